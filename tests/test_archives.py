@@ -0,0 +1,51 @@
+"""Runs tests on ingesting uploaded archives."""
+
+import io
+import tarfile
+import zipfile
+from typing import Literal
+
+import pytest
+from fastapi import UploadFile
+
+from www.app.crud.artifacts import iter_normalized_archive
+from www.app.errors import BadArtifactError
+from www.app.utils.workers import process_pool
+
+
+def make_tgz(files: dict[str, bytes]) -> bytes:
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode="w:gz") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+
+async def normalize(data: bytes, artifact_type: Literal["tgz", "zip"]) -> list[str]:
+    file = UploadFile(io.BytesIO(data), filename=f"archive.{artifact_type}")
+    return [subname async for _, subname in iter_normalized_archive(file, artifact_type)]
+
+
+async def test_bad_archives() -> None:
+    urdf = b"<robot name='test'></robot>"
+    try:
+        assert await normalize(make_tgz({"robot.urdf": urdf}), "tgz") == ["robot.urdf"]
+
+        # Files which fail to parse in the worker are bad artifacts, not server errors.
+        with pytest.raises(BadArtifactError, match="bad.png"):
+            await normalize(make_tgz({"robot.urdf": urdf, "bad.png": b"not an image"}), "tgz")
+
+        # So are archives which can't be read at all.
+        with pytest.raises(BadArtifactError, match="Invalid archive"):
+            await normalize(make_tgz({"robot.urdf": urdf})[:20], "tgz")
+        with pytest.raises(BadArtifactError, match="Invalid archive"):
+            await normalize(b"not a zip file", "zip")
+
+        zip_data = io.BytesIO()
+        with zipfile.ZipFile(zip_data, "w") as archive:
+            archive.writestr("robot.urdf", urdf)
+        assert await normalize(zip_data.getvalue(), "zip") == ["robot.urdf"]
+    finally:
+        process_pool.close()
@@ -0,0 +1,84 @@
+"""Runs tests on processing staged artifact uploads in background jobs."""
+
+import io
+
+import pytest
+import trimesh
+from aiobotocore.response import StreamingBody
+from botocore.exceptions import ClientError
+from fastapi import UploadFile
+
+from www.app.db import Crud, create_tables
+from www.app.model import ArtifactType, Listing, get_staging_name
+from www.app.routers.artifacts import PROCESS_ARTIFACT_JOB
+from www.app.utils.jobs import Job, job_runner
+from www.settings import settings
+from www.utils import new_uuid
+
+
+async def run_artifact_job(name: str, data: bytes, artifact_type: ArtifactType) -> tuple[Job, str]:
+    async with Crud() as crud:
+        await create_tables(crud)
+        listing = Listing.create(user_id=new_uuid(), name="robot", slug=new_uuid(), child_ids=[])
+        await crud.add_listing(listing)
+        file = UploadFile(file=io.BytesIO(data), filename=name)
+        pending = await crud.create_pending_artifact(name, file, listing, artifact_type)
+
+    await job_runner.start()
+    try:
+        payload = {"artifact_id": pending.id, "name": name, "artifact_type": artifact_type}
+        job = await job_runner.submit(PROCESS_ARTIFACT_JOB, payload, user_id="user")
+        statuses = [job.status async for job in job_runner.watch(job.id)]
+        done = await job_runner.get(job.id)
+        assert done is not None and done.status == statuses[-1]
+        return done, pending.id
+    finally:
+        await job_runner.close()
+
+
+async def test_artifact_job_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.jobs, "backend", "memory")
+    monkeypatch.setattr(settings.jobs, "poll_seconds", 0.01)
+    monkeypatch.setattr(settings.jobs, "retry_seconds", 0.01)
+
+    # The first download of the staged upload is throttled.
+    download_from_s3 = Crud._download_from_s3
+    num_downloads = 0
+
+    async def flaky_download_from_s3(self: Crud, filename: str) -> StreamingBody:
+        nonlocal num_downloads
+        num_downloads += 1
+        if num_downloads == 1:
+            raise ClientError({"Error": {"Code": "SlowDown", "Message": "Reduce your request rate"}}, "GetObject")
+        return await download_from_s3(self, filename)
+
+    monkeypatch.setattr(Crud, "_download_from_s3", flaky_download_from_s3)
+
+    data = io.BytesIO()
+    trimesh.creation.box().export(data, file_type="stl")
+    job, artifact_id = await run_artifact_job("box.stl", data.getvalue(), "stl")
+    assert job.status == "succeeded", job.error
+    assert job.attempts == 2
+    assert job.error is None
+    assert num_downloads == 2
+
+    async with Crud() as crud:
+        artifact = await crud.get_raw_artifact(artifact_id)
+        assert artifact is not None and artifact.status == "ready"
+        assert await crud._head_object(get_staging_name(artifact_id, "box.stl")) is None
+
+
+async def test_artifact_job_bad_upload(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.jobs, "backend", "memory")
+    monkeypatch.setattr(settings.jobs, "poll_seconds", 0.01)
+    monkeypatch.setattr(settings.jobs, "retry_seconds", 0.01)
+
+    # Invalid uploads fail on the first attempt, and the staged upload is removed.
+    job, artifact_id = await run_artifact_job("robot.urdf", b"<robot", "urdf")
+    assert job.status == "failed"
+    assert job.attempts == 1
+
+    async with Crud() as crud:
+        artifact = await crud.get_raw_artifact(artifact_id)
+        assert artifact is not None and artifact.status == "failed"
+        assert await crud._head_object(get_staging_name(artifact_id, "robot.urdf")) is None
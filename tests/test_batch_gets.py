@@ -0,0 +1,52 @@
+"""Runs tests on batched DynamoDB reads."""
+
+from typing import Any
+
+import pytest
+from pytest_mock.plugin import MockerFixture
+
+from www.app.crud.base import TABLE_NAME
+from www.app.db import Crud, create_tables
+from www.app.errors import InternalError
+from www.app.model import KRec
+from www.settings import settings
+
+
+async def test_batch_get_items(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(settings.dynamo, "batch_retry_seconds", 0.0)
+
+    async with Crud() as crud:
+        await create_tables(crud)
+        krecs = [KRec.create("user", "robot", f"{i}.krec", description="description") for i in range(5)]
+        await crud._batch_write_items(puts=krecs)
+
+        # Only reads the first key of each call, like a throttled table, and
+        # leaves the rest unprocessed.
+        batch_get_item = crud.db.batch_get_item
+        requested: list[list[str]] = []
+
+        async def throttled_batch_get_item(**kwargs: Any) -> dict[str, Any]:  # noqa: ANN401
+            request = kwargs["RequestItems"][TABLE_NAME]
+            first, *rest = request["Keys"]
+            requested.append([key["id"] for key in request["Keys"]])
+            response: dict[str, Any] = dict(
+                await batch_get_item(RequestItems={TABLE_NAME: {**request, "Keys": [first]}})
+            )
+            if rest:
+                response["UnprocessedKeys"] = {TABLE_NAME: {**request, "Keys": rest}}
+            return response
+
+        mocker.patch.object(crud.db, "batch_get_item", side_effect=throttled_batch_get_item)
+
+        # Repeated IDs are read once, and missing IDs are left out.
+        ids = [krec.id for krec in krecs]
+        items = await crud._batch_get_items([*ids, ids[0], "missing"], attributes=["name"], chunk_size=3)
+        assert set(items) == set(ids)
+        assert all(set(item) == {"id", "name"} for item in items.values())
+        assert sorted(map(len, requested)) == [1, 1, 2, 2, 3, 3]
+        assert sorted(key for keys in requested for key in keys).count(ids[0]) == 1
+
+        # Keys which are still unprocessed after the last attempt are an error.
+        monkeypatch.setattr(settings.dynamo, "batch_max_attempts", 1)
+        with pytest.raises(InternalError):
+            await crud._batch_get_items(ids)
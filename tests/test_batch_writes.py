@@ -0,0 +1,52 @@
+"""Runs tests on batched DynamoDB writes."""
+
+from typing import Any
+
+import pytest
+from pytest_mock.plugin import MockerFixture
+
+from www.app.crud import base
+from www.app.crud.base import TABLE_NAME
+from www.app.db import Crud, create_tables
+from www.app.errors import InternalError
+from www.app.model import KRec
+from www.settings import settings
+
+
+async def test_batch_write_items(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(settings.dynamo, "batch_retry_seconds", 0.0)
+    monkeypatch.setattr(base, "DYNAMO_WRITE_BATCH_SIZE", 2)
+
+    async with Crud() as crud:
+        await create_tables(crud)
+
+        # Only writes the first item of each call, like a throttled table,
+        # and leaves the rest unprocessed.
+        batch_write_item = crud.db.batch_write_item
+        requested: list[int] = []
+
+        async def throttled_batch_write_item(**kwargs: Any) -> dict[str, Any]:  # noqa: ANN401
+            first, *rest = kwargs["RequestItems"][TABLE_NAME]
+            requested.append(1 + len(rest))
+            await batch_write_item(RequestItems={TABLE_NAME: [first]})
+            return {"UnprocessedItems": {TABLE_NAME: rest} if rest else {}}
+
+        mocker.patch.object(crud.db, "batch_write_item", side_effect=throttled_batch_write_item)
+
+        krecs = [KRec.create("user", "robot", f"{i}.krec") for i in range(3)]
+        await crud._batch_write_items(puts=krecs)
+        assert sorted(requested) == [1, 1, 2]
+        assert [krec.id for krec in await crud._get_item_batch([krec.id for krec in krecs], KRec)] == [
+            krec.id for krec in krecs
+        ]
+
+        # A later write to the same key wins, so the put is dropped.
+        requested.clear()
+        await crud._batch_write_items(puts=[krecs[0]], deletes=[krecs[0], krecs[1].id])
+        assert sorted(requested) == [1, 2]
+        assert [krec.id for krec in await crud._get_item_batch([krec.id for krec in krecs], KRec)] == [krecs[2].id]
+
+        # Items which are still unprocessed after the last attempt are an error.
+        monkeypatch.setattr(settings.dynamo, "batch_max_attempts", 1)
+        with pytest.raises(InternalError):
+            await crud._delete_items([krecs[2], "missing"])
@@ -0,0 +1,65 @@
+"""Runs tests on content-addressed blob storage."""
+
+import asyncio
+import io
+import time
+from typing import Any
+
+from www.app.crud.base import TABLE_NAME
+from www.app.db import Crud, create_tables
+from www.app.model import get_blob_name
+
+
+async def get_row(crud: Crud, content_hash: str) -> dict[str, Any] | None:
+    table = await crud.db.Table(TABLE_NAME)
+    return (await table.get_item(Key={"id": content_hash}, ConsistentRead=True)).get("Item")
+
+
+async def mark_deleting(crud: Crud, content_hash: str, deleting_at: int) -> None:
+    table = await crud.db.Table(TABLE_NAME)
+    await table.update_item(
+        Key={"id": content_hash},
+        UpdateExpression="SET ref_count = :zero, deleting_at = :at",
+        ExpressionAttributeValues={":zero": 0, ":at": deleting_at},
+    )
+
+
+async def test_blob_reference_counting() -> None:
+    async with Crud() as crud:
+        await create_tables(crud)
+
+        _, content_hash = await crud._store_blob(io.BytesIO(b"content"), "a.bin", "application/octet-stream")
+        assert await crud._store_blob(io.BytesIO(b"content"), "b.bin", "application/octet-stream") == (7, content_hash)
+        assert (row := await get_row(crud, content_hash)) is not None and row["ref_count"] == 2
+
+        await crud._release_blob(content_hash)
+        assert await crud._head_object(get_blob_name(content_hash)) is not None
+        await crud._release_blob(content_hash)
+        assert await get_row(crud, content_hash) is None
+        assert await crud._head_object(get_blob_name(content_hash)) is None
+
+
+async def test_store_waits_for_blob_deletion() -> None:
+    async with Crud() as crud:
+        await create_tables(crud)
+
+        # An upload which finds a tombstone waits for the deletion to finish,
+        # then uploads the content again, rather than reusing the doomed row.
+        _, content_hash = await crud._store_blob(io.BytesIO(b"content"), "a.bin", "application/octet-stream")
+        deleting_at = int(time.time())
+        await mark_deleting(crud, content_hash, deleting_at)
+        store = asyncio.create_task(crud._store_blob(io.BytesIO(b"content"), "b.bin", "application/octet-stream"))
+        await asyncio.sleep(0.3)
+        assert not store.done()
+        await crud._finish_blob_deletion(content_hash, deleting_at)
+        assert await store == (7, content_hash)
+        assert (row := await get_row(crud, content_hash)) is not None
+        assert row["ref_count"] == 1 and "deleting_at" not in row
+        assert await crud._head_object(get_blob_name(content_hash)) is not None
+
+        # If the deleter died part way through, the upload finishes the deletion itself.
+        await mark_deleting(crud, content_hash, int(time.time()) - 3600)
+        await crud._store_blob(io.BytesIO(b"content"), "c.bin", "application/octet-stream")
+        assert (row := await get_row(crud, content_hash)) is not None
+        assert row["ref_count"] == 1 and "deleting_at" not in row
+        assert await crud._head_object(get_blob_name(content_hash)) is not None
@@ -0,0 +1,55 @@
+"""Runs tests on the cache metrics registry and endpoints."""
+
+import asyncio
+
+from fastapi import status
+from fastapi.testclient import TestClient
+
+from www.app.db import Crud
+from www.utils import LRUCache, get_cache_metrics, render_cache_metrics
+
+
+def test_cache_metrics() -> None:
+    cache = LRUCache[int, str](1, name="test")
+    cache.put(1, "one")
+    cache.get(1)
+    cache.get(2)
+    cache.put(2, "two")
+    metrics = get_cache_metrics()["test"]
+    assert (metrics["size"], metrics["hits"], metrics["misses"], metrics["evictions"]) == (1, 1, 1, 1)
+    assert 'www_cache_hits_total{cache="test"} 1' in render_cache_metrics().splitlines()
+
+
+def test_cache_metrics_endpoints(test_client: TestClient) -> None:
+    cache = LRUCache[int, str](1, name="endpoint_test")
+    cache.put(1, "one")
+    cache.get(1)
+
+    response = test_client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert 'www_cache_hits_total{cache="endpoint_test"} 1' in response.text.splitlines()
+
+    # The JSON view is only available to administrators.
+    response = test_client.get("/metrics/caches")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED, response.json()
+
+    response = test_client.post("/auth/github/code", json={"code": "test_code"})
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    auth_headers = {"Authorization": f"Bearer {response.json()['api_key']}"}
+
+    response = test_client.get("/metrics/caches", headers=auth_headers)
+    assert response.status_code == status.HTTP_403_FORBIDDEN, response.json()
+
+    async def make_admin() -> None:
+        async with Crud() as crud:
+            user = await crud.get_user_from_email("dchen@kscale.dev")
+            assert user is not None
+            await crud.update_user(user.id, {"permissions": ["is_admin"]})
+
+    asyncio.run(make_admin())
+
+    response = test_client.get("/metrics/caches", headers=auth_headers)
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    caches = {cache["name"]: cache for cache in response.json()["caches"]}
+    assert caches["endpoint_test"]["hits"] == 1
+    assert caches["endpoint_test"]["hit_rate"] == 1.0
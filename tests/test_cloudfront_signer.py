@@ -0,0 +1,51 @@
+"""Runs tests on signing CloudFront URLs."""
+
+import base64
+import json
+from urllib.parse import parse_qs, urlparse
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from pytest_mock.plugin import MockerFixture
+
+from www.app.utils.cloudfront_signer import CloudFrontUrlSigner
+
+
+def _url_b64decode(data: str) -> bytes:
+    return base64.b64decode(data.replace("-", "+").replace("_", "=").replace("~", "/"))
+
+
+def test_cloudfront_signer(mocker: MockerFixture) -> None:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    signer = CloudFrontUrlSigner("KEY", pem, cache_size=8)
+    sign = mocker.spy(signer, "generate_presigned_url")
+    mock_time = mocker.patch("www.app.utils.cloudfront_signer.time.time", return_value=1000.0)
+
+    # Signatures are reused within an expiration bucket.
+    url, expires_at = signer.sign_url("https://cdn.test/a.png", expire_days=1, bucket_seconds=3600)
+    assert expires_at == 90000
+    assert signer.sign_url("https://cdn.test/a.png", expire_days=1, bucket_seconds=3600) == (url, expires_at)
+    assert sign.call_count == 1
+    assert signer._url_cache is not None and signer._url_cache.stats.hits == 1
+    policy = json.loads(_url_b64decode(parse_qs(urlparse(url).query)["Policy"][0]))
+    assert policy["Statement"][0]["Condition"]["DateLessThan"]["AWS:EpochTime"] == expires_at
+
+    # Moving into the next bucket signs again, with the later expiration.
+    mock_time.return_value = 5000.0
+    new_url, new_expires_at = signer.sign_url("https://cdn.test/a.png", expire_days=1, bucket_seconds=3600)
+    assert new_url != url
+    assert new_expires_at == 93600
+    assert sign.call_count == 2
+
+    # Prefix signatures cover every URL under the prefix, and verify against the public key.
+    query, _ = signer.sign_prefix("https://cdn.test/listing/", expire_days=1, bucket_seconds=3600)
+    params = parse_qs(query)
+    policy_bytes = _url_b64decode(params["Policy"][0])
+    assert json.loads(policy_bytes)["Statement"][0]["Resource"] == "https://cdn.test/listing/*"
+    key.public_key().verify(_url_b64decode(params["Signature"][0]), policy_bytes, padding.PKCS1v15(), hashes.SHA1())
+    assert params["Key-Pair-Id"] == ["KEY"]
@@ -49,6 +49,7 @@ def test_user_auth_functions(test_client: TestClient, tmpdir: Path) -> None:
     assert response.status_code == status.HTTP_200_OK, response.json()
     data = response.json()
     assert data["artifacts"] is not None
+    assert data["artifacts"][0]["size"] > 0
     listing_id = data["artifacts"][0]["listing_id"]
     name = data["artifacts"][0]["name"]
 
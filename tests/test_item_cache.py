@@ -0,0 +1,62 @@
+"""Runs tests on the cross-request item cache."""
+
+import time
+from pathlib import Path
+
+from www.app.db import Crud, create_tables
+from www.app.model import Listing
+from www.app.utils.itemcache import ItemCache, SQLiteItemCacheBackend
+from www.utils import new_uuid
+
+
+async def test_item_cache_invalidation(tmpdir: Path) -> None:
+    # Two caches sharing a SQLite file stand in for two worker processes.
+    path = Path(tmpdir) / "cache.sqlite3"
+    first, second = (
+        ItemCache({"User": 60.0}, capacity=10, max_bytes=10_000, local_ttl=60.0, backend=SQLiteItemCacheBackend(path))
+        for _ in range(2)
+    )
+    try:
+        item = {"id": "a", "type": "User", "name": "old"}
+
+        # Items which are written by one worker are shared with the other.
+        await first.put_many({"a": item}, time.time())
+        assert await second.get_many(["a"]) == {"a": item}
+
+        # Types without a TTL aren't cached.
+        await first.put_many({"b": {"id": "b", "type": "Artifact"}}, time.time())
+        assert await second.get_many(["b"]) == {}
+
+        # A read which started before another worker's write isn't cached,
+        # in either the writing worker or the shared backend.
+        read_at = time.time()
+        await second.invalidate(["a"])
+        second.clear()
+        await first.put_many({"a": item}, read_at)
+        first.clear()
+        assert await second.get_many(["a"]) == {}
+        assert await first.get_many(["a"]) == {}
+
+        # Reads which started after the write are cached again.
+        new_item = {**item, "name": "new"}
+        await first.put_many({"a": new_item}, time.time())
+        assert await second.get_many(["a"]) == {"a": new_item}
+
+    finally:
+        await first.close()
+        await second.close()
+
+
+async def test_view_count_invalidates_listing() -> None:
+    async with Crud() as crud:
+        await create_tables(crud)
+        listing = Listing.create(user_id=new_uuid(), name="robot", slug=new_uuid(), child_ids=[])
+        await crud.add_listing(listing)
+
+        # Reads the listing into the cache, then counts a view.
+        cached = await crud.get_listing(listing.id)
+        assert cached is not None and cached.views == 0
+        await crud.increment_view_count(cached)
+
+        viewed = await crud.get_listing(listing.id)
+        assert viewed is not None and viewed.views == 1
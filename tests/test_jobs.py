@@ -0,0 +1,186 @@
+"""Runs tests on the background job queue."""
+
+import asyncio
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from www.app.utils.jobs import Job, JobQueue, JobRunner, MemoryJobQueue, SQLiteJobQueue
+from www.settings import settings
+
+
+async def test_job_runner(tmpdir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.jobs, "backend", "sqlite")
+    monkeypatch.setattr(settings.jobs, "sqlite_path", str(Path(tmpdir) / "jobs.sqlite3"))
+
+    failed_payloads: list[dict[str, Any]] = []
+
+    async def double(payload: dict[str, Any]) -> dict[str, Any]:
+        if payload["value"] < 0:
+            raise ValueError("Negative value")
+        return {"value": payload["value"] * 2}
+
+    async def on_failure(payload: dict[str, Any]) -> None:
+        failed_payloads.append(payload)
+
+    runner = JobRunner()
+    runner.register("double", double, on_failure=on_failure, permanent_errors=(ValueError,))
+    await runner.start()
+    try:
+        ok_job = await runner.submit("double", {"value": 21}, user_id="user")
+        bad_job = await runner.submit("double", {"value": -1}, user_id="user")
+
+        statuses = [job.status async for job in runner.watch(ok_job.id)]
+        assert statuses[-1] == "succeeded"
+        ok_job_done = await runner.get(ok_job.id)
+        assert ok_job_done is not None
+        assert ok_job_done.result == {"value": 42}
+        assert ok_job_done.user_id == "user"
+        assert ok_job_done.lease_expires_at is None
+
+        statuses = [job.status async for job in runner.watch(bad_job.id)]
+        assert statuses[-1] == "failed"
+        bad_job_done = await runner.get(bad_job.id)
+        assert bad_job_done is not None
+        assert bad_job_done.error == "Negative value"
+        assert failed_payloads == [{"value": -1}]
+
+    finally:
+        await runner.close()
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+async def test_job_leases(backend: str, tmpdir: Path) -> None:
+    queue: JobQueue = MemoryJobQueue() if backend == "memory" else SQLiteJobQueue(Path(tmpdir) / "jobs.sqlite3")
+    try:
+        await queue.put(Job.create("kind", {}))
+
+        first = await queue.claim(0.05)
+        assert first is not None
+        assert first.status == "running"
+        assert first.attempts == 1
+
+        # The job is leased, so it can't be claimed again until the lease expires.
+        assert await queue.claim(0.05) is None
+        assert await queue.renew(first, 0.05)
+
+        await asyncio.sleep(0.1)
+        second = await queue.claim(60.0)
+        assert second is not None
+        assert second.id == first.id
+        assert second.attempts == 2
+        assert second.lease_id != first.lease_id
+
+        # The first worker lost its lease, so it can't renew or finish the job.
+        assert not await queue.renew(first, 60.0)
+        first.status = "succeeded"
+        assert not await queue.update(first)
+
+        second.status, second.result = "succeeded", {"ok": True}
+        assert await queue.update(second)
+        done = await queue.get(second.id)
+        assert done is not None
+        assert done.status == "succeeded"
+        assert done.result == {"ok": True}
+
+        # Only finished jobs are pruned.
+        await queue.put(Job.create("kind", {}))
+        assert await queue.prune(time.time() + 1) == 1
+        assert await queue.get(second.id) is None
+
+        # Jobs queued for a retry can't be claimed until their retry time.
+        retried = await queue.claim(60.0)
+        assert retried is not None
+        retried.status, retried.lease_expires_at = "queued", time.time() + 0.05
+        assert await queue.update(retried)
+        assert await queue.claim(60.0) is None
+        await asyncio.sleep(0.1)
+        reclaimed = await queue.claim(60.0)
+        assert reclaimed is not None
+        assert (reclaimed.id, reclaimed.attempts) == (retried.id, 2)
+
+    finally:
+        await queue.close()
+
+
+async def test_job_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.jobs, "backend", "memory")
+    monkeypatch.setattr(settings.jobs, "poll_seconds", 0.01)
+    monkeypatch.setattr(settings.jobs, "retry_seconds", 0.05)
+    monkeypatch.setattr(settings.jobs, "max_attempts", 3)
+
+    num_calls: dict[str, int] = {}
+    failed_payloads: list[dict[str, Any]] = []
+
+    async def flaky(payload: dict[str, Any]) -> dict[str, Any]:
+        num_calls[payload["name"]] = num_calls.get(payload["name"], 0) + 1
+        if num_calls[payload["name"]] <= payload["failures"]:
+            raise RuntimeError(f"Failure {num_calls[payload['name']]}")
+        return {"calls": num_calls[payload["name"]]}
+
+    async def on_failure(payload: dict[str, Any]) -> None:
+        failed_payloads.append(payload)
+
+    runner = JobRunner()
+    runner.register("flaky", flaky, on_failure=on_failure)
+    await runner.start()
+    try:
+        # Errors are retried after an exponential backoff.
+        start = time.time()
+        job = await runner.submit("flaky", {"name": "recovers", "failures": 2})
+        statuses = [job.status async for job in runner.watch(job.id)]
+        assert statuses[-1] == "succeeded"
+        assert time.time() - start >= 0.05 + 0.1
+        done = await runner.get(job.id)
+        assert done is not None
+        assert (done.attempts, done.result, done.error) == (3, {"calls": 3}, None)
+        assert failed_payloads == []
+
+        # Jobs which keep failing fail for good after the last attempt.
+        job = await runner.submit("flaky", {"name": "fails", "failures": 3})
+        statuses = [job.status async for job in runner.watch(job.id)]
+        assert statuses[-1] == "failed"
+        done = await runner.get(job.id)
+        assert done is not None
+        assert (done.attempts, done.error) == (3, "Failure 3")
+        assert failed_payloads == [{"name": "fails", "failures": 3}]
+
+    finally:
+        await runner.close()
+
+
+async def test_interrupted_job_fails(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.jobs, "backend", "memory")
+    monkeypatch.setattr(settings.jobs, "max_attempts", 2)
+
+    failed_payloads: list[dict[str, Any]] = []
+
+    async def handler(payload: dict[str, Any]) -> dict[str, Any]:
+        raise AssertionError("Should not run")
+
+    async def on_failure(payload: dict[str, Any]) -> None:
+        failed_payloads.append(payload)
+
+    runner = JobRunner()
+    runner.register("kind", handler, on_failure=on_failure)
+
+    # Simulates a job whose workers died mid-run on every attempt.
+    job = Job.create("kind", {"value": 1})
+    job.claim(0.0)
+    job.attempts = settings.jobs.max_attempts
+    await runner.queue.put(job)
+
+    await runner.start()
+    try:
+        statuses = [job.status async for job in runner.watch(job.id)]
+        assert statuses[-1] == "failed"
+        done = await runner.get(job.id)
+        assert done is not None
+        assert done.attempts == settings.jobs.max_attempts + 1
+        assert done.error is not None and "interrupted" in done.error
+        assert failed_payloads == [{"value": 1}]
+
+    finally:
+        await runner.close()
@@ -0,0 +1,136 @@
+"""Runs tests on the presigned multipart upload APIs."""
+
+import base64
+import hashlib
+
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import status
+from fastapi.testclient import TestClient
+from pytest_mock.plugin import MockerFixture
+
+from www.app.db import Crud
+from www.app.model import KRec
+from www.settings import settings
+
+PART_SIZES = [5 * 1024 * 1024, 1024]
+
+
+def create_krec(test_client: TestClient, auth_headers: dict[str, str], robot_id: str) -> tuple[str, str]:
+    response = test_client.post(
+        "/krecs/multipart",
+        json={"name": "test.krec", "robot_id": robot_id},
+        headers=auth_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    data = response.json()
+    return data["krec_id"], data["upload_id"]
+
+
+async def test_krec_multipart_upload(test_client: TestClient) -> None:
+    response = test_client.post("/auth/github/code", json={"code": "test_code"})
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    auth_headers = {"Authorization": f"Bearer {response.json()['api_key']}"}
+
+    response = test_client.post(
+        "/listings/add",
+        data={"name": "test listing", "description": "test", "child_ids": "", "slug": "test", "username": "testuser"},
+        headers=auth_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    response = test_client.post(
+        "/robots/create",
+        json={"listing_id": response.json()["listing_id"], "name": "test_robot", "description": "test"},
+        headers=auth_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    robot_id = response.json()["robot_id"]
+
+    krec_id, upload_id = create_krec(test_client, auth_headers, robot_id)
+
+    response = test_client.post(
+        f"/krecs/multipart/{krec_id}/parts",
+        json={"upload_id": upload_id, "parts": [{"part_number": n} for n in range(1, len(PART_SIZES) + 1)]},
+        headers=auth_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    assert [url["part_number"] for url in response.json()["urls"]] == [1, 2]
+
+    # Uploads the parts the way a client would with the presigned URLs.
+    parts = [bytes([n]) * size for n, size in enumerate(PART_SIZES)]
+    async with Crud() as crud:
+        for part_number, part in enumerate(parts, 1):
+            await crud.s3.meta.client.upload_part(
+                Bucket=settings.s3.bucket,
+                Key=f"{settings.s3.prefix}krecs/{krec_id}/test.krec",
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=part,
+                ChecksumSHA256=base64.b64encode(hashlib.sha256(part).digest()).decode(),
+            )
+
+    response = test_client.get(
+        f"/krecs/multipart/{krec_id}/parts",
+        params={"upload_id": upload_id},
+        headers=auth_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    uploaded_parts = response.json()["parts"]
+    assert [part["part_number"] for part in uploaded_parts] == [1, 2]
+
+    response = test_client.post(
+        f"/krecs/multipart/{krec_id}/complete",
+        json={"upload_id": upload_id, "parts": uploaded_parts},
+        headers=auth_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK, response.json()
+    assert response.json()["status"] == "ready"
+    assert response.json()["size"] == sum(PART_SIZES)
+
+    # Finished uploads can't be written to again.
+    response = test_client.post(
+        f"/krecs/multipart/{krec_id}/complete",
+        json={"upload_id": upload_id, "parts": uploaded_parts},
+        headers=auth_headers,
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST, response.json()
+
+    # Aborting an upload which doesn't exist is a 404.
+    krec_id, _ = create_krec(test_client, auth_headers, robot_id)
+    response = test_client.post(
+        f"/krecs/multipart/{krec_id}/abort",
+        json={"upload_id": "missing"},
+        headers=auth_headers,
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND, response.json()
+
+
+async def test_complete_multipart_upload_errors(mocker: MockerFixture) -> None:
+    async with Crud() as crud:
+        # S3 rejects parts without checksums, since the upload was created
+        # with a SHA-256 checksum; the client has to send them.
+        error = ClientError(
+            {"Error": {"Code": "InvalidRequest", "Message": "The upload was created using a sha256 checksum"}},
+            "CompleteMultipartUpload",
+        )
+        mocker.patch.object(crud.s3.meta.client, "complete_multipart_upload", side_effect=error)
+        with pytest.raises(ValueError, match="sha256 checksum"):
+            await crud.complete_multipart_upload("key", "upload", [{"PartNumber": 1, "ETag": "etag"}])
+
+
+async def test_finalize_multipart_krec(mocker: MockerFixture) -> None:
+    async with Crud() as crud:
+        krec = KRec.create("user", "robot", "test.krec", status="processing")
+
+        # Multipart uploads have a checksum of the part checksums, which isn't
+        # the checksum of the content, so it isn't stored.
+        head = {"ContentLength": 10, "ChecksumSHA256": "Y2hlY2tzdW0=-2"}
+        mocker.patch.object(crud, "_head_object", return_value=head)
+        mocker.patch.object(crud, "_update_item")
+        finalized = await crud.finalize_krec_upload(krec)
+        assert finalized.status == "ready"
+        assert finalized.checksum is None
+
+        head["ChecksumSHA256"] = "Y2hlY2tzdW0="
+        finalized = await crud.finalize_krec_upload(krec)
+        assert finalized.checksum == "Y2hlY2tzdW0="
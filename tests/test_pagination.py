@@ -0,0 +1,36 @@
+"""Runs tests on paginating listings with cursors."""
+
+import pytest
+
+from www.app.crud.base import encode_cursor
+from www.app.crud.listings import SortOption
+from www.app.db import Crud, create_tables
+from www.app.model import Listing
+
+
+async def test_invalid_cursors() -> None:
+    async with Crud() as crud:
+        await create_tables(crud)
+        crud.PAGE_SIZE = 2
+        for i in range(3):
+            await crud.add_listing(Listing.create(user_id="user", name=f"robot {i}", slug=f"robot-{i}", child_ids=[]))
+
+        newest, newest_cursor = await crud.get_user_listings("user", sort_by=SortOption.NEWEST)
+        viewed, viewed_cursor = await crud.get_user_listings("user", sort_by=SortOption.MOST_VIEWED)
+        assert len(newest) == len(viewed) == 2
+        assert newest_cursor is not None and viewed_cursor is not None
+        assert len((await crud.get_user_listings("user", sort_by=SortOption.MOST_VIEWED, cursor=viewed_cursor))[0]) == 1
+
+        # Cursors from another sort order, another user or another endpoint
+        # are rejected as invalid requests, rather than failing the lookup.
+        bad_cursors = [newest_cursor, encode_cursor({}), encode_cursor({"offset": "1"}), encode_cursor({"offset": -1})]
+        for cursor in bad_cursors:
+            with pytest.raises(ValueError, match="Invalid pagination cursor"):
+                await crud.get_user_listings("user", sort_by=SortOption.MOST_VIEWED, cursor=cursor)
+            with pytest.raises(ValueError, match="Invalid pagination cursor"):
+                await crud.get_listings(search_query="robot", cursor=cursor)
+        for cursor in [viewed_cursor, "not base64!", encode_cursor({"id": "x", "user_id": "user"})]:
+            with pytest.raises(ValueError, match="Invalid pagination cursor"):
+                await crud.get_user_listings("user", sort_by=SortOption.NEWEST, cursor=cursor)
+        with pytest.raises(ValueError, match="Invalid pagination cursor"):
+            await crud.get_user_listings("other", sort_by=SortOption.NEWEST, cursor=newest_cursor)
@@ -0,0 +1,85 @@
+"""Runs tests on resolving API keys to their users."""
+
+import time
+from pathlib import Path
+
+from www.app.crud.users import PrincipalCache
+from www.app.db import Crud, create_tables
+from www.app.model import APIKey, User
+from www.app.security.user import maybe_get_user_from_api_key
+from www.app.utils.itemcache import SQLiteItemCacheBackend
+
+
+async def test_principal_cache() -> None:
+    user = User.create(email="test@example.com", username="test")
+    api_key = APIKey.create(user_id=user.id, source="user", permissions="full")
+    cache = PrincipalCache(ttl=60, negative_ttl=60, capacity=3)
+    assert await cache.get(api_key.id) == (False, None)
+    cache.put(api_key.id, (api_key, user), time.time())
+    assert await cache.get(api_key.id) == (True, (api_key, user))
+    cache.put("missing", None, time.time())
+    assert await cache.get("missing") == (True, None)
+    await cache.invalidate_user(user.id)
+    assert await cache.get(api_key.id) == (False, None)
+    assert await cache.get("missing") == (True, None)
+    cache.put(api_key.id, (api_key, user), time.time())
+    await cache.invalidate(api_key.id)
+    assert await cache.get(api_key.id) == (False, None)
+    assert user.id not in cache.user_keys
+
+    # Lookups which started before an invalidation aren't cached.
+    read_at = time.time()
+    await cache.invalidate(api_key.id)
+    cache.put(api_key.id, (api_key, user), read_at)
+    assert await cache.get(api_key.id) == (False, None)
+    read_at = time.time()
+    await cache.invalidate_user(user.id)
+    cache.put(api_key.id, (api_key, user), read_at)
+    assert await cache.get(api_key.id) == (False, None)
+
+
+async def test_shared_principal_invalidations(tmp_path: Path) -> None:
+    user = User.create(email="test@example.com", username="test")
+    api_key = APIKey.create(user_id=user.id, source="user", permissions="full")
+    other_key = APIKey.create(user_id=user.id, source="user", permissions="full")
+
+    # Each cache stands in for a worker process, with its own connection.
+    backends = [SQLiteItemCacheBackend(tmp_path / "cache.sqlite3") for _ in range(2)]
+    caches = [PrincipalCache(ttl=60, negative_ttl=60, capacity=8, backend=backend) for backend in backends]
+    try:
+        for cache in caches:
+            cache.put(api_key.id, (api_key, user), time.time())
+            cache.put(other_key.id, (other_key, user), time.time())
+
+        # A key revoked by one process is rejected by the other.
+        await caches[0].invalidate(api_key.id)
+        assert await caches[1].get(api_key.id) == (False, None)
+        assert await caches[1].get(other_key.id) == (True, (other_key, user))
+
+        # So is every key of a user whose permissions changed.
+        await caches[0].invalidate_user(user.id)
+        assert await caches[1].get(other_key.id) == (False, None)
+
+        # Lookups made after the invalidation are cached again.
+        caches[1].put(other_key.id, (other_key, user), time.time())
+        assert await caches[1].get(other_key.id) == (True, (other_key, user))
+    finally:
+        for backend in backends:
+            await backend.close()
+
+
+async def test_optional_auth_with_missing_user() -> None:
+    async with Crud() as crud:
+        await create_tables(crud)
+
+        user = User.create(email="test@example.com", username="test")
+        await crud._add_item(user)
+        api_key = await crud.add_api_key(user.id, source="user", permissions="full")
+        assert await maybe_get_user_from_api_key(crud, api_key.id) == user
+
+        # A key whose user was deleted is treated as anonymous, not as an error.
+        orphan_key = APIKey.create(user_id="missing", source="user", permissions="full")
+        await crud._add_item(orphan_key)
+        assert await maybe_get_user_from_api_key(crud, orphan_key.id) is None
+        assert await maybe_get_user_from_api_key(crud, "missing") is None
+        assert await maybe_get_user_from_api_key(crud, None) is None
@@ -0,0 +1,62 @@
+"""Runs tests on reconciling the table against the bucket."""
+
+import io
+import logging
+from pathlib import Path
+
+import pytest
+
+from www.app.crud import reconcile
+from www.app.db import Crud, create_tables
+from www.app.model import KRec, get_krec_name
+from www.settings import settings
+from www.utils import new_uuid
+
+
+async def test_reconcile_storage(
+    tmpdir: Path, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    # The mocked bucket is shared between tests, so this test uses its own prefix.
+    monkeypatch.setattr(settings.s3, "prefix", f"reconcile-{new_uuid()}/")
+    monkeypatch.setattr(settings.reconcile, "grace_seconds", -60)
+    monkeypatch.setattr(settings.reconcile, "requests_per_second", None)
+    monkeypatch.setattr(reconcile, "S3_DELETE_BATCH_SIZE", 2)
+    checkpoint = Path(tmpdir) / "checkpoint.json"
+
+    async with Crud() as crud:
+        await create_tables(crud)
+
+        uploaded = KRec.create("user", "robot", "uploaded.krec")
+        missing = KRec.create("user", "robot", "missing.krec")
+        pending = KRec.create("user", "robot", "pending.krec", status="processing")
+        for krec in (uploaded, missing, pending):
+            await crud._add_item(krec)
+
+        async def upload(name: str) -> None:
+            await crud._upload_to_s3(io.BytesIO(b"data"), name, name, "application/octet-stream")
+
+        async def exists(name: str) -> bool:
+            return await crud._head_object(name) is not None
+
+        orphans = [f"orphans/{i}.bin" for i in range(3)]
+        for name in [get_krec_name(uploaded), *orphans]:
+            await upload(name)
+
+        # Orphans are only reported unless deletion is requested.
+        with caplog.at_level(logging.WARNING, logger=reconcile.__name__):
+            report = await crud.reconcile_storage(checkpoint_path=checkpoint)
+        assert report.completed
+        assert (report.scanned_objects, report.orphan_objects, report.deleted_objects) == (4, 3, 0)
+        assert all([await exists(name) for name in orphans])
+        assert not checkpoint.exists()
+
+        # Rows are only missing their objects once the upload is finished.
+        assert f"Row {missing.id} is missing object" in caplog.text
+        assert pending.id not in caplog.text
+
+        # Orphans are deleted in batches, and objects with rows are kept.
+        report = await crud.reconcile_storage(delete=True, checkpoint_path=checkpoint)
+        assert (report.orphan_objects, report.deleted_objects) == (3, 3)
+        assert not any([await exists(name) for name in orphans])
+        assert await exists(get_krec_name(uploaded))
+        assert not checkpoint.exists()
@@ -0,0 +1,58 @@
+"""Tests the result caches, with single flight and stale-while-revalidate."""
+
+import asyncio
+import time
+
+from www.utils import TTLCache, cache_async_result
+
+
+def test_ttl_cache() -> None:
+    cache = TTLCache[str, int](ttl=0.1, capacity=2, stale_ttl=0.4)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == (1, True)
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.stats.evictions == 1
+    time.sleep(0.2)
+    assert cache.get("a") == (1, False)
+    time.sleep(0.4)
+    assert cache.get("c") is None
+    assert len(cache) == 0
+    assert cache.stats.expirations == 2
+
+
+async def test_cache_async_result() -> None:
+    calls: list[str] = []
+
+    @cache_async_result(num_seconds=0.1, key=lambda name, delay: name, stale_seconds=1.0)
+    async def load(name: str, delay: float) -> str:
+        calls.append(name)
+        await asyncio.sleep(delay)
+        return f"{name}-{len(calls)}"
+
+    # Concurrent misses share one call, and the delay isn't part of the key.
+    results = await asyncio.gather(*(load("x", 0.01 * i) for i in range(1, 6)))
+    assert results == ["x-1"] * 5
+    assert calls == ["x"]
+
+    # Expired entries are served stale while they are refreshed.
+    await asyncio.sleep(0.15)
+    assert await load("x", 0.01) == "x-1"
+    await asyncio.sleep(0.05)
+    assert await load("x", 0.01) == "x-2"
+    assert calls == ["x", "x"]
+
+    # Failed refreshes are logged, and the stale value keeps being served.
+    @cache_async_result(num_seconds=0.05, stale_seconds=1.0)
+    async def flaky(name: str) -> str:
+        calls.append(name)
+        if len(calls) > 3:
+            raise RuntimeError("Failed")
+        return name
+
+    assert await flaky("y") == "y"
+    await asyncio.sleep(0.1)
+    assert await flaky("y") == "y"
+    await asyncio.sleep(0.05)
+    assert await flaky("y") == "y"
@@ -0,0 +1,72 @@
+"""Runs tests on deleting S3 objects in batches."""
+
+import io
+
+import pytest
+from botocore.exceptions import ClientError
+from pytest_mock.plugin import MockerFixture
+
+from www.app.crud import base
+from www.app.db import Crud, create_tables
+from www.settings import settings
+from www.utils import new_uuid
+
+
+async def test_delete_many_from_s3(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    # The mocked bucket is shared between tests, so this test uses its own prefix.
+    monkeypatch.setattr(settings.s3, "prefix", f"deletes-{new_uuid()}/")
+    monkeypatch.setattr(base, "S3_DELETE_BATCH_SIZE", 2)
+
+    async with Crud() as crud:
+        await create_tables(crud)
+
+        async def exists(name: str) -> bool:
+            return await crud._head_object(name) is not None
+
+        names = [f"dir/{i}.bin" for i in range(5)]
+        for name in [*names, "kept.bin"]:
+            await crud._upload_to_s3(io.BytesIO(b"data"), name, name, "application/octet-stream")
+
+        # Duplicate keys are only deleted once, in batches of at most two keys.
+        spy = mocker.spy(crud.s3.meta.client, "delete_objects")
+        assert await crud._delete_many_from_s3([*names[:3], names[0]]) == []
+        assert [len(call.kwargs["Delete"]["Objects"]) for call in spy.call_args_list] == [2, 1]
+        assert not any([await exists(name) for name in names[:3]])
+
+        assert await crud._delete_s3_prefix("dir/") == []
+        assert not any([await exists(name) for name in names])
+        assert await exists("kept.bin")
+
+
+async def test_delete_many_from_s3_retries(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(settings.s3, "delete_retry_seconds", 0.0)
+    prefix = settings.s3.prefix
+
+    async with Crud() as crud:
+        throttled = ClientError({"Error": {"Code": "SlowDown", "Message": "Slow down"}}, "DeleteObjects")
+        delete_objects = mocker.patch.object(
+            crud.s3.meta.client,
+            "delete_objects",
+            new_callable=mocker.AsyncMock,
+            side_effect=[
+                throttled,
+                {
+                    "Errors": [
+                        {"Key": f"{prefix}a", "Code": "InternalError", "Message": "Try again"},
+                        {"Key": f"{prefix}b", "Code": "AccessDenied", "Message": "Access denied"},
+                    ]
+                },
+                {},
+            ],
+        )
+
+        # Throttled batches and keys with transient errors are retried, and
+        # keys with other errors are given up on straight away.
+        assert await crud._delete_many_from_s3(["a", "b", "c"]) == ["b"]
+        requested = [[obj["Key"] for obj in call.kwargs["Delete"]["Objects"]] for call in delete_objects.call_args_list]
+        assert requested == [[f"{prefix}{k}" for k in keys] for keys in (["a", "b", "c"], ["a", "b", "c"], ["a"])]
+
+        # Keys which still can't be deleted after the last attempt are returned.
+        monkeypatch.setattr(settings.s3, "delete_max_attempts", 2)
+        delete_objects.side_effect = [throttled, throttled]
+        assert await crud._delete_many_from_s3(["a", "b"]) == ["a", "b"]
@@ -0,0 +1,69 @@
+"""Runs tests on streaming uploads to S3."""
+
+import hashlib
+import io
+import os
+
+import pytest
+
+from www.app.db import Crud, create_tables
+from www.settings import settings
+
+PART_SIZE = 5 * 1024 * 1024
+
+
+class FailingReader:
+    """Returns some data, then fails, like a client which disconnects part way through."""
+
+    def __init__(self, data: bytes) -> None:
+        super().__init__()
+
+        self._data = io.BytesIO(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        chunk = self._data.read(size)
+        if not chunk:
+            raise ConnectionError("Client disconnected")
+        return chunk
+
+
+async def test_stream_to_s3(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.s3, "multipart_part_size", PART_SIZE)
+    monkeypatch.setattr(settings.s3, "multipart_concurrency", 2)
+
+    async with Crud() as crud:
+        await create_tables(crud)
+        client = crud.s3.meta.client
+
+        # Small objects are uploaded in one request.
+        assert await crud._stream_to_s3(io.BytesIO(b"small"), "a.txt", "small", "text/plain") == (
+            5,
+            hashlib.sha256(b"small").hexdigest(),
+        )
+        assert await (await crud._download_from_s3("small")).read() == b"small"
+
+        # Larger objects are uploaded one part at a time, and reads never
+        # ask for more than one part.
+        data = os.urandom(PART_SIZE * 2 + 123)
+        source = io.BytesIO(data)
+        read_sizes: list[int] = []
+        read = source.read
+
+        def tracked_read(size: int = -1) -> bytes:
+            read_sizes.append(size)
+            return read(size)
+
+        monkeypatch.setattr(source, "read", tracked_read)
+        size, sha256 = await crud._stream_to_s3(source, "b.bin", "large", "application/octet-stream")
+        assert (size, sha256) == (len(data), hashlib.sha256(data).hexdigest())
+        assert 0 < max(read_sizes) <= PART_SIZE
+        head = await client.head_object(Bucket=settings.s3.bucket, Key=f"{settings.s3.prefix}large")
+        assert head["ContentLength"] == len(data)
+        assert head["ETag"].strip('"').endswith("-3")
+        assert await (await crud._download_from_s3("large")).read() == data
+
+        # A failed upload is aborted, rather than leaving its parts behind.
+        with pytest.raises(ConnectionError):
+            await crud._stream_to_s3(FailingReader(data), "c.bin", "failed", "application/octet-stream")
+        uploads = await client.list_multipart_uploads(Bucket=settings.s3.bucket, Prefix=f"{settings.s3.prefix}failed")
+        assert not uploads.get("Uploads")
@@ -0,0 +1,23 @@
+"""Runs tests on the in-process listing search index."""
+
+from www.app.model import Listing
+from www.app.utils.search import ListingSearchIndex
+
+
+def test_listing_search_index() -> None:
+    arm = Listing.create(user_id="u", name="Robot Arm", slug="arm", child_ids=[], description="A small arm")
+    dog = Listing.create(user_id="u", name="Robot Dog", slug="dog", child_ids=[], description="Quadruped")
+    index = ListingSearchIndex()
+    index.finish_rebuild([arm, dog], {dog.id: ["legged"]})
+    assert {listing.id for listing, _ in index.search("robot")} == {arm.id, dog.id}
+    assert [listing.id for listing, _ in index.search("ROB arm")] == [arm.id]
+    assert [listing.id for listing, _ in index.search("leg")] == [dog.id]
+    assert index.search("robot cat") == []
+
+    # Writes made during a rebuild are replayed on top of the snapshot.
+    index.begin_rebuild()
+    index.add(arm.model_copy(update={"name": "Gripper"}))
+    index.remove(dog.id)
+    index.finish_rebuild([arm, dog], {})
+    assert [listing.id for listing, _ in index.search("grip")] == [arm.id]
+    assert index.search("robot") == []
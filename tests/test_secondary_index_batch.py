@@ -0,0 +1,41 @@
+"""Runs tests on reading a secondary index for many keys at once."""
+
+import asyncio
+
+from pytest_mock.plugin import MockerFixture
+
+from www.app.db import Crud, create_tables
+from www.app.model import Artifact, Robot
+from www.utils import new_uuid
+
+
+async def test_get_items_from_secondary_index_batch(mocker: MockerFixture) -> None:
+    async with Crud() as crud:
+        await create_tables(crud)
+
+        listing_ids = [new_uuid() for _ in range(3)]
+        artifacts = [
+            Artifact.create("user", listing_id, f"{i}.stl", "stl")
+            for listing_id, count in zip(listing_ids, (3, 1, 0))
+            for i in range(count)
+        ]
+        await crud._batch_write_items(puts=[*artifacts, Robot.create("user", listing_ids[0], "robot")])
+
+        # Each distinct key is queried once, and other types are left out.
+        spy = mocker.spy(crud, "_query_secondary_index")
+        keys = [*listing_ids, listing_ids[0]]
+        results = await crud._get_items_from_secondary_index_batch("listing_id", keys, Artifact)
+        assert [len(items) for items in results] == [3, 1, 0, 3]
+        assert all(item.listing_id == key for key, items in zip(keys, results) for item in items)
+        assert spy.call_count == 3
+
+        # Identical concurrent queries are shared when coalescing, but each
+        # caller still gets its own items.
+        spy.reset_mock()
+        first, second = await asyncio.gather(
+            crud._get_items_from_secondary_index_batch("listing_id", listing_ids[:1], Artifact, coalesce=True),
+            crud._get_items_from_secondary_index_batch("listing_id", listing_ids[:1], Artifact, coalesce=True),
+        )
+        assert spy.call_count == 1
+        assert [item.id for item in first[0]] == [item.id for item in second[0]]
+        assert first[0][0] is not second[0][0]
@@ -0,0 +1,32 @@
+"""Tests the binary STL validator."""
+
+import io
+import struct
+
+import pytest
+import trimesh
+
+from www.app.errors import BadArtifactError
+from www.app.utils.formats.stl import validate_binary_stl
+
+
+def test_validate_binary_stl() -> None:
+    mesh = trimesh.creation.box()
+    binary_file, ascii_file = io.BytesIO(), io.BytesIO()
+    mesh.export(binary_file, file_type="stl")
+    mesh.export(ascii_file, file_type="stl_ascii")
+
+    binary_file.seek(0)
+    assert validate_binary_stl(binary_file)
+    assert binary_file.tell() == 0
+    ascii_file.seek(0)
+    assert not validate_binary_stl(ascii_file)
+
+    # Truncated files are not binary STLs.
+    assert not validate_binary_stl(io.BytesIO(binary_file.getvalue()[:-1]))
+
+    # Non-finite vertices are rejected outright.
+    data = bytearray(binary_file.getvalue())
+    data[96:100] = struct.pack("<f", float("nan"))
+    with pytest.raises(BadArtifactError):
+        validate_binary_stl(io.BytesIO(bytes(data)))
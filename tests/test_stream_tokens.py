@@ -0,0 +1,24 @@
+"""Runs tests on the short-lived stream tokens."""
+
+import pytest
+
+from www.app.errors import NotAuthenticatedError
+from www.app.security.tokens import create_stream_token, verify_stream_token
+from www.settings import settings
+
+
+def test_stream_tokens(monkeypatch: pytest.MonkeyPatch) -> None:
+    token, _ = create_stream_token("user", "job:1")
+    assert verify_stream_token(token, "job:1") == "user"
+
+    # Tokens only grant access to the resource they were created for.
+    with pytest.raises(NotAuthenticatedError):
+        verify_stream_token(token, "job:2")
+
+    with pytest.raises(NotAuthenticatedError):
+        verify_stream_token("not-a-token", "job:1")
+
+    monkeypatch.setattr(settings.crypto, "stream_token_seconds", -10)
+    expired_token, _ = create_stream_token("user", "job:1")
+    with pytest.raises(NotAuthenticatedError):
+        verify_stream_token(expired_token, "job:1")
@@ -0,0 +1,110 @@
+"""Runs tests on the sharded type index and its merged queries."""
+
+import random
+
+import pytest
+
+from www.app.crud.base import TYPE_SHARD_COLNAME, decode_cursor, encode_cursor
+from www.app.crud.listings import SortOption
+from www.app.db import Crud, create_tables
+from www.app.model import Listing
+from www.settings import settings
+from www.utils import new_uuid
+
+
+async def test_sharded_listing_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.dynamo, "type_index_shards", 4)
+
+    async with Crud() as crud:
+        await create_tables(crud)
+        crud.PAGE_SIZE = 3
+
+        # Views are distinct and unrelated to creation time, so each sort
+        # order interleaves the shards differently.
+        user_id = new_uuid()
+        views = random.Random(0).sample(range(100), 13)
+        listings = [
+            Listing.create(user_id=user_id, name=f"robot {i}", slug=f"robot-{i}", child_ids=[]).model_copy(
+                update={"created_at": 1000 + i, "views": views[i]}
+            )
+            for i in range(13)
+        ]
+        for listing in random.Random(1).sample(listings, len(listings)):
+            await crud.add_listing(listing)
+        listing_ids = {listing.id for listing in listings}
+
+        for sort_by, sort_colname in ((SortOption.NEWEST, "created_at"), (SortOption.MOST_VIEWED, "views")):
+            # Following the cursors reads every listing once, in sort order.
+            pages: list[list[Listing]] = []
+            cursor = None
+            while True:
+                page, cursor = await crud.get_listings(sort_by=sort_by, cursor=cursor)
+                pages.append(page)
+                if cursor is None:
+                    break
+                assert len(page) == 3
+                assert len(decode_cursor(cursor)["shards"]) == 4
+            found = [listing for page in pages for listing in page]
+            assert len({listing.id for listing in found}) == len(found)
+            sort_values = [getattr(listing, sort_colname) for listing in found]
+            assert sort_values == sorted(sort_values, reverse=True)
+            expected = sorted(listings, key=lambda listing: getattr(listing, sort_colname), reverse=True)
+            assert [listing.id for listing in found if listing.id in listing_ids] == [
+                listing.id for listing in expected
+            ]
+
+            # Numbered pages match the pages reached by following cursors.
+            page, _ = await crud.get_listings(page=3, sort_by=sort_by)
+            assert [listing.id for listing in page] == [listing.id for listing in pages[2]]
+            assert await crud.get_listings(page=len(pages) + 1, sort_by=sort_by) == ([], None)
+
+        # Ascending queries merge the shards in the opposite order.
+        oldest: list[Listing] = []
+        cursor = None
+        while True:
+            page, cursor = await crud._query_type_page(Listing, limit=5, cursor=cursor, ascending=True)
+            oldest.extend(listing for listing in page if listing.id in listing_ids)
+            if cursor is None:
+                break
+        assert [listing.created_at for listing in oldest] == list(range(1000, 1013))
+
+
+async def test_invalid_shard_cursors(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.dynamo, "type_index_shards", 2)
+
+    async with Crud() as crud:
+        await create_tables(crud)
+        crud.PAGE_SIZE = 1
+        for i in range(3):
+            await crud.add_listing(
+                Listing.create(user_id=new_uuid(), name=f"robot {i}", slug=f"robot-{i}", child_ids=[])
+            )
+
+        _, cursor = await crud.get_listings(sort_by=SortOption.NEWEST)
+        assert cursor is not None
+        shards = decode_cursor(cursor)["shards"]
+        position = next(position for position in shards if isinstance(position, dict))
+        other_shard = "Listing#1" if position[TYPE_SHARD_COLNAME] == "Listing#0" else "Listing#0"
+
+        # Cursors are checked against the shard count, the sort column and
+        # the shard each position belongs to.
+        bad_cursors = [
+            encode_cursor({}),
+            encode_cursor({"shards": "done"}),
+            encode_cursor({"shards": [None]}),
+            encode_cursor({"shards": [None, None, None]}),
+            encode_cursor({"shards": [None, "finished"]}),
+            encode_cursor({"shards": [None, {"id": "x"}]}),
+            encode_cursor({"shards": [{**position, TYPE_SHARD_COLNAME: other_shard}] * 2}),
+        ]
+        for bad_cursor in bad_cursors:
+            with pytest.raises(ValueError, match="Invalid pagination cursor"):
+                await crud.get_listings(sort_by=SortOption.NEWEST, cursor=bad_cursor)
+        with pytest.raises(ValueError, match="Invalid pagination cursor"):
+            await crud.get_listings(sort_by=SortOption.MOST_VIEWED, cursor=cursor)
+
+        # A cursor whose shards are all exhausted gives an empty last page.
+        assert await crud.get_listings(sort_by=SortOption.NEWEST, cursor=encode_cursor({"shards": ["done"] * 2})) == (
+            [],
+            None,
+        )
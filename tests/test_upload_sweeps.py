@@ -0,0 +1,47 @@
+"""Runs tests on sweeping presigned uploads which the client never finalized."""
+
+import io
+
+import pytest
+
+from www.app.db import Crud, create_tables, sweep_pending_uploads
+from www.app.model import KRec, get_krec_name
+from www.settings import settings
+
+
+async def test_sweep_pending_uploads(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.s3, "finalize_grace_seconds", 0)
+
+    async with Crud() as crud:
+        await create_tables(crud)
+
+        uploaded = KRec.create("user", "robot", "uploaded.krec", status="processing")
+        abandoned = KRec.create("user", "robot", "abandoned.krec", status="processing")
+        ready = KRec.create("user", "robot", "ready.krec")
+        for krec in (uploaded, abandoned, ready):
+            await crud._add_item(krec)
+
+        # Only rows which are still processing are in the pending index. The
+        # mocked table is shared between tests, so other rows are ignored.
+        async def get_pending_ids() -> set[str]:
+            pending = await crud._get_pending_items(KRec)
+            return {krec.id for krec in pending} & {uploaded.id, abandoned.id, ready.id}
+
+        assert await get_pending_ids() == {uploaded.id, abandoned.id}
+
+        # Uploads with an object are finalized, and leave the pending index.
+        await crud._upload_to_s3(io.BytesIO(b"krec"), uploaded.name, get_krec_name(uploaded), "video/x-matroska")
+        await sweep_pending_uploads(crud)
+        uploaded_krec = await crud.get_krec(uploaded.id)
+        assert uploaded_krec is not None
+        assert uploaded_krec.status == "ready"
+        assert uploaded_krec.size_bytes == 4
+        assert await get_pending_ids() == {abandoned.id}
+
+        # Uploads which are still missing are eventually failed.
+        monkeypatch.setattr(settings.s3, "abandoned_upload_seconds", 0)
+        await sweep_pending_uploads(crud)
+        abandoned_krec = await crud.get_krec(abandoned.id)
+        assert abandoned_krec is not None
+        assert abandoned_krec.status == "failed"
+        assert await get_pending_ids() == set()
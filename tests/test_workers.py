@@ -0,0 +1,35 @@
+"""Runs tests on the worker process pool."""
+
+import asyncio
+import time
+
+import pytest
+
+from www.app.utils.workers import ProcessPool
+from www.settings import settings
+
+
+async def test_hung_task_does_not_block_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.artifact, "worker_processes", 2)
+    pool = ProcessPool()
+    try:
+        # Warms up the workers, so that spawning them doesn't count against the timeouts below.
+        assert list(await asyncio.gather(pool.run(abs, -1, timeout=30), pool.run(abs, -2, timeout=30))) == [1, 2]
+        executor = pool._get_executor()
+        processes = list(executor._processes.values())
+
+        # A call which is still running when another one times out isn't interrupted.
+        hung = pool.run(time.sleep, 60, timeout=0.5)
+        slow = pool.run(time.sleep, 1.0, timeout=30)
+        results = await asyncio.gather(hung, slow, return_exceptions=True)
+        assert isinstance(results[0], asyncio.TimeoutError)
+        assert results[1] is None
+
+        # The hung worker is killed, and later calls go to a fresh pool.
+        assert pool._executor is not executor
+        for process in processes:
+            process.join(timeout=5)
+            assert not process.is_alive()
+        assert await pool.run(abs, -3, timeout=30) == 3
+    finally:
+        pool.close()
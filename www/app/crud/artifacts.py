@@ -1,13 +1,20 @@
 """Defines CRUD interface for handling user-uploaded artifacts."""
 
 import asyncio
+import base64
+import binascii
+import gzip
+import hashlib
 import io
 import logging
 import tarfile
 import tempfile
+import time
 import zipfile
-from pathlib import Path
-from typing import IO, Any, AsyncIterator, Literal
+import zlib
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from typing import IO, Any, AsyncIterator, BinaryIO, Literal, cast
 from xml.etree import ElementTree as ET
 
 import trimesh
@@ -15,7 +22,8 @@ from boto3.dynamodb.conditions import ComparisonCondition
 from fastapi import UploadFile
 from PIL import Image
 
-from www.app.crud.base import BaseCrud, ItemNotFoundError
+from www.app.crud.base import AsyncReadable, BaseCrud, ItemNotFoundError
+from www.app.crud.blobs import HASH_CHUNK_SIZE, BlobsCrud
 from www.app.errors import BadArtifactError
 from www.app.model import (
     DOWNLOAD_CONTENT_TYPE,
@@ -25,71 +33,121 @@ from www.app.model import (
     Listing,
     SizeMapping,
     get_artifact_name,
+    get_artifact_names,
+    get_staging_name,
 )
+from www.app.utils.archives import BytePipe, ChunkSink, normalize_archive_member
+from www.app.utils.formats.stl import validate_binary_stl
+from www.app.utils.images import image_processor
+from www.app.utils.workers import process_pool
 from www.settings import settings
 from www.utils import save_xml
 
 logger = logging.getLogger(__name__)
 
+BACKFILL_CONCURRENCY = 16
+
 
 async def iter_archive(file: UploadFile, artifact_type: Literal["tgz", "zip"]) -> AsyncIterator[tuple[bytes, str]]:
-    file_input = io.BytesIO(await file.read())
-    match artifact_type:
-        case "tgz":
-            tar_archive = tarfile.open(fileobj=file_input, mode="r:gz")
-            for tar_member in tar_archive.getmembers():
-                if tar_member.isfile():
-                    if (member_read := tar_archive.extractfile(tar_member)) is None:
+    """Streams the files out of an uploaded archive.
+
+    Members are read one at a time, in a thread, straight from the spooled
+    upload instead of copying the whole archive into memory first.
+
+    Args:
+        file: The uploaded archive.
+        artifact_type: The archive format.
+
+    Yields:
+        The contents and path of each file in the archive.
+    """
+    max_bytes = settings.artifact.max_bytes
+    try:
+        match artifact_type:
+            case "tgz":
+                tar_archive = tarfile.open(fileobj=file.file, mode="r|gz")
+
+                def read_next() -> tuple[bytes, str] | None:
+                    while (tar_member := tar_archive.next()) is not None:
+                        if not tar_member.isfile():
+                            continue
+                        if tar_member.size > max_bytes:
+                            raise BadArtifactError(f"File in archive is too large: {tar_member.name}")
+                        if (member_read := tar_archive.extractfile(tar_member)) is None:
+                            continue
+                        return member_read.read(), tar_member.name
+                    return None
+
+                while (item := await asyncio.to_thread(read_next)) is not None:
+                    yield item
+
+            case "zip":
+                zip_archive = zipfile.ZipFile(file.file)
+                for zip_info in zip_archive.infolist():
+                    if zip_info.is_dir():
                         continue
-                    file_data = member_read.read()
-                    yield file_data, tar_member.name
-        case "zip":
-            zip_archive = zipfile.ZipFile(file_input)
-            for zip_member in zip_archive.namelist():
-                if not zip_member.endswith("/"):
-                    file_data = zip_archive.read(zip_member)
-                    yield file_data, zip_member
-        case _:
-            raise BadArtifactError(f"Invalid archive type: {artifact_type}")
-
-
-class ArtifactsCrud(BaseCrud):
+                    if zip_info.file_size > max_bytes:
+                        raise BadArtifactError(f"File in archive is too large: {zip_info.filename}")
+                    yield await asyncio.to_thread(zip_archive.read, zip_info), zip_info.filename
+
+            case _:
+                raise BadArtifactError(f"Invalid archive type: {artifact_type}")
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError, zlib.error) as e:
+        raise BadArtifactError(f"Invalid archive: {e}")
+
+
+async def iter_normalized_archive(
+    file: UploadFile,
+    artifact_type: Literal["tgz", "zip"],
+) -> AsyncIterator[tuple[bytes, str]]:
+    """Normalizes the files in an uploaded archive in the worker process pool.
+
+    Up to `archive_members_in_flight` files are processed concurrently, and
+    results are yielded in the same order as the original archive.
+
+    Args:
+        file: The uploaded archive.
+        artifact_type: The archive format.
+
+    Yields:
+        The normalized contents and path of each file in the archive.
+    """
+    timeout = settings.artifact.archive_member_timeout_seconds
+
+    async def normalize(data: bytes, subname: str) -> bytes:
+        try:
+            return await process_pool.run(normalize_archive_member, data, subname, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise BadArtifactError(f"Timed out while processing file in archive: {subname}")
+        except (BadArtifactError, BrokenProcessPool):
+            raise
+        except Exception as e:
+            # Parsing errors from PIL, trimesh and friends mean the file is bad.
+            raise BadArtifactError(f"Invalid file in archive: {subname} ({e})")
+
+    pending: deque[tuple[str, asyncio.Task[bytes]]] = deque()
+    try:
+        async for data, subname in iter_archive(file, artifact_type):
+            pending.append((subname, asyncio.create_task(normalize(data, subname))))
+            if len(pending) >= settings.artifact.archive_members_in_flight:
+                subname, task = pending.popleft()
+                yield await task, subname
+        while pending:
+            subname, task = pending.popleft()
+            yield await task, subname
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+class ArtifactsCrud(BlobsCrud, BaseCrud):
     @classmethod
     def get_gsis(cls) -> set[str]:
         return super().get_gsis().union({"user_id", "listing_id", "name"})
 
-    async def _crop_image(self, image: Image.Image, size: tuple[int, int]) -> IO[bytes]:
-        # Simply squashes the image to the desired size.
-        # image_resized = image.resize(size, resample=Image.Resampling.BICUBIC)
-        # Finds a bounding box of the image and crops it to the desired size.
-        image_ratio, size_ratio = image.width / image.height, size[0] / size[1]
-        if image_ratio > size_ratio:
-            new_width = int(image.height * size_ratio)
-            new_height = image.height
-            left = (image.width - new_width) // 2
-            upper = 0
-        else:
-            new_width = image.width
-            new_height = int(image.width / size_ratio)
-            left = 0
-            upper = (image.height - new_height) // 2
-        right = left + new_width
-        lower = upper + new_height
-        image = image.crop((left, upper, right, lower))
-
-        # Resize the image to the desired size.
-        image = image.resize(size, resample=Image.Resampling.BICUBIC)
-
-        # Save the image to a byte stream.
-        image_bytes = io.BytesIO()
-        image.save(image_bytes, format="PNG", optimize=True, quality=settings.artifact.quality)
-        image_bytes.seek(0)
-        return image_bytes
-
-    async def _upload_cropped_image(self, image: Image.Image, artifact: Artifact, size: ArtifactSize) -> None:
-        image_bytes = await self._crop_image(image, SizeMapping[size])
+    async def _upload_cropped_image(self, image_bytes: bytes, artifact: Artifact, size: ArtifactSize) -> None:
         filename = get_artifact_name(artifact=artifact, size=size)
-        await self._upload_to_s3(image_bytes, artifact.name, filename, "image/png")
+        await self._upload_to_s3(io.BytesIO(image_bytes), artifact.name, filename, "image/png")
 
     async def _upload_image(
         self,
@@ -97,11 +155,40 @@ class ArtifactsCrud(BaseCrud):
         file: UploadFile | Image.Image,
         listing: Listing,
         description: str | None = None,
+        *,
+        pending: Artifact | None = None,
     ) -> Artifact:
+        artifact = pending or await self._create_image_artifact(name, listing, description)
+
+        # Each size is rendered in its own worker process.
+        source = file if isinstance(file, Image.Image) else await file.read()
+        sizes = list(SizeMapping.keys())
+        crops = dict(
+            zip(sizes, await asyncio.gather(*(image_processor.crop(source, SizeMapping[size]) for size in sizes)))
+        )
+
+        # The recorded size and hash are for the large image, which is the
+        # one that gets downloaded by default.
+        artifact.size_bytes, artifact.content_hash = len(crops["large"]), hashlib.sha256(crops["large"]).hexdigest()
+
+        if settings.artifact.content_addressed:
+            stored = await asyncio.gather(
+                *(self._store_blob(io.BytesIO(crops[size]), name, "image/png") for size in sizes)
+            )
+            artifact.blobs = {size: content_hash for size, (_, content_hash) in zip(sizes, stored)}
+            await self._save_artifact(artifact, pending is not None)
+            return artifact
+
+        await asyncio.gather(
+            *(self._upload_cropped_image(image_bytes=crops[size], artifact=artifact, size=size) for size in sizes),
+            self._save_artifact(artifact, pending is not None),
+        )
+        return artifact
+
+    async def _create_image_artifact(self, name: str, listing: Listing, description: str | None) -> Artifact:
         existing_images = await self.get_listing_artifacts(listing.id)
         is_first_image = not any(a.artifact_type == "image" for a in existing_images)
-
-        artifact = Artifact.create(
+        return Artifact.create(
             user_id=listing.user_id,
             listing_id=listing.id,
             name=name,
@@ -111,13 +198,27 @@ class ArtifactsCrud(BaseCrud):
             is_main=is_first_image,
         )
 
-        image = file if isinstance(file, Image.Image) else Image.open(io.BytesIO(await file.read()))
+    async def _save_artifact(self, artifact: Artifact, pending: bool) -> None:
+        """Adds a newly stored artifact, or marks a pending one as ready.
 
-        await asyncio.gather(
-            *(self._upload_cropped_image(image=image, artifact=artifact, size=size) for size in SizeMapping.keys()),
-            self._add_item(artifact),
-        )
-        return artifact
+        If the artifact can't be saved, any blob references it holds are
+        released again.
+
+        Args:
+            artifact: The stored artifact.
+            pending: If the artifact row was already added by
+                `create_pending_artifact` and is waiting for processing.
+        """
+        try:
+            if pending:
+                artifact.status = "ready"
+                await self._update_item(artifact.id, Artifact, artifact.model_dump(exclude={"id"}, exclude_none=True))
+            else:
+                await self._add_item(artifact)
+        except BaseException:
+            if artifact.blobs:
+                await asyncio.gather(*(self._release_blob(content_hash) for content_hash in artifact.blobs.values()))
+            raise
 
     async def get_raw_artifact(self, artifact_id: str) -> Artifact | None:
         return await self._get_item(artifact_id, Artifact)
@@ -129,11 +230,16 @@ class ArtifactsCrud(BaseCrud):
         listing: Listing,
         artifact_type: Literal["stl", "obj", "ply", "dae"],
         description: str | None = None,
+        *,
+        pending: Artifact | None = None,
     ) -> Artifact:
-        # Converts the mesh to a binary STL file.
-        file_data = await file.read()
+        # Binary STL files are already in the stored format, so they can be
+        # streamed to S3 as-is.
+        if artifact_type == "stl" and validate_binary_stl(file.file):
+            return await self._upload_and_store(name, file, listing, "stl", description, pending=pending)
 
-        tmesh = trimesh.load(io.BytesIO(file_data), file_type=artifact_type)
+        # Converts the mesh to a binary STL file.
+        tmesh = trimesh.load(file.file, file_type=artifact_type)
         if not isinstance(tmesh, trimesh.Trimesh):
             raise BadArtifactError(f"Invalid mesh file: {name} ({type(tmesh)})")
 
@@ -145,7 +251,7 @@ class ArtifactsCrud(BaseCrud):
         name = f"{name.rsplit('.', 1)[0]}.stl"
 
         # Saves the artifact to S3.
-        artifact = await self._upload_and_store(name, out_file, listing, "stl", description)
+        artifact = await self._upload_and_store(name, out_file, listing, "stl", description, pending=pending)
 
         # Closes the file handlers when done.
         out_file.close()
@@ -159,10 +265,12 @@ class ArtifactsCrud(BaseCrud):
         listing: Listing,
         artifact_type: Literal["urdf", "mjcf"],
         description: str | None = None,
+        *,
+        pending: Artifact | None = None,
     ) -> Artifact:
         # Standardizes the XML file.
         try:
-            tree = ET.parse(io.BytesIO(await file.read()))
+            tree = ET.parse(file.file)
         except Exception:
             raise BadArtifactError("Invalid XML file")
 
@@ -172,7 +280,7 @@ class ArtifactsCrud(BaseCrud):
         out_file.seek(0)
 
         # Saves the artifact to S3.
-        return await self._upload_and_store(name, out_file, listing, artifact_type, description)
+        return await self._upload_and_store(name, out_file, listing, artifact_type, description, pending=pending)
 
     async def _upload_archive(
         self,
@@ -181,64 +289,53 @@ class ArtifactsCrud(BaseCrud):
         listing: Listing,
         artifact_type: Literal["tgz", "zip"],
         description: str | None = None,
+        *,
+        pending: Artifact | None = None,
     ) -> Artifact:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            out_file = Path(temp_dir) / name
-            with tarfile.open(out_file, mode="w:gz") as archive:
-                async for data, subname in iter_archive(file, artifact_type):
-                    subtype = Path(subname).suffix.lower()
-                    temp_path = Path(temp_dir) / subname
-                    temp_path.parent.mkdir(parents=True, exist_ok=True)
-                    match subtype:
-                        case ".stl" | ".obj" | ".ply" | ".dae":
-                            tmesh = trimesh.load(io.BytesIO(data), file_type=subtype)
-                            if not isinstance(tmesh, trimesh.Trimesh):
-                                raise BadArtifactError(f"Invalid mesh file: {subname}")
-                            tmesh.export(temp_path, file_type=subtype.lstrip("."))
-                            archive.add(temp_path, arcname=subname)
-
-                        case ".png" | ".jpg" | ".jpeg" | ".gif" | ".bmp" | ".tiff" | ".webp":
-                            image = Image.open(io.BytesIO(data))
-                            match subtype:
-                                case ".png":
-                                    format = "PNG"
-                                case ".jpg" | ".jpeg":
-                                    format = "JPEG"
-                                case ".gif":
-                                    format = "GIF"
-                                case ".bmp":
-                                    format = "BMP"
-                                case ".tiff":
-                                    format = "TIFF"
-                                case ".webp":
-                                    format = "WEBP"
-                            image.save(temp_path, format=format)
-                            archive.add(temp_path, arcname=subname)
-
-                        case ".urdf" | ".mjcf":
-                            try:
-                                tree = ET.parse(io.BytesIO(data))
-                            except Exception:
-                                raise BadArtifactError("Invalid XML file")
-                            save_xml(temp_path, tree)
-                            archive.add(temp_path, arcname=subname)
-
-                        case _:
-                            raise BadArtifactError(f"Invalid file in archive: {subname}")
-
-            logger.info("Created archive: %s", out_file)
-            with open(out_file, "rb") as f:
-                return await self._upload_and_store(name, f, listing, "tgz", description)
+        # The rebuilt archive is compressed into a pipe as the normalized
+        # members come in, while the upload reads from the other end.
+        pipe = BytePipe(max_buffer_bytes=settings.s3.multipart_part_size)
+
+        async def build_archive() -> None:
+            try:
+                # Timestamps are fixed so that the same members always produce
+                # the same bytes, which lets repeated uploads share a blob.
+                sink = ChunkSink()
+                compressed = gzip.GzipFile(fileobj=sink, mode="wb", mtime=0)
+                archive = tarfile.open(fileobj=compressed, mode="w|")
+                async for data, subname in iter_normalized_archive(file, artifact_type):
+                    tar_info = tarfile.TarInfo(subname)
+                    tar_info.size, tar_info.mode = len(data), 0o644
+                    await asyncio.to_thread(archive.addfile, tar_info, io.BytesIO(data))
+                    await pipe.write(sink.drain())
+                await asyncio.to_thread(archive.close)
+                await asyncio.to_thread(compressed.close)
+                await pipe.write(sink.drain())
+            except BaseException as e:
+                await pipe.close(e)
+                raise
+            await pipe.close()
+
+        build_task = asyncio.create_task(build_archive())
+        try:
+            artifact = await self._upload_and_store(name, pipe, listing, "tgz", description, pending=pending)
+        finally:
+            build_task.cancel()
+            await asyncio.gather(build_task, return_exceptions=True)
+        logger.info("Uploaded rebuilt archive: %s", name)
+        return artifact
 
     async def _upload_and_store(
         self,
         name: str,
-        file: IO[bytes],
+        file: IO[bytes] | AsyncReadable,
         listing: Listing,
         artifact_type: ArtifactType,
         description: str | None = None,
+        *,
+        pending: Artifact | None = None,
     ) -> Artifact:
-        artifact = Artifact.create(
+        artifact = pending or Artifact.create(
             user_id=listing.user_id,
             listing_id=listing.id,
             name=name,
@@ -246,18 +343,24 @@ class ArtifactsCrud(BaseCrud):
             description=description,
         )
 
+        if settings.artifact.content_addressed:
+            artifact.size_bytes, artifact.content_hash = await self._store_blob(
+                file, name, DOWNLOAD_CONTENT_TYPE[artifact_type]
+            )
+            artifact.blobs = {"large": artifact.content_hash}
+            await self._save_artifact(artifact, pending is not None)
+            return artifact
+
         # Prepend the artifact ID to the filename
         s3_filename = get_artifact_name(artifact=artifact, name=name, artifact_type=artifact_type)
 
-        await asyncio.gather(
-            self._upload_to_s3(
-                data=file,
-                name=name,
-                filename=s3_filename,
-                content_type=DOWNLOAD_CONTENT_TYPE[artifact_type],
-            ),
-            self._add_item(artifact),
+        artifact.size_bytes, artifact.content_hash = await self._stream_to_s3(
+            data=file,
+            name=name,
+            filename=s3_filename,
+            content_type=DOWNLOAD_CONTENT_TYPE[artifact_type],
         )
+        await self._save_artifact(artifact, pending is not None)
         return artifact
 
     async def upload_artifact(
@@ -267,36 +370,263 @@ class ArtifactsCrud(BaseCrud):
         listing: Listing,
         artifact_type: ArtifactType,
         description: str | None = None,
+        *,
+        pending: Artifact | None = None,
     ) -> Artifact:
         match artifact_type:
             case "image":
-                return await self._upload_image(name, file, listing, description)
+                return await self._upload_image(name, file, listing, description, pending=pending)
             case "stl" | "obj" | "ply" | "dae":
-                return await self._upload_mesh(name, file, listing, artifact_type, description)
+                return await self._upload_mesh(name, file, listing, artifact_type, description, pending=pending)
             case "urdf" | "mjcf":
-                return await self._upload_xml(name, file, listing, artifact_type, description)
+                return await self._upload_xml(name, file, listing, artifact_type, description, pending=pending)
             case "tgz" | "zip":
-                return await self._upload_archive(name, file, listing, artifact_type, description)
+                return await self._upload_archive(name, file, listing, artifact_type, description, pending=pending)
             case _:
                 raise BadArtifactError(f"Invalid artifact type: {artifact_type}")
 
-    async def _remove_image(self, artifact: Artifact) -> None:
-        await asyncio.gather(
-            *(self._delete_from_s3(get_artifact_name(artifact=artifact, size=size)) for size in SizeMapping.keys()),
-            self._delete_item(artifact),
+    async def create_pending_artifact(
+        self,
+        name: str,
+        file: UploadFile,
+        listing: Listing,
+        artifact_type: ArtifactType,
+        description: str | None = None,
+    ) -> Artifact:
+        """Stages an upload to be processed later by `process_pending_artifact`.
+
+        The raw file is streamed to a staging key as-is, and the artifact is
+        added in the "processing" state with the name and type it will have
+        once it has been processed.
+
+        Args:
+            name: The uploaded filename.
+            file: The uploaded file.
+            listing: The listing to add the artifact to.
+            artifact_type: The type of the uploaded file.
+            description: The artifact description.
+
+        Returns:
+            The pending artifact.
+        """
+        match artifact_type:
+            case "image":
+                artifact = await self._create_image_artifact(name, listing, description)
+            case "stl" | "obj" | "ply" | "dae":
+                stl_name = f"{name.rsplit('.', 1)[0]}.stl"
+                artifact = Artifact.create(listing.user_id, listing.id, stl_name, "stl", description=description)
+            case "tgz" | "zip":
+                artifact = Artifact.create(listing.user_id, listing.id, name, "tgz", description=description)
+            case "urdf" | "mjcf":
+                artifact = Artifact.create(listing.user_id, listing.id, name, artifact_type, description=description)
+            case _:
+                raise BadArtifactError(f"Invalid artifact type: {artifact_type}")
+        artifact.status = "processing"
+
+        await self._stream_to_s3(
+            data=file,
+            name=name,
+            filename=get_staging_name(artifact.id, name),
+            content_type=DOWNLOAD_CONTENT_TYPE[artifact_type],
         )
+        await self._add_item(artifact)
+        return artifact
 
-    async def _remove_raw_artifact(self, artifact: Artifact) -> None:
+    async def process_pending_artifact(self, artifact_id: str, name: str, artifact_type: ArtifactType) -> Artifact:
+        """Processes an upload which was staged by `create_pending_artifact`.
+
+        Args:
+            artifact_id: The pending artifact's ID.
+            name: The uploaded filename.
+            artifact_type: The type of the uploaded file.
+
+        Returns:
+            The processed artifact.
+
+        Raises:
+            BadArtifactError: If the upload is invalid, so that processing it
+                again won't help. Other errors, like a throttled request,
+                leave the artifact and its staged upload as they were, so
+                that processing can be retried. The job runner calls
+                `fail_pending_artifact` once it gives up.
+        """
+        artifact = await self._get_item(artifact_id, Artifact, throw_if_missing=True)
+        if artifact.status != "processing":
+            raise BadArtifactError(f"Artifact {artifact_id} is not waiting to be processed")
+        listing = await self._get_item(artifact.listing_id, Listing, throw_if_missing=True)
+
+        staging_name = get_staging_name(artifact_id, name)
+        spool = tempfile.SpooledTemporaryFile(max_size=settings.s3.multipart_part_size)
+        try:
+            body = await self._download_from_s3(staging_name)
+            async for chunk in body.iter_chunks(HASH_CHUNK_SIZE):
+                await asyncio.to_thread(spool.write, chunk)
+            spool.seek(0)
+            file = UploadFile(file=cast(BinaryIO, spool), filename=name)
+            artifact = await self.upload_artifact(
+                name, file, listing, artifact_type, artifact.description, pending=artifact
+            )
+        finally:
+            spool.close()
+        await self._delete_from_s3(staging_name)
+        return artifact
+
+    async def fail_pending_artifact(self, artifact_id: str, name: str) -> None:
+        """Gives up on an upload which was staged by `create_pending_artifact`.
+
+        This is called once the processing job has failed for good, including
+        when a worker died while processing it, so that the artifact doesn't
+        stay in the "processing" state forever.
+
+        Args:
+            artifact_id: The pending artifact's ID.
+            name: The uploaded filename.
+        """
+        artifact = await self._get_item(artifact_id, Artifact)
+        if artifact is not None and artifact.status == "processing":
+            await self._update_item(artifact_id, Artifact, {"status": "failed"})
+        await self._delete_from_s3(get_staging_name(artifact_id, name))
+
+    async def _head_artifact(self, artifact: Artifact) -> tuple[int, str | None] | None:
+        """Reads an artifact's size and checksum from S3.
+
+        Args:
+            artifact: The artifact to look up.
+
+        Returns:
+            The size in bytes and the hex SHA-256 digest, if S3 has a full
+            object checksum for it, or None if the object doesn't exist.
+        """
+        if (response := await self._head_object(get_artifact_name(artifact=artifact))) is None:
+            return None
+
+        # Multipart uploads have a checksum of checksums, like "abc=-3",
+        # which is not the hash of the content.
+        content_hash = None
+        if (checksum := response.get("ChecksumSHA256")) is not None and "-" not in checksum:
+            try:
+                content_hash = base64.b64decode(checksum, validate=True).hex()
+            except binascii.Error:
+                content_hash = None
+        return response["ContentLength"], content_hash
+
+    async def _hash_artifact(self, artifact: Artifact) -> str:
+        body = await self._download_from_s3(get_artifact_name(artifact=artifact))
+        hasher = hashlib.sha256()
+        async for chunk in body.iter_chunks(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+        return hasher.hexdigest()
+
+    async def finalize_artifact_upload(self, artifact: Artifact) -> Artifact:
+        """Records the size and hash of an artifact uploaded directly to S3.
+
+        Presigned uploads bypass the API server, so this should be called
+        once the client has finished uploading.
+
+        Args:
+            artifact: The artifact which was uploaded.
+
+        Returns:
+            The updated artifact.
+        """
+        if (info := await self._head_artifact(artifact)) is None:
+            raise BadArtifactError("Artifact has not been uploaded yet")
+        size_bytes, content_hash = info
+        updates: dict[str, Any] = {"size_bytes": size_bytes, "status": "ready"}
+        if content_hash is not None:
+            updates["content_hash"] = content_hash
+        await self._update_item(artifact.id, Artifact, updates)
+        return artifact.model_copy(update=updates)
+
+    async def sweep_pending_artifact_uploads(self) -> int:
+        """Finalizes presigned kernel uploads which the client never finalized.
+
+        Uploads which are still missing after `abandoned_upload_seconds` are
+        marked as failed.
+
+        Returns:
+            The number of artifacts which were finalized.
+        """
+        now = time.time()
+        semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+
+        async def sweep(artifact: Artifact) -> bool:
+            async with semaphore:
+                try:
+                    await self.finalize_artifact_upload(artifact)
+                    return True
+                except BadArtifactError:
+                    if now - artifact.timestamp >= settings.s3.abandoned_upload_seconds:
+                        logger.warning("Upload of artifact %s was abandoned", artifact.id)
+                        await self._update_item(artifact.id, Artifact, {"status": "failed"})
+                    return False
+
+        artifacts = [
+            artifact
+            for artifact in await self._get_pending_items(Artifact)
+            if artifact.artifact_type == "kernel" and now - artifact.timestamp >= settings.s3.finalize_grace_seconds
+        ]
+        results = await asyncio.gather(*(sweep(artifact) for artifact in artifacts))
+        return sum(results)
+
+    async def backfill_artifact_sizes(self, compute_hashes: bool = True) -> int:
+        """Fills in the size and hash of artifacts which predate them.
+
+        Args:
+            compute_hashes: If set, download and hash objects which don't
+                have an S3 checksum, instead of leaving their hash unset.
+
+        Returns:
+            The number of artifacts which were updated.
+        """
+        semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+
+        async def backfill(artifact: Artifact) -> bool:
+            async with semaphore:
+                if (info := await self._head_artifact(artifact)) is None:
+                    logger.warning("Artifact %s is missing from S3", artifact.id)
+                    return False
+                size_bytes, content_hash = info
+                if content_hash is None and compute_hashes:
+                    content_hash = await self._hash_artifact(artifact)
+                updates: dict[str, Any] = {"size_bytes": size_bytes}
+                if content_hash is not None:
+                    updates["content_hash"] = content_hash
+                await self._update_item(artifact.id, Artifact, updates)
+                return True
+
+        artifacts = [a async for a in self._iter_items(Artifact) if a.size_bytes is None or a.content_hash is None]
+        logger.info("Backfilling %d artifacts", len(artifacts))
+        results = await asyncio.gather(*(backfill(artifact) for artifact in artifacts))
+        return sum(results)
+
+    async def remove_artifacts(self, artifacts: list[Artifact]) -> None:
+        """Removes artifacts and their files.
+
+        The rows are removed first, so that a failure part way through leaves
+        orphaned objects for the reconciler rather than rows pointing at
+        missing objects. Files are deleted in batched requests.
+
+        Args:
+            artifacts: The artifacts to remove.
+        """
+        await self._delete_items(artifacts)
+        filenames: list[str] = []
+        content_hashes: list[str] = []
+        for artifact in artifacts:
+            if artifact.blobs:
+                content_hashes.extend(artifact.blobs.values())
+                continue
+            filenames.extend(get_artifact_names(artifact))
+            if artifact.status == "processing":
+                filenames.append(get_staging_name(artifact.id, artifact.name))
         await asyncio.gather(
-            self._delete_from_s3(get_artifact_name(artifact=artifact)),
-            self._delete_item(artifact),
+            self._delete_many_from_s3(filenames),
+            *(self._release_blob(content_hash) for content_hash in content_hashes),
         )
 
     async def remove_artifact(self, artifact: Artifact) -> None:
-        if artifact.artifact_type == "image":
-            await self._remove_image(artifact)
-        else:
-            await self._remove_raw_artifact(artifact)
+        await self.remove_artifacts([artifact])
 
     async def get_listing_artifacts(
         self,
@@ -312,7 +642,9 @@ class ArtifactsCrud(BaseCrud):
         return sorted(artifacts, key=lambda a: a.timestamp)
 
     async def get_listings_artifacts(self, listing_ids: list[str]) -> list[list[Artifact]]:
-        artifact_chunks = await self._get_items_from_secondary_index_batch("listing_id", listing_ids, Artifact)
+        artifact_chunks = await self._get_items_from_secondary_index_batch(
+            "listing_id", listing_ids, Artifact, coalesce=True
+        )
         return [sorted(artifacts, key=lambda a: a.timestamp) for artifacts in artifact_chunks]
 
     async def edit_artifact(
@@ -1,28 +1,54 @@
 """Defines the base CRUD interface."""
 
 import asyncio
+import base64
+import binascii
+import collections
+import hashlib
+import heapq
+import inspect
 import itertools
+import json
 import logging
+import random
+import time
+import zlib
+from decimal import Decimal
 from typing import (
     IO,
     Any,
     AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
     Callable,
+    Iterable,
     Literal,
+    Mapping,
+    Protocol,
     Self,
     TypeVar,
     overload,
 )
 
-import aioboto3
 from aiobotocore.response import StreamingBody
-from boto3.dynamodb.conditions import Attr, ComparisonCondition, Key
+from boto3.dynamodb.conditions import Attr, ComparisonCondition, ConditionBase, Key
 from botocore.exceptions import ClientError
-from types_aiobotocore_dynamodb.service_resource import DynamoDBServiceResource
+from types_aiobotocore_dynamodb.service_resource import DynamoDBServiceResource, Table
+from types_aiobotocore_dynamodb.type_defs import (
+    AttributeDefinitionTypeDef,
+    GlobalSecondaryIndexTypeDef,
+    KeysAndAttributesServiceResourceTypeDef,
+    WriteRequestServiceResourceUnionTypeDef,
+)
 from types_aiobotocore_s3.service_resource import S3ServiceResource
+from types_aiobotocore_s3.type_defs import CompletedPartTypeDef, HeadObjectOutputTypeDef, ObjectIdentifierTypeDef
 
 from www.app.errors import InternalError, ItemNotFoundError
 from www.app.model import StoreBaseModel
+from www.app.utils.aws import aws_clients
+from www.app.utils.itemcache import item_cache
+from www.app.utils.loader import ItemLoader
+from www.app.utils.ratelimit import RateLimiter
 from www.settings import settings
 from www.utils import get_cors_origins
 
@@ -35,9 +61,246 @@ T = TypeVar("T", bound=StoreBaseModel)
 DEFAULT_CHUNK_SIZE = 100
 DEFAULT_SCAN_LIMIT = 1000
 ITEMS_PER_PAGE = 12
+MAX_MULTIPART_PARTS = 10000
+S3_DELETE_BATCH_SIZE = 1000
+DYNAMO_WRITE_BATCH_SIZE = 25
+
+# Every item is in one shard of the type index, which is sorted by the
+# item's creation time, so that listing a type doesn't hit one partition.
+TYPE_SHARD_COLNAME = "type_shard"
+TYPE_SORT_COLNAME = "type_sort"
+TYPE_SORT_SOURCE_COLNAMES = ("created_at", "timestamp")
+
+# Items which are still "processing" have their type in this column, which
+# is removed once they finish, so that a sparse index over it finds pending
+# uploads without scanning the table.
+PENDING_COLNAME = "pending_type"
+
+# Secondary index queries which are in flight, so that identical concurrent
+# queries can share one request.
+_inflight_queries: dict[tuple[str, str, str], asyncio.Task[list[dict[str, Any]]]] = {}
+
+# Error codes which S3 returns for transient failures, either for a whole
+# request or for individual keys in a `delete_objects` response.
+RETRYABLE_S3_ERRORS = {"SlowDown", "InternalError", "ServiceUnavailable", "RequestTimeout", "503"}
 
 TableKey = tuple[str, Literal["S", "N", "B"], Literal["HASH", "RANGE"]]
-GlobalSecondaryIndex = tuple[str, str, Literal["S", "N", "B"], Literal["HASH", "RANGE"]]
+GlobalSecondaryIndex = tuple[str, list[TableKey]]
+
+
+class AsyncReadable(Protocol):
+    async def read(self, size: int = -1) -> bytes: ...
+
+
+def encode_cursor(key: dict[str, Any]) -> str:
+    """Encodes a DynamoDB key as an opaque pagination cursor."""
+    data = json.dumps(key, default=lambda v: int(v) if v == int(v) else float(v), separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    """Decodes a cursor created by `encode_cursor`.
+
+    Args:
+        cursor: The cursor to decode.
+
+    Returns:
+        The DynamoDB key to start reading from.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)), parse_float=Decimal)
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid pagination cursor")
+    if not isinstance(key, dict) or not all(isinstance(k, str) for k in key):
+        raise ValueError("Invalid pagination cursor")
+    return key
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    """Decodes a cursor which holds the offset of the next page in a list.
+
+    Args:
+        cursor: The cursor to decode.
+
+    Returns:
+        The offset of the next page.
+
+    Raises:
+        ValueError: If the cursor is malformed, or came from another kind of
+            listing.
+    """
+    offset = decode_cursor(cursor).get("offset")
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise ValueError("Invalid pagination cursor")
+    return offset
+
+
+def get_type_shard(item_type: str, item_id: str, num_shards: int | None = None) -> str:
+    """Gets the type index shard which an item belongs to.
+
+    Args:
+        item_type: The type of the item.
+        item_id: The ID of the item, which is hashed to pick the shard.
+        num_shards: The number of shards, if not the configured number.
+
+    Returns:
+        The shard, as `type#number`.
+    """
+    num_shards = settings.dynamo.type_index_shards if num_shards is None else num_shards
+    return f"{item_type}#{zlib.crc32(item_id.encode()) % num_shards}"
+
+
+def get_type_sort_value(data: Mapping[str, Any]) -> int:
+    """Gets the value which sorts an item within its type index shard.
+
+    Args:
+        data: The item's attributes.
+
+    Returns:
+        The item's creation time, or 0 for types which don't record one.
+    """
+    for colname in TYPE_SORT_SOURCE_COLNAMES:
+        if (value := data.get(colname)) is not None:
+            return int(value)
+    return 0
+
+
+def get_pending_value(item_type: str, data: Mapping[str, Any]) -> str | None:
+    """Gets the value of an item in the pending index.
+
+    Args:
+        item_type: The type of the item.
+        data: The item's attributes.
+
+    Returns:
+        The item's type if it is still being processed, otherwise None, so
+        that the item is left out of the index.
+    """
+    return item_type if data.get("status") == "processing" else None
+
+
+# The state of one shard in a sharded query: the key to resume after, None
+# to start from the beginning, or "done" once the shard is exhausted.
+ShardPosition = dict[str, Any] | Literal["done"] | None
+
+
+class _ShardedQuery:
+    """Merges the sorted pages of every type index shard into one stream.
+
+    Each shard is read a page at a time, and a heap holds the head of every
+    shard which still has items, so reading the first N items in order only
+    reads about N items, rather than the whole type.
+    """
+
+    def __init__(
+        self,
+        table: Table,
+        item_type: str,
+        *,
+        range_colname: str,
+        ascending: bool,
+        page_size: int,
+        filter_expression: ConditionBase | None,
+        positions: list[ShardPosition] | None,
+    ) -> None:
+        super().__init__()
+
+        num_shards = settings.dynamo.type_index_shards
+        shards = [f"{item_type}#{shard}" for shard in range(num_shards)]
+        if positions is None:
+            positions = [None] * num_shards
+        elif len(positions) != num_shards or not all(
+            position is None
+            or position == "done"
+            or (
+                isinstance(position, dict)
+                and set(position) == {"id", TYPE_SHARD_COLNAME, range_colname}
+                and position[TYPE_SHARD_COLNAME] == shard
+            )
+            for position, shard in zip(positions, shards)
+        ):
+            raise ValueError("Invalid pagination cursor")
+
+        self._table = table
+        self._range_colname = range_colname
+        self._ascending = ascending
+        self._shards = shards
+        self._params: dict[str, Any] = {
+            "IndexName": BaseCrud.get_sorted_gsi_index_name(TYPE_SHARD_COLNAME, range_colname),
+            "ScanIndexForward": ascending,
+            "Limit": page_size,
+        }
+        if filter_expression is not None:
+            self._params["FilterExpression"] = filter_expression
+        self._positions = positions
+        self._start_keys: list[dict[str, Any] | None] = [p if isinstance(p, dict) else None for p in positions]
+        self._done = [p == "done" for p in positions]
+        self._buffers: list[collections.deque[dict[str, Any]]] = [collections.deque() for _ in positions]
+        self._heap: list[tuple[Any, int]] | None = None
+
+    @property
+    def positions(self) -> list[ShardPosition]:
+        """Where to resume each shard, so that no unread item is skipped."""
+        return [
+            "done" if done and not buffer else position
+            for position, done, buffer in zip(self._positions, self._done, self._buffers)
+        ]
+
+    def _get_heap_entry(self, shard: int) -> tuple[Any, int]:
+        value = self._buffers[shard][0][self._range_colname]
+        return (value if self._ascending else -value), shard
+
+    async def _fill(self, shard: int) -> None:
+        # Filtered pages can be empty, so keep reading until there is an
+        # item or the shard is exhausted.
+        while not self._buffers[shard] and not self._done[shard]:
+            params = {**self._params, "KeyConditionExpression": Key(TYPE_SHARD_COLNAME).eq(self._shards[shard])}
+            if (start_key := self._start_keys[shard]) is not None:
+                params["ExclusiveStartKey"] = start_key
+            response = await self._table.query(**params)
+            self._buffers[shard].extend(response["Items"])
+            self._start_keys[shard] = response.get("LastEvaluatedKey")
+            self._done[shard] = self._start_keys[shard] is None
+
+    async def next(self) -> dict[str, Any] | None:
+        """Gets the next item in sort order, or None if every shard is exhausted."""
+        if self._heap is None:
+            await asyncio.gather(*(self._fill(shard) for shard in range(len(self._shards))))
+            self._heap = [self._get_heap_entry(shard) for shard, buffer in enumerate(self._buffers) if buffer]
+            heapq.heapify(self._heap)
+        if not self._heap:
+            return None
+        _, shard = heapq.heappop(self._heap)
+        item = self._buffers[shard].popleft()
+        self._positions[shard] = {k: item[k] for k in ("id", TYPE_SHARD_COLNAME, self._range_colname)}
+        await self._fill(shard)
+        if self._buffers[shard]:
+            heapq.heappush(self._heap, self._get_heap_entry(shard))
+        return item
+
+    @property
+    def has_more(self) -> bool:
+        return self._heap is None or bool(self._heap)
+
+
+def get_attribute_definitions(
+    keys: list[TableKey],
+    gsis: list[GlobalSecondaryIndex] | None = None,
+) -> list[AttributeDefinitionTypeDef]:
+    attributes = {n: t for n, t, _ in itertools.chain(keys, *(gsi_keys for _, gsi_keys in gsis or []))}
+    return [{"AttributeName": n, "AttributeType": t} for n, t in attributes.items()]
+
+
+def get_gsi_definition(gsi: GlobalSecondaryIndex) -> GlobalSecondaryIndexTypeDef:
+    index_name, gsi_keys = gsi
+    return {
+        "IndexName": index_name,
+        "KeySchema": [{"AttributeName": n, "KeyType": t} for n, _, t in gsi_keys],
+        "Projection": {"ProjectionType": "ALL"},
+    }
 
 
 class BaseCrud(AsyncContextManager["BaseCrud"]):
@@ -46,6 +309,7 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
 
         self.__db: DynamoDBServiceResource | None = None
         self.__s3: S3ServiceResource | None = None
+        self.__loader: ItemLoader | None = None
 
     @property
     def db(self) -> DynamoDBServiceResource:
@@ -59,49 +323,114 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
             raise RuntimeError("Must call __aenter__ first!")
         return self.__s3
 
+    @property
+    def loader(self) -> ItemLoader | None:
+        return self.__loader
+
+    def use_loader(self) -> None:
+        """Batches and memoizes item reads for the lifetime of this instance.
+
+        Once enabled, reads by ID which happen in the same event loop
+        iteration are sent as one batched request, and each item is read at
+        most once, until it is written through this instance. This is meant
+        for request-scoped instances, where slightly stale reads are fine.
+        """
+        if self.__loader is None:
+            self.__loader = ItemLoader(self._batch_get_items)
+
+    async def _invalidate_items(self, keys: Iterable[str]) -> None:
+        """Drops written items from the request's loader and the shared cache.
+
+        Args:
+            keys: The IDs of the written items, or other cache keys derived
+                from them.
+        """
+        keys = list(keys)
+        if self.__loader is not None:
+            for key in keys:
+                self.__loader.clear(key)
+        await item_cache.invalidate(keys)
+
+    async def _read_through(
+        self,
+        key: str,
+        read: Callable[[], Awaitable[dict[str, Any] | None]],
+    ) -> dict[str, Any] | None:
+        """Reads a raw item through the shared cache.
+
+        Args:
+            key: The cache key for the item.
+            read: Reads the item if it isn't cached. Its `type` attribute
+                selects the TTL.
+
+        Returns:
+            The item, or None if it doesn't exist.
+        """
+        if (item := (await item_cache.get_many([key])).get(key)) is not None:
+            return item
+        read_at = time.time()
+        item = await read()
+        await item_cache.put_many({} if item is None else {key: item}, read_at)
+        return item
+
     @classmethod
     def get_gsis(cls) -> set[str]:
-        return {"type"}
+        return {PENDING_COLNAME}
 
     @classmethod
     def get_gsi_index_name(cls, colname: str) -> str:
         return f"{colname}_index"
 
+    @classmethod
+    def get_sorted_gsis(cls) -> set[tuple[str, str]]:
+        """Returns the (hash, range) column pairs to build sorted GSIs for.
+
+        The range column is always numeric, like a timestamp or a counter.
+        """
+        return {(TYPE_SHARD_COLNAME, TYPE_SORT_COLNAME)}
+
+    @classmethod
+    def get_sorted_gsi_index_name(cls, hash_colname: str, range_colname: str) -> str:
+        return f"{hash_colname}_{range_colname}_index"
+
     async def __aenter__(self) -> Self:
-        session = aioboto3.Session()
-        db = session.resource("dynamodb")
-        s3 = session.resource("s3")
-        db, s3 = await asyncio.gather(db.__aenter__(), s3.__aenter__())
-        self.__db = db
-        self.__s3 = s3
+        # Borrows the process-wide resources rather than opening new ones.
+        self.__db, self.__s3 = await aws_clients.get()
         return self
 
     async def __aexit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:  # noqa: ANN401
-        to_close = []
-        if self.__db is not None:
-            to_close.append(self.__db)
-        if self.__s3 is not None:
-            to_close.append(self.__s3)
-        await asyncio.gather(*(resource.__aexit__(exc_type, exc_val, exc_tb) for resource in to_close))
+        # The shared resources are closed by the app lifespan, not per request.
+        self.__db = None
+        self.__s3 = None
+        self.__loader = None
 
-    async def _add_item(self, item: StoreBaseModel, unique_fields: list[str] | None = None) -> None:
-        table = await self.db.Table(TABLE_NAME)
+    @staticmethod
+    def _get_item_data(item: StoreBaseModel) -> dict[str, Any]:
         item_data = item.model_dump()
 
         # Ensure no empty strings are present
         item_data = {k: v for k, v in item_data.items() if v is not None and v != ""}
 
         # DynamoDB-specific requirements
-        if "type" in item_data:
-            raise InternalError("Cannot add item with 'type' attribute")
+        if any(k in item_data for k in ("type", TYPE_SHARD_COLNAME, TYPE_SORT_COLNAME, PENDING_COLNAME)):
+            raise InternalError("Cannot add item with reserved attributes")
         item_data["type"] = item.__class__.__name__
+        item_data[TYPE_SHARD_COLNAME] = get_type_shard(item_data["type"], item.id)
+        item_data[TYPE_SORT_COLNAME] = get_type_sort_value(item_data)
+        if (pending := get_pending_value(item_data["type"], item_data)) is not None:
+            item_data[PENDING_COLNAME] = pending
+        return item_data
+
+    async def _add_item(self, item: StoreBaseModel, unique_fields: list[str] | None = None) -> None:
+        table = await self.db.Table(TABLE_NAME)
+        item_data = self._get_item_data(item)
 
         # Prepare the condition expression
-        condition = "attribute_not_exists(id)"
+        condition = Attr("id").not_exists()
         if unique_fields:
             for field in unique_fields:
                 assert hasattr(item, field), f"Item does not have field {field}"
-            condition += " AND " + " AND ".join(f"attribute_not_exists({field})" for field in unique_fields)
+                condition &= Attr(field).not_exists()
 
         # Log the item data before insertion for debugging purposes
         logger.info("Inserting item into DynamoDB: %s", item_data)
@@ -114,105 +443,329 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
         except ClientError:
             logger.exception("Failed to insert item into DynamoDB")
             raise
+        await self._invalidate_items([item.id])
 
     async def _delete_item(self, item: StoreBaseModel | str) -> None:
         table = await self.db.Table(TABLE_NAME)
-        await table.delete_item(Key={"id": item if isinstance(item, str) else item.id})
+        item_id = item if isinstance(item, str) else item.id
+        await table.delete_item(Key={"id": item_id})
+        await self._invalidate_items([item_id])
+
+    async def _batch_write_items(
+        self,
+        puts: Iterable[StoreBaseModel] = (),
+        deletes: Iterable[StoreBaseModel | str] = (),
+    ) -> None:
+        """Puts and deletes many items using batched writes.
+
+        Writes are grouped into `batch_write_item` calls of up to 25 items,
+        with at most `batch_write_concurrency` calls in flight. Items which
+        DynamoDB leaves unprocessed are retried with jittered exponential
+        backoff. Batched puts can't have condition expressions, so they
+        overwrite any existing item with the same ID.
+
+        Args:
+            puts: The items to put.
+            deletes: The items, or item IDs, to delete.
+
+        Raises:
+            InternalError: If some items are still unprocessed after all
+                retries.
+        """
+        # A batch can't touch the same key twice, so later writes win.
+        requests: dict[str, WriteRequestServiceResourceUnionTypeDef] = {}
+        for item in puts:
+            requests[item.id] = {"PutRequest": {"Item": self._get_item_data(item)}}
+        for item in deletes:
+            item_id = item if isinstance(item, str) else item.id
+            requests[item_id] = {"DeleteRequest": {"Key": {"id": item_id}}}
+        if not requests:
+            return
+
+        semaphore = asyncio.Semaphore(settings.dynamo.batch_write_concurrency)
+
+        async def write_batch(batch: list[WriteRequestServiceResourceUnionTypeDef]) -> None:
+            async with semaphore:
+                for attempt in range(settings.dynamo.batch_max_attempts):
+                    if attempt > 0:
+                        await asyncio.sleep(random.uniform(0, settings.dynamo.batch_retry_seconds * 2**attempt))
+                    response = await self.db.batch_write_item(RequestItems={TABLE_NAME: batch})
+                    if not (batch := response.get("UnprocessedItems", {}).get(TABLE_NAME, [])):
+                        return
+            raise InternalError(f"Failed to write {len(batch)} items to DynamoDB")
+
+        writes = list(requests.values())
+        try:
+            await asyncio.gather(
+                *(
+                    write_batch(writes[i : i + DYNAMO_WRITE_BATCH_SIZE])
+                    for i in range(0, len(writes), DYNAMO_WRITE_BATCH_SIZE)
+                )
+            )
+        finally:
+            await self._invalidate_items(requests)
+
+    async def _delete_items(self, items: Iterable[StoreBaseModel | str]) -> None:
+        await self._batch_write_items(deletes=items)
 
     async def _list_items(
         self,
         item_class: type[T],
-        expression_attribute_names: dict[str, str] | None = None,
-        expression_attribute_values: dict[str, Any] | None = None,
-        filter_expression: str | None = None,
-        offset: int | None = None,
+        filter_expression: ConditionBase | None = None,
         limit: int = DEFAULT_SCAN_LIMIT,
     ) -> list[T]:
-        table = await self.db.Table(TABLE_NAME)
+        items, _ = await self._query_type_page(item_class, limit=limit, filter_expression=filter_expression)
+        return items
 
-        query_params = {
-            "IndexName": "type_index",
-            "KeyConditionExpression": Key("type").eq(item_class.__name__),
-            "Limit": limit,
-        }
+    async def _iter_items(self, item_class: type[T], page_size: int = DEFAULT_SCAN_LIMIT) -> AsyncIterator[T]:
+        """Iterates over every item of a given class, one page at a time.
 
-        if expression_attribute_names:
-            query_params["ExpressionAttributeNames"] = expression_attribute_names
-        if expression_attribute_values:
-            query_params["ExpressionAttributeValues"] = expression_attribute_values
-        if filter_expression:
-            query_params["FilterExpression"] = filter_expression
-        if offset:
-            query_params["ExclusiveStartKey"] = {"id": offset}
+        Args:
+            item_class: The class of the items to list.
+            page_size: The number of items to read per query, per shard.
 
-        items = (await table.query(**query_params))["Items"]
-        return [self._validate_item(item, item_class) for item in items]
+        Yields:
+            The items, newest first.
+        """
+        table = await self.db.Table(TABLE_NAME)
+        query = _ShardedQuery(
+            table,
+            item_class.__name__,
+            range_colname=TYPE_SORT_COLNAME,
+            ascending=False,
+            page_size=page_size,
+            filter_expression=None,
+            positions=None,
+        )
+        while (item := await query.next()) is not None:
+            yield self._validate_item(item, item_class)
 
-    async def _list(
+    async def _query_type_page(
         self,
         item_class: type[T],
-        page: int,
-        sort_key: Callable[[T], int] | None = None,
-        search_query: str | None = None,
-    ) -> tuple[list[T], bool]:
-        """Lists items of a given class.
+        range_colname: str = TYPE_SORT_COLNAME,
+        *,
+        limit: int = ITEMS_PER_PAGE,
+        cursor: str | None = None,
+        filter_expression: ConditionBase | None = None,
+        ascending: bool = False,
+    ) -> tuple[list[T], str | None]:
+        """Reads one page of items of a type, from the sharded type index.
+
+        Every shard is queried in parallel and the sorted results are merged,
+        so only about one page per shard is read, however many items there
+        are. The cursor records where to resume each shard.
 
         Args:
             item_class: The class of the items to list.
-            page: The page number to list.
-            sort_key: A function that returns the sort key for an item.
-            search_query: A query string to filter items by.
+            range_colname: The column to sort by. The shard GSI for this
+                column must exist; by default, items are sorted by creation
+                time.
+            limit: The maximum number of items to return.
+            cursor: The cursor returned with the previous page, if any.
+            filter_expression: An additional filter to apply to the items.
+            ascending: Whether to sort in ascending order.
 
         Returns:
-            A tuple of the items on the page and a boolean indicating whether
-            there are more pages.
+            The items on the page, and an opaque cursor for the next page,
+            or None if there are no more items.
         """
-        if search_query:
-            response = await self._list_items(
-                item_class,
-                filter_expression="contains(#part_name, :query) OR contains(description, :query)",
-                expression_attribute_names={"#part_name": "name"},
-                expression_attribute_values={":query": search_query},
-            )
-        else:
-            response = await self._list_items(item_class)
-        if sort_key is not None:
-            response = sorted(response, key=sort_key, reverse=True)
-        return response[(page - 1) * ITEMS_PER_PAGE : page * ITEMS_PER_PAGE], page * ITEMS_PER_PAGE < len(response)
+        positions = None
+        if cursor is not None and not isinstance(positions := decode_cursor(cursor).get("shards"), list):
+            raise ValueError("Invalid pagination cursor")
+
+        # Items are spread evenly over the shards, so each shard only needs a
+        # little more than its share of the page up front.
+        num_shards = settings.dynamo.type_index_shards
+        page_size = min(DEFAULT_SCAN_LIMIT, 2 * -(-(limit + 1) // num_shards))
+        table = await self.db.Table(TABLE_NAME)
+        query = _ShardedQuery(
+            table,
+            item_class.__name__,
+            range_colname=range_colname,
+            ascending=ascending,
+            page_size=page_size,
+            filter_expression=filter_expression,
+            positions=positions,
+        )
 
-    async def _list_me(
+        items: list[dict[str, Any]] = []
+        while len(items) < limit and (item := await query.next()) is not None:
+            items.append(item)
+        next_cursor = encode_cursor({"shards": query.positions}) if query.has_more else None
+        return [self._validate_item(item, item_class) for item in items], next_cursor
+
+    async def _query_page(
         self,
         item_class: type[T],
-        user_id: str,
-        page: int,
-        sort_key: Callable[[T], int],
-        search_query: str | None = None,
-    ) -> tuple[list[T], bool]:
-        if search_query:
-            response = await self._list_items(
-                item_class,
-                filter_expression="(contains(#p_name, :query) OR contains(description, :query)) AND #p_owner=:user_id",
-                expression_attribute_names={"#p_name": "name", "#p_owner": "user_id"},
-                expression_attribute_values={":query": search_query, ":user_id": user_id},
-            )
-        else:
-            response = await self._list_items(
-                item_class,
-                filter_expression="#p_owner=:user_id",
-                expression_attribute_values={":user_id": user_id},
-                expression_attribute_names={"#p_owner": "user_id"},
-            )
-        sorted_items = sorted(response, key=sort_key, reverse=True)
-        return sorted_items[(page - 1) * ITEMS_PER_PAGE : page * ITEMS_PER_PAGE], page * ITEMS_PER_PAGE < len(response)
+        hash_colname: str,
+        hash_value: str,
+        range_colname: str,
+        *,
+        limit: int = ITEMS_PER_PAGE,
+        cursor: str | None = None,
+        filter_expression: ConditionBase | None = None,
+        ascending: bool = False,
+    ) -> tuple[list[T], str | None]:
+        """Reads one page of items from a sorted GSI.
+
+        Args:
+            item_class: The class of the items to list.
+            hash_colname: The hash column of the GSI.
+            hash_value: The value of the hash column to query.
+            range_colname: The range column of the GSI to sort by.
+            limit: The maximum number of items to return.
+            cursor: The cursor returned with the previous page, if any.
+            filter_expression: An additional filter to apply to the items.
+            ascending: Whether to sort in ascending order.
+
+        Returns:
+            The items on the page, and an opaque cursor for the next page,
+            or None if there are no more items.
+        """
+        if hash_colname != "type":
+            type_filter = Attr("type").eq(item_class.__name__)
+            filter_expression = type_filter if filter_expression is None else type_filter & filter_expression
 
-    async def _count_items(self, item_class: type[T]) -> int:
         table = await self.db.Table(TABLE_NAME)
-        item_dict = await table.scan(
-            IndexName="type_index",
-            Select="COUNT",
-            FilterExpression=Key("type").eq(item_class.__name__),
-        )
-        return item_dict["Count"]
+        query_params: dict[str, Any] = {
+            "IndexName": self.get_sorted_gsi_index_name(hash_colname, range_colname),
+            "KeyConditionExpression": Key(hash_colname).eq(hash_value),
+            "ScanIndexForward": ascending,
+            "Limit": limit,
+        }
+        if filter_expression is not None:
+            query_params["FilterExpression"] = filter_expression
+
+        # Filtering happens after the limit is applied, so keep reading until
+        # the page is full or the index is exhausted.
+        start_key = None if cursor is None else decode_cursor(cursor)
+        if start_key is not None and (
+            set(start_key) != {"id", hash_colname, range_colname} or start_key[hash_colname] != hash_value
+        ):
+            raise ValueError("Invalid pagination cursor")
+        items: list[dict[str, Any]] = []
+        while True:
+            if start_key is not None:
+                query_params["ExclusiveStartKey"] = start_key
+            response = await table.query(**query_params)
+            items.extend(response["Items"])
+            start_key = response.get("LastEvaluatedKey")
+            if len(items) >= limit or start_key is None:
+                break
+
+        page = items[:limit]
+        next_cursor = None
+        if page and (len(items) > limit or start_key is not None):
+            next_cursor = encode_cursor({k: page[-1][k] for k in ("id", hash_colname, range_colname)})
+
+        return [self._validate_item(item, item_class) for item in page], next_cursor
+
+    async def _count_items(self, item_class: type[T], filter_expression: ConditionBase | None = None) -> int:
+        table = await self.db.Table(TABLE_NAME)
+        index_name = self.get_sorted_gsi_index_name(TYPE_SHARD_COLNAME, TYPE_SORT_COLNAME)
+
+        async def count_shard(shard: int) -> int:
+            query_params: dict[str, Any] = {
+                "IndexName": index_name,
+                "KeyConditionExpression": Key(TYPE_SHARD_COLNAME).eq(f"{item_class.__name__}#{shard}"),
+                "Select": "COUNT",
+            }
+            if filter_expression is not None:
+                query_params["FilterExpression"] = filter_expression
+            count = 0
+            while True:
+                response = await table.query(**query_params)
+                count += response["Count"]
+                if (start_key := response.get("LastEvaluatedKey")) is None:
+                    return count
+                query_params["ExclusiveStartKey"] = start_key
+
+        counts = await asyncio.gather(*(count_shard(shard) for shard in range(settings.dynamo.type_index_shards)))
+        return sum(counts)
+
+    async def backfill_type_shards(self) -> int:
+        """Sets the type index attributes on items written before they existed.
+
+        The table is scanned in parallel segments, at a limited rate, and
+        items which already have the right shard, sort value and pending
+        index value are skipped, so this can be re-run safely, including
+        after changing the number of shards.
+
+        Returns:
+            The number of items which were updated.
+        """
+        table = await self.db.Table(TABLE_NAME)
+        limiter = RateLimiter(settings.dynamo.backfill_requests_per_second)
+        semaphore = asyncio.Semaphore(settings.dynamo.batch_write_concurrency)
+        total_segments = settings.dynamo.backfill_segments
+        names = {
+            "#id": "id",
+            "#type": "type",
+            "#status": "status",
+            "#shard": TYPE_SHARD_COLNAME,
+            "#sort": TYPE_SORT_COLNAME,
+            "#pending": PENDING_COLNAME,
+        }
+        names.update({f"#{colname}": colname for colname in TYPE_SORT_SOURCE_COLNAMES})
+
+        async def update(item: dict[str, Any]) -> bool:
+            shard = get_type_shard(str(item["type"]), str(item["id"]))
+            sort_value = get_type_sort_value(item)
+            pending = get_pending_value(str(item["type"]), item)
+            if (
+                item.get(TYPE_SHARD_COLNAME) == shard
+                and item.get(TYPE_SORT_COLNAME) == sort_value
+                and item.get(PENDING_COLNAME) == pending
+            ):
+                return False
+            update_expression = "SET #shard = :shard, #sort = :sort"
+            values: dict[str, Any] = {":shard": shard, ":sort": sort_value}
+            if pending is None:
+                update_expression += " REMOVE #pending"
+            else:
+                update_expression += ", #pending = :pending"
+                values[":pending"] = pending
+            async with semaphore:
+                await limiter.wait()
+                try:
+                    await table.update_item(
+                        Key={"id": item["id"]},
+                        UpdateExpression=update_expression,
+                        ConditionExpression=Attr("id").exists(),
+                        ExpressionAttributeNames={
+                            "#shard": TYPE_SHARD_COLNAME,
+                            "#sort": TYPE_SORT_COLNAME,
+                            "#pending": PENDING_COLNAME,
+                        },
+                        ExpressionAttributeValues=values,
+                    )
+                except ClientError as e:
+                    # The item was deleted since it was scanned.
+                    if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                        return False
+                    raise
+            return True
+
+        async def backfill_segment(segment: int) -> int:
+            scan_params: dict[str, Any] = {
+                "Segment": segment,
+                "TotalSegments": total_segments,
+                "FilterExpression": Attr("type").exists(),
+                "ProjectionExpression": ", ".join(names),
+                "ExpressionAttributeNames": names,
+            }
+            num_updated = 0
+            while True:
+                await limiter.wait()
+                response = await table.scan(**scan_params)
+                num_updated += sum(await asyncio.gather(*(update(item) for item in response["Items"])))
+                if (start_key := response.get("LastEvaluatedKey")) is None:
+                    return num_updated
+                scan_params["ExclusiveStartKey"] = start_key
+
+        counts = await asyncio.gather(*(backfill_segment(segment) for segment in range(total_segments)))
+        return sum(counts)
 
     def _validate_item(self, data: dict[str, Any], item_class: type[T]) -> T:
         if (item_type := data.pop("type")) != item_class.__name__:
@@ -236,13 +789,21 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
     ) -> T | None: ...
 
     async def _get_item(self, item_id: str, item_class: type[T], throw_if_missing: bool = False) -> T | None:
-        table = await self.db.Table(TABLE_NAME)
-        item_dict = await table.get_item(Key={"id": item_id})
-        if "Item" not in item_dict:
+        async def read() -> dict[str, Any] | None:
+            if self.__loader is not None:
+                return await self.__loader.load(item_id)
+            table = await self.db.Table(TABLE_NAME)
+            item_dict = await table.get_item(Key={"id": item_id})
+            return item_dict.get("Item")
+
+        if item_cache.caches(item_class.__name__):
+            item_data = await self._read_through(item_id, read)
+        else:
+            item_data = await read()
+        if item_data is None:
             if throw_if_missing:
                 raise ItemNotFoundError
             return None
-        item_data = item_dict["Item"]
         return self._validate_item(item_data, item_class)
 
     async def _item_exists(self, item_id: str) -> bool:
@@ -250,27 +811,86 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
         item_dict = await table.get_item(Key={"id": item_id})
         return "Item" in item_dict
 
+    async def _batch_get_items(
+        self,
+        item_ids: Iterable[str],
+        attributes: list[str] | None = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> dict[str, dict[str, Any]]:
+        """Gets many raw items by ID using batched reads.
+
+        Repeated IDs are only fetched once. Chunks of up to 100 keys are read
+        concurrently, with at most `batch_get_concurrency` in flight, and
+        keys which DynamoDB leaves unprocessed are retried with jittered
+        exponential backoff.
+
+        Args:
+            item_ids: The IDs of the items to get.
+            attributes: If provided, only fetch these attributes (plus the
+                ID), instead of the full items.
+            chunk_size: The number of keys per request, at most 100.
+
+        Returns:
+            The items which exist, keyed by ID.
+
+        Raises:
+            InternalError: If some keys are still unprocessed after all
+                retries.
+        """
+        unique_ids = list(dict.fromkeys(item_ids))
+        names: dict[str, str] = {}
+        if attributes is not None:
+            names = {f"#a{i}": attribute for i, attribute in enumerate(dict.fromkeys(["id", *attributes]))}
+
+        semaphore = asyncio.Semaphore(settings.dynamo.batch_get_concurrency)
+        items: dict[str, dict[str, Any]] = {}
+
+        async def get_chunk(chunk: list[str]) -> None:
+            request: KeysAndAttributesServiceResourceTypeDef = {"Keys": [{"id": item_id} for item_id in chunk]}
+            if names:
+                request["ProjectionExpression"] = ", ".join(names)
+                request["ExpressionAttributeNames"] = names
+            async with semaphore:
+                for attempt in range(settings.dynamo.batch_max_attempts):
+                    if attempt > 0:
+                        await asyncio.sleep(random.uniform(0, settings.dynamo.batch_retry_seconds * 2**attempt))
+                    response = await self.db.batch_get_item(RequestItems={TABLE_NAME: request})
+                    for item in response["Responses"].get(TABLE_NAME, []):
+                        items[str(item["id"])] = item
+                    unprocessed = response.get("UnprocessedKeys", {}).get(TABLE_NAME)
+                    if unprocessed is None or not unprocessed["Keys"]:
+                        return
+                    request["Keys"] = unprocessed["Keys"]
+            raise InternalError(f"Failed to read {len(request['Keys'])} items from DynamoDB")
+
+        await asyncio.gather(
+            *(get_chunk(unique_ids[i : i + chunk_size]) for i in range(0, len(unique_ids), chunk_size)),
+        )
+        return items
+
     async def _get_item_batch(
         self,
         item_ids: list[str],
         item_class: type[T],
         chunk_size: int = DEFAULT_CHUNK_SIZE,
     ) -> list[T]:
-        items: list[T] = []
-        for i in range(0, len(item_ids), chunk_size):
-            chunk = item_ids[i : i + chunk_size]
-            keys = [{"id": item_id} for item_id in chunk]
-            response = await self.db.batch_get_item(RequestItems={TABLE_NAME: {"Keys": keys}})
-
-            # Maps the items to their IDs to return them in the correct order.
-            item_ids_to_items: dict[str, T] = {}
-            for item in response["Responses"][TABLE_NAME]:
-                item_impl = self._validate_item(item, item_class)
-                item_ids_to_items[item_impl.id] = item_impl
-
-            items += [item for item in (item_ids_to_items.get(item_id) for item_id in chunk) if item is not None]
+        unique_ids = list(dict.fromkeys(item_ids))
+        cached = item_cache.caches(item_class.__name__)
+        raw_items = await item_cache.get_many(unique_ids) if cached else {}
+        if missing_ids := [item_id for item_id in unique_ids if item_id not in raw_items]:
+            read_at = time.time()
+            if self.__loader is not None:
+                loaded = await self.__loader.load_many(missing_ids)
+                read_items = {item_id: item for item_id, item in zip(missing_ids, loaded) if item is not None}
+            else:
+                read_items = await self._batch_get_items(missing_ids, chunk_size=chunk_size)
+            if cached:
+                await item_cache.put_many(read_items, read_at)
+            raw_items.update(read_items)
+        items = {item_id: self._validate_item(item, item_class) for item_id, item in raw_items.items()}
 
-        return items
+        # Returns the items in the same order as the requested IDs.
+        return [items[item_id] for item_id in item_ids if item_id in items]
 
     async def _get_items_from_secondary_index(
         self,
@@ -302,37 +922,87 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
         items = await self._get_items_from_secondary_index(secondary_index_name, secondary_index_value, item_class)
         return len(items) > 0
 
+    async def _query_secondary_index(
+        self,
+        secondary_index_name: str,
+        secondary_index_value: str,
+        item_type: str,
+    ) -> list[dict[str, Any]]:
+        table = await self.db.Table(TABLE_NAME)
+        query_params: dict[str, Any] = {
+            "IndexName": self.get_gsi_index_name(secondary_index_name),
+            "KeyConditionExpression": Key(secondary_index_name).eq(secondary_index_value),
+            "FilterExpression": Key("type").eq(item_type),
+        }
+        items: list[dict[str, Any]] = []
+        while True:
+            response = await table.query(**query_params)
+            items += response["Items"]
+            if (start_key := response.get("LastEvaluatedKey")) is None:
+                return items
+            query_params["ExclusiveStartKey"] = start_key
+
+    async def _get_pending_items(self, item_class: type[T]) -> list[T]:
+        """Gets the items of a type which are still being processed.
+
+        This reads the sparse pending index, so it costs as much as the number
+        of pending items rather than a scan of the whole table.
+
+        Args:
+            item_class: The type of item to get.
+
+        Returns:
+            The pending items.
+        """
+        items = await self._query_secondary_index(PENDING_COLNAME, item_class.__name__, item_class.__name__)
+        return [self._validate_item(item, item_class) for item in items]
+
     async def _get_items_from_secondary_index_batch(
         self,
         secondary_index_name: str,
         secondary_index_values: list[str],
         item_class: type[T],
-        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        coalesce: bool = False,
     ) -> list[list[T]]:
-        items: list[list[T]] = []
-        table = await self.db.Table(TABLE_NAME)
-
-        for i in range(0, len(secondary_index_values), chunk_size):
-            chunk = secondary_index_values[i : i + chunk_size]
-            response = await table.scan(
-                IndexName=self.get_gsi_index_name(secondary_index_name),
-                FilterExpression=(Attr(secondary_index_name).is_in(chunk) & Attr("type").eq(item_class.__name__)),
-            )
+        """Gets the items matching each of several secondary index values.
 
-            # Maps the items to their IDs.
-            chunk_items = [self._validate_item(item, item_class) for item in response["Items"]]
-            chunk_ids_to_items: dict[str, list[T]] = {}
-            for item in chunk_items:
-                item_id = getattr(item, secondary_index_name)
-                if item_id in chunk_ids_to_items:
-                    chunk_ids_to_items[item_id].append(item)
-                else:
-                    chunk_ids_to_items[item_id] = [item]
+        Each distinct value is read with its own fully-paginated query, with
+        at most `query_concurrency` queries in flight, so the cost grows with
+        the number of values rather than the size of the table.
 
-            # Adds the items to the list.
-            items += [chunk_ids_to_items.get(id, []) for id in chunk]
+        Args:
+            secondary_index_name: The name of the secondary index.
+            secondary_index_values: The values to look up.
+            item_class: The class of the items to return.
+            coalesce: If set, share a query with any identical query which is
+                already in flight, from this or any other request.
 
-        return items
+        Returns:
+            The matching items for each value, in the same order as the values.
+        """
+        semaphore = asyncio.Semaphore(settings.dynamo.query_concurrency)
+
+        async def query(value: str) -> list[dict[str, Any]]:
+            async with semaphore:
+                return await self._query_secondary_index(secondary_index_name, value, item_class.__name__)
+
+        async def coalesced_query(value: str) -> list[dict[str, Any]]:
+            key = (secondary_index_name, value, item_class.__name__)
+            if (task := _inflight_queries.get(key)) is None:
+                task = asyncio.create_task(query(value))
+                _inflight_queries[key] = task
+                task.add_done_callback(lambda _: _inflight_queries.pop(key, None))
+            return await asyncio.shield(task)
+
+        unique_values = list(dict.fromkeys(secondary_index_values))
+        results = await asyncio.gather(*((coalesced_query if coalesce else query)(value) for value in unique_values))
+
+        # Copies the raw items, since coalesced results are shared between callers.
+        items = {
+            value: [self._validate_item(dict(item), item_class) for item in value_items]
+            for value, value_items in zip(unique_values, results)
+        }
+        return [items[value] for value in secondary_index_values]
 
     @overload
     async def _get_unique_item_from_secondary_index(
@@ -378,13 +1048,23 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
     async def _update_item(self, id: str, model_type: type[T], updates: dict[str, Any]) -> None:
         table_name = TABLE_NAME
         key = {"id": id}
+        if any(updates.get(k) is not None for k in TYPE_SORT_SOURCE_COLNAMES):
+            updates = {**updates, TYPE_SORT_COLNAME: get_type_sort_value(updates)}
+        removes: list[str] = []
+        if "status" in updates:
+            if (pending := get_pending_value(model_type.__name__, updates)) is not None:
+                updates = {**updates, PENDING_COLNAME: pending}
+            else:
+                removes.append(PENDING_COLNAME)
 
         # Add condition to ensure we're updating the correct type
         condition_expression = "#type = :type"
         update_expression = "SET " + ", ".join(f"#{k} = :{k}" for k in updates.keys())
+        if removes:
+            update_expression += " REMOVE " + ", ".join(f"#{k}" for k in removes)
 
         expression_attribute_values = {":type": model_type.__name__, **{f":{k}": v for k, v in updates.items()}}
-        expression_attribute_names = {"#type": "type", **{f"#{k}": k for k in updates.keys()}}
+        expression_attribute_names = {"#type": "type", **{f"#{k}": k for k in [*updates.keys(), *removes]}}
 
         try:
             await self.db.meta.client.update_item(
@@ -402,6 +1082,8 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
             elif e.response["Error"]["Code"] == "ConditionalCheckFailedException":
                 raise ItemNotFoundError(f"Item not found or is not of type {model_type.__name__}")
             raise
+        finally:
+            await self._invalidate_items([id])
 
     async def _upload_to_s3(self, data: IO[bytes], name: str, filename: str, content_type: str) -> None:
         """Uploads some data to S3."""
@@ -421,6 +1103,114 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
             logger.exception("S3 upload failed: %s", e)
             raise
 
+    async def _stream_to_s3(
+        self,
+        data: IO[bytes] | AsyncReadable,
+        name: str,
+        filename: str,
+        content_type: str,
+    ) -> tuple[int, str]:
+        """Streams data to S3 without reading all of it into memory.
+
+        Data is read one part at a time. Objects smaller than one part are
+        uploaded with a single `put_object`; larger objects use a multipart
+        upload with a bounded number of parts in flight, so memory use is at
+        most `multipart_concurrency + 1` parts regardless of the object size.
+
+        Args:
+            data: The file to upload, positioned at the start of the content,
+                or an async reader like an `UploadFile`.
+            name: The filename to download the object as.
+            filename: The S3 key, relative to the S3 prefix.
+            content_type: The content type of the object.
+
+        Returns:
+            The size of the object in bytes and its SHA-256 hex digest.
+        """
+        client = self.s3.meta.client
+        bucket, key = settings.s3.bucket, f"{settings.s3.prefix}{filename}"
+        part_size = settings.s3.multipart_part_size
+        sanitized_name = name.replace("\u202f", " ").replace("\xa0", " ")
+        content_disposition = f'attachment; filename="{sanitized_name}"'
+        hasher = hashlib.sha256()
+        size = 0
+
+        async def read_part() -> bytes:
+            nonlocal size
+            chunks: list[bytes] = []
+            remaining = part_size
+            while remaining > 0:
+                chunk = data.read(remaining)
+                if inspect.isawaitable(chunk):
+                    chunk = await chunk
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+            part = b"".join(chunks)
+            hasher.update(part)
+            size += len(part)
+            return part
+
+        part = await read_part()
+        if len(part) < part_size:
+            await client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=part,
+                ContentType=content_type,
+                ContentDisposition=content_disposition,
+            )
+            logger.info("S3 upload successful")
+            return size, hasher.hexdigest()
+
+        upload_id = (
+            await client.create_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                ContentType=content_type,
+                ContentDisposition=content_disposition,
+            )
+        )["UploadId"]
+        semaphore = asyncio.Semaphore(settings.s3.multipart_concurrency)
+        tasks: list[asyncio.Task[CompletedPartTypeDef]] = []
+
+        async def upload_part(part_number: int, body: bytes) -> CompletedPartTypeDef:
+            try:
+                response = await client.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body,
+                )
+                return {"ETag": response["ETag"], "PartNumber": part_number}
+            finally:
+                semaphore.release()
+
+        try:
+            while part:
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, part)))
+                part = await read_part()
+            parts = await asyncio.gather(*tasks)
+            await client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            logger.exception("S3 multipart upload failed")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+
+        logger.info("S3 multipart upload successful (%d parts)", len(tasks))
+        return size, hasher.hexdigest()
+
     async def _download_from_s3(self, filename: str) -> StreamingBody:
         """Downloads an object from S3.
 
@@ -441,8 +1231,83 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
         Args:
             filename: The filename of the object to delete.
         """
-        bucket = await self.s3.Bucket(settings.s3.bucket)
-        await bucket.delete_objects(Delete={"Objects": [{"Key": f"{settings.s3.prefix}{filename}"}]})
+        await self._delete_many_from_s3([filename])
+
+    async def _delete_many_from_s3(self, filenames: Iterable[str]) -> list[str]:
+        """Deletes many objects from S3, in batches of up to 1000 keys.
+
+        At most `delete_concurrency` batches are in flight at once. Keys which
+        fail with a transient error, or batches which are throttled, are
+        retried with jittered exponential backoff.
+
+        Args:
+            filenames: The filenames of the objects to delete.
+
+        Returns:
+            The filenames which could not be deleted.
+        """
+        client = self.s3.meta.client
+        prefix = settings.s3.prefix
+        semaphore = asyncio.Semaphore(settings.s3.delete_concurrency)
+
+        async def delete_batch(batch: list[str]) -> list[str]:
+            failed: list[str] = []
+            async with semaphore:
+                for attempt in range(settings.s3.delete_max_attempts):
+                    if attempt > 0:
+                        await asyncio.sleep(random.uniform(0, settings.s3.delete_retry_seconds * 2**attempt))
+                    objects: list[ObjectIdentifierTypeDef] = [{"Key": f"{prefix}{filename}"} for filename in batch]
+                    try:
+                        response = await client.delete_objects(
+                            Bucket=settings.s3.bucket,
+                            Delete={"Objects": objects, "Quiet": True},
+                        )
+                    except ClientError as e:
+                        if e.response["Error"]["Code"] not in RETRYABLE_S3_ERRORS:
+                            raise
+                        logger.warning("Deleting %d objects was throttled: %s", len(batch), e)
+                        continue
+                    retry: list[str] = []
+                    for error in response.get("Errors", []):
+                        filename = error["Key"].removeprefix(prefix)
+                        if error["Code"] in RETRYABLE_S3_ERRORS:
+                            retry.append(filename)
+                        else:
+                            logger.warning("Failed to delete %s: %s", filename, error.get("Message"))
+                            failed.append(filename)
+                    if not (batch := retry):
+                        return failed
+            logger.warning("Giving up on deleting %d objects", len(batch))
+            return failed + batch
+
+        unique_filenames = list(dict.fromkeys(filenames))
+        batches = [
+            unique_filenames[i : i + S3_DELETE_BATCH_SIZE]
+            for i in range(0, len(unique_filenames), S3_DELETE_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(*(delete_batch(batch) for batch in batches))
+        return [filename for failed in results for filename in failed]
+
+    async def _delete_s3_prefix(self, filename_prefix: str) -> list[str]:
+        """Deletes every object under a prefix from S3.
+
+        Args:
+            filename_prefix: The prefix to delete, relative to the S3 prefix.
+
+        Returns:
+            The filenames which could not be deleted.
+        """
+        client = self.s3.meta.client
+        prefix = settings.s3.prefix
+        list_params: dict[str, Any] = {"Bucket": settings.s3.bucket, "Prefix": f"{prefix}{filename_prefix}"}
+        failed: list[str] = []
+        while True:
+            response = await client.list_objects_v2(**list_params)
+            filenames = [obj["Key"].removeprefix(prefix) for obj in response.get("Contents", [])]
+            failed += await self._delete_many_from_s3(filenames)
+            if not response.get("IsTruncated"):
+                return failed
+            list_params["ContinuationToken"] = response["NextContinuationToken"]
 
     async def _create_s3_bucket(self) -> None:
         """Creates an S3 bucket if it does not already exist."""
@@ -503,31 +1368,17 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
 
             if gsis:
                 table = await self.db.create_table(
-                    AttributeDefinitions=[
-                        {"AttributeName": n, "AttributeType": t}
-                        for n, t in itertools.chain(((n, t) for (n, t, _) in keys), ((n, t) for _, n, t, _ in gsis))
-                    ],
+                    AttributeDefinitions=get_attribute_definitions(keys, gsis),
                     TableName=name,
                     KeySchema=[{"AttributeName": n, "KeyType": t} for n, _, t in keys],
-                    GlobalSecondaryIndexes=(
-                        [
-                            {
-                                "IndexName": i,
-                                "KeySchema": [{"AttributeName": n, "KeyType": t}],
-                                "Projection": {"ProjectionType": "ALL"},
-                            }
-                            for i, n, _, t in gsis
-                        ]
-                    ),
+                    GlobalSecondaryIndexes=[get_gsi_definition(gsi) for gsi in gsis],
                     DeletionProtectionEnabled=deletion_protection,
                     BillingMode="PAY_PER_REQUEST",
                 )
 
             else:
                 table = await self.db.create_table(
-                    AttributeDefinitions=[
-                        {"AttributeName": n, "AttributeType": t} for n, t in ((n, t) for (n, t, _) in keys)
-                    ],
+                    AttributeDefinitions=get_attribute_definitions(keys),
                     TableName=name,
                     KeySchema=[{"AttributeName": n, "KeyType": t} for n, _, t in keys],
                     DeletionProtectionEnabled=deletion_protection,
@@ -536,6 +1387,46 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
 
             await table.wait_until_exists()
 
+    async def _add_missing_gsis(
+        self,
+        name: str,
+        keys: list[TableKey],
+        gsis: list[GlobalSecondaryIndex],
+        poll_seconds: float = 10.0,
+    ) -> None:
+        """Adds any GSIs which are missing from an existing table.
+
+        DynamoDB only allows creating one GSI per `UpdateTable` call, so this
+        adds them one at a time and waits for each one to finish backfilling
+        before starting the next.
+
+        Args:
+            name: Name of the table.
+            keys: Primary and secondary keys of the table.
+            gsis: The GSIs that the table should have.
+            poll_seconds: How often to check whether a new GSI is active.
+        """
+        client = self.db.meta.client
+        table_info = (await client.describe_table(TableName=name))["Table"]
+        existing = {gsi["IndexName"] for gsi in table_info.get("GlobalSecondaryIndexes", [])}
+        for gsi in gsis:
+            index_name = gsi[0]
+            if index_name in existing:
+                continue
+            logger.info("Adding GSI %s to table %s", index_name, name)
+            await client.update_table(
+                TableName=name,
+                AttributeDefinitions=get_attribute_definitions(keys, [gsi]),
+                GlobalSecondaryIndexUpdates=[{"Create": get_gsi_definition(gsi)}],
+            )
+            while True:
+                table_info = (await client.describe_table(TableName=name))["Table"]
+                statuses = {g["IndexName"]: g["IndexStatus"] for g in table_info.get("GlobalSecondaryIndexes", [])}
+                if statuses.get(index_name) == "ACTIVE":
+                    break
+                await asyncio.sleep(poll_seconds)
+            logger.info("GSI %s is active", index_name)
+
     async def _delete_dynamodb_table(self, name: str) -> None:
         """Deletes a table in the Dynamo database.
 
@@ -590,6 +1481,176 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
             logger.error("Failed to generate presigned URL: %s", e)
             raise
 
+    async def create_presigned_multipart_upload(self, filename: str, s3_key: str, content_type: str) -> str:
+        """Starts a multipart upload which the client uploads parts to directly.
+
+        Args:
+            filename: Original filename for Content-Disposition
+            s3_key: The S3 key where the file will be stored
+            content_type: The content type of the file
+
+        Returns:
+            The upload ID
+        """
+        response = await self.s3.meta.client.create_multipart_upload(
+            Bucket=settings.s3.bucket,
+            Key=f"{settings.s3.prefix}{s3_key}",
+            ContentType=content_type,
+            ContentDisposition=f'attachment; filename="{filename}"',
+            ChecksumAlgorithm="SHA256",
+        )
+        return response["UploadId"]
+
+    async def generate_presigned_part_urls(
+        self,
+        s3_key: str,
+        upload_id: str,
+        parts: list[tuple[int, str | None]],
+        expires_in: int = 3600,
+    ) -> list[str]:
+        """Generates presigned URLs for uploading parts of a multipart upload.
+
+        Args:
+            s3_key: The S3 key of the upload
+            upload_id: The multipart upload ID
+            parts: The part numbers to sign, each with the base64 SHA-256
+                checksum of the part if the client knows it up front. The
+                client must send the checksum in the `x-amz-checksum-sha256`
+                header, and S3 rejects the part if the body doesn't match.
+            expires_in: Number of seconds until the URLs expire
+
+        Returns:
+            The presigned URL for each part, in the same order as `parts`
+        """
+        for part_number, _ in parts:
+            if not 1 <= part_number <= MAX_MULTIPART_PARTS:
+                raise ValueError(f"Part number must be between 1 and {MAX_MULTIPART_PARTS}, got {part_number}")
+
+        async def sign(part_number: int, checksum: str | None) -> str:
+            params: dict[str, Any] = {
+                "Bucket": settings.s3.bucket,
+                "Key": f"{settings.s3.prefix}{s3_key}",
+                "UploadId": upload_id,
+                "PartNumber": part_number,
+            }
+            if checksum is None:
+                params["ChecksumAlgorithm"] = "SHA256"
+            else:
+                params["ChecksumSHA256"] = checksum
+            return await self.s3.meta.client.generate_presigned_url(
+                ClientMethod="upload_part",
+                Params=params,
+                ExpiresIn=expires_in,
+            )
+
+        return await asyncio.gather(*(sign(part_number, checksum) for part_number, checksum in parts))
+
+    async def list_multipart_upload_parts(self, s3_key: str, upload_id: str) -> list[CompletedPartTypeDef]:
+        """Lists the parts which have been uploaded so far, to resume an upload.
+
+        Args:
+            s3_key: The S3 key of the upload
+            upload_id: The multipart upload ID
+
+        Returns:
+            The uploaded parts, ordered by part number
+
+        Raises:
+            ItemNotFoundError: If the upload doesn't exist, or was already
+                completed or aborted.
+        """
+        parts: list[CompletedPartTypeDef] = []
+        paginator = self.s3.meta.client.get_paginator("list_parts")
+        try:
+            async for page in paginator.paginate(
+                Bucket=settings.s3.bucket,
+                Key=f"{settings.s3.prefix}{s3_key}",
+                UploadId=upload_id,
+            ):
+                for part in page.get("Parts", []):
+                    completed: CompletedPartTypeDef = {"PartNumber": part["PartNumber"], "ETag": part["ETag"]}
+                    if "ChecksumSHA256" in part:
+                        completed["ChecksumSHA256"] = part["ChecksumSHA256"]
+                    parts.append(completed)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchUpload":
+                raise ItemNotFoundError(f"Upload {upload_id} not found")
+            raise
+        return parts
+
+    async def complete_multipart_upload(self, s3_key: str, upload_id: str, parts: list[CompletedPartTypeDef]) -> None:
+        """Completes a multipart upload from its uploaded parts.
+
+        Args:
+            s3_key: The S3 key of the upload
+            upload_id: The multipart upload ID
+            parts: The uploaded parts, with the ETag and SHA-256 checksum
+                which S3 returned for each one
+
+        Raises:
+            ItemNotFoundError: If the upload doesn't exist, or was already
+                completed or aborted.
+            ValueError: If the parts don't match the uploaded parts.
+        """
+        try:
+            await self.s3.meta.client.complete_multipart_upload(
+                Bucket=settings.s3.bucket,
+                Key=f"{settings.s3.prefix}{s3_key}",
+                UploadId=upload_id,
+                MultipartUpload={"Parts": sorted(parts, key=lambda part: part["PartNumber"])},
+            )
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "NoSuchUpload":
+                raise ItemNotFoundError(f"Upload {upload_id} not found")
+            # S3 responds with "InvalidRequest" if a part's checksum is
+            # missing, since the upload was created with a SHA-256 checksum.
+            if code in ("InvalidPart", "InvalidPartOrder", "EntityTooSmall", "InvalidRequest"):
+                raise ValueError(f"Could not complete the upload: {e.response['Error'].get('Message', e)}")
+            raise
+
+    async def abort_multipart_upload(self, s3_key: str, upload_id: str) -> None:
+        """Aborts a multipart upload, discarding any uploaded parts.
+
+        Args:
+            s3_key: The S3 key of the upload
+            upload_id: The multipart upload ID
+
+        Raises:
+            ItemNotFoundError: If the upload doesn't exist, or was already
+                completed or aborted.
+        """
+        try:
+            await self.s3.meta.client.abort_multipart_upload(
+                Bucket=settings.s3.bucket,
+                Key=f"{settings.s3.prefix}{s3_key}",
+                UploadId=upload_id,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchUpload":
+                raise ItemNotFoundError(f"Upload {upload_id} not found")
+            raise
+
+    async def _head_object(self, filename: str) -> HeadObjectOutputTypeDef | None:
+        """Gets the metadata of an object in S3, including its checksum.
+
+        Args:
+            filename: The name of the file
+
+        Returns:
+            The object metadata, or None if the object doesn't exist
+        """
+        try:
+            return await self.s3.meta.client.head_object(
+                Bucket=settings.s3.bucket,
+                Key=f"{settings.s3.prefix}{filename}",
+                ChecksumMode="ENABLED",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
     async def get_file_size(self, filename: str) -> int | None:
         """Gets the size of a file in S3.
 
@@ -618,16 +1679,24 @@ class BaseCrud(AsyncContextManager["BaseCrud"]):
         content_type: str,
         checksum_algorithm: str = "SHA256",
         expiration: int = 3600,
+        *,
+        fetch_checksum: bool = True,
     ) -> tuple[str, str | None]:
-        """Generate a presigned URL for downloading a file from S3 with checksum."""
+        """Generate a presigned URL for downloading a file from S3 with checksum.
+
+        If `fetch_checksum` is False, the object is not looked up and the
+        returned checksum is None, for callers which already stored it.
+        """
         try:
             full_key = f"{settings.s3.prefix}{s3_key}"
-            head_response = await self.s3.meta.client.head_object(
-                Bucket=settings.s3.bucket, Key=full_key, ChecksumMode="ENABLED"
-            )
-            # Cast the response to str | None
-            checksum_value = head_response.get(f"Checksum{checksum_algorithm}")
-            checksum: str | None = str(checksum_value) if checksum_value is not None else None
+            checksum: str | None = None
+            if fetch_checksum:
+                head_response = await self.s3.meta.client.head_object(
+                    Bucket=settings.s3.bucket, Key=full_key, ChecksumMode="ENABLED"
+                )
+                # Cast the response to str | None
+                checksum_value = head_response.get(f"Checksum{checksum_algorithm}")
+                checksum = str(checksum_value) if checksum_value is not None else None
 
             url = await self.s3.meta.client.generate_presigned_url(
                 "get_object",
@@ -0,0 +1,227 @@
+"""Defines the CRUD interface for content-addressed blob storage.
+
+Each distinct piece of content is stored once in S3, keyed by its SHA-256
+digest, with a reference count in DynamoDB tracking how many artifacts point
+at it. Uploading content which is already stored just bumps the count and
+skips the S3 upload entirely.
+
+When the last reference is released, the row is first marked as a
+tombstone, then the object is deleted, then the row. An upload of the same
+content which finds the tombstone waits for the deletion to finish before
+uploading the object again, so it can never lose its object to the
+deletion.
+"""
+
+import asyncio
+import hashlib
+import inspect
+import logging
+import tempfile
+import time
+from decimal import Decimal
+from typing import IO
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from www.app.crud.base import TABLE_NAME, AsyncReadable, BaseCrud
+from www.app.errors import InternalError
+from www.app.model import Blob, get_blob_name
+from www.settings import settings
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobsCrud(BaseCrud):
+    """CRUD operations for content-addressed blobs."""
+
+    async def _spool_and_hash(self, data: IO[bytes] | AsyncReadable) -> tuple[IO[bytes], int, str]:
+        """Reads some data through a hasher into a temporary file.
+
+        The content hash has to be known before deciding whether to upload,
+        so streams which can't be rewound are spooled first. Small blobs stay
+        in memory; larger ones spill to disk.
+
+        Args:
+            data: The data to read.
+
+        Returns:
+            The spooled file, positioned at the start, along with the size
+            and hex SHA-256 digest of the data.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=settings.s3.multipart_part_size)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            while True:
+                chunk = data.read(HASH_CHUNK_SIZE)
+                if inspect.isawaitable(chunk):
+                    chunk = await chunk
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size += len(chunk)
+                await asyncio.to_thread(spool.write, chunk)
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool, size, hasher.hexdigest()
+
+    async def _acquire_blob(self, content_hash: str) -> bool:
+        """Adds a reference to a blob, if it is already stored.
+
+        If the blob is being deleted, this waits for the deletion to finish,
+        and then reports the blob as missing.
+
+        Args:
+            content_hash: The blob's content hash.
+
+        Returns:
+            True if the blob exists and the reference was added.
+        """
+        table = await self.db.Table(TABLE_NAME)
+        while True:
+            try:
+                await table.update_item(
+                    Key={"id": content_hash},
+                    UpdateExpression="ADD ref_count :inc",
+                    ConditionExpression=Attr("type").eq(Blob.__name__) & Attr("deleting_at").not_exists(),
+                    ExpressionAttributeValues={":inc": 1},
+                )
+                return True
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+
+            row = (await table.get_item(Key={"id": content_hash}, ConsistentRead=True)).get("Item")
+            if row is None or row.get("type") != Blob.__name__:
+                return False
+            if isinstance(deleting_at := row.get("deleting_at"), Decimal):
+                await self._wait_for_blob_deletion(content_hash, int(deleting_at))
+            # Otherwise, the tombstone was replaced by a new blob in the meantime.
+
+    async def _wait_for_blob_deletion(self, content_hash: str, deleting_at: int) -> None:
+        """Waits for a blob tombstone to go away, finishing the deletion if it is stuck.
+
+        If the tombstone outlives `blob_deletion_timeout_seconds`, the process
+        deleting the blob most likely died part way through, so the deletion
+        is finished here instead.
+
+        Args:
+            content_hash: The blob's content hash.
+            deleting_at: The time the blob was marked for deletion.
+        """
+        table = await self.db.Table(TABLE_NAME)
+        deadline = deleting_at + settings.artifact.blob_deletion_timeout_seconds
+        delay = 0.05
+        while time.time() < deadline:
+            await asyncio.sleep(min(delay, max(deadline - time.time(), 0)))
+            delay = min(delay * 2, 1.0)
+            row = (await table.get_item(Key={"id": content_hash}, ConsistentRead=True)).get("Item")
+            if row is None or row.get("deleting_at") != deleting_at:
+                return
+
+        logger.warning("Deletion of blob %s is stuck; finishing it", content_hash)
+        await self._finish_blob_deletion(content_hash, deleting_at)
+
+    async def _finish_blob_deletion(self, content_hash: str, deleting_at: int) -> None:
+        table = await self.db.Table(TABLE_NAME)
+        await self._delete_from_s3(get_blob_name(content_hash))
+        try:
+            await table.delete_item(Key={"id": content_hash}, ConditionExpression=Attr("deleting_at").eq(deleting_at))
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    async def _store_blob(self, data: IO[bytes] | AsyncReadable, name: str, content_type: str) -> tuple[int, str]:
+        """Stores some data as a blob, reusing the existing blob if there is one.
+
+        The caller owns the returned reference and should give it back with
+        `_release_blob` when it no longer needs the blob.
+
+        Args:
+            data: The data to store.
+            name: The name used for the blob's download filename, if the blob
+                is newly created.
+            content_type: The content type of the data.
+
+        Returns:
+            The size and hex SHA-256 digest of the data.
+        """
+        spool, size, content_hash = await self._spool_and_hash(data)
+        blob_name = get_blob_name(content_hash)
+        try:
+            while True:
+                if await self._acquire_blob(content_hash):
+                    logger.info("Reusing stored blob %s for %s", content_hash, name)
+                    return size, content_hash
+
+                spool.seek(0)
+                await self._stream_to_s3(spool, name, blob_name, content_type)
+                try:
+                    await self._add_item(Blob.create(content_hash, size, content_type))
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+                    # Someone else stored the same content at the same time, so
+                    # the object was just overwritten with identical bytes. If
+                    # their blob was already deleted again, start over.
+                    continue
+
+                # Deletions remove the object before the row, so any deletion
+                # which overlapped the upload is finished by now, but it may
+                # have deleted the new object.
+                if await self._head_object(blob_name) is None:
+                    logger.warning("Blob %s was deleted while it was uploaded; uploading it again", content_hash)
+                    spool.seek(0)
+                    await self._stream_to_s3(spool, name, blob_name, content_type)
+                return size, content_hash
+        finally:
+            spool.close()
+
+    async def _release_blob(self, content_hash: str) -> None:
+        """Removes a reference to a blob, deleting it if it was the last one.
+
+        Args:
+            content_hash: The blob's content hash.
+        """
+        table = await self.db.Table(TABLE_NAME)
+        try:
+            response = await table.update_item(
+                Key={"id": content_hash},
+                UpdateExpression="ADD ref_count :dec",
+                ConditionExpression=Attr("type").eq(Blob.__name__) & Attr("ref_count").gt(0),
+                ExpressionAttributeValues={":dec": -1},
+                ReturnValues="UPDATED_NEW",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                logger.warning("Blob %s is missing or has no references", content_hash)
+                return
+            raise
+        ref_count = response["Attributes"]["ref_count"]
+        if not isinstance(ref_count, Decimal):
+            raise InternalError(f"Unexpected reference count for blob {content_hash}: {ref_count!r}")
+        if ref_count > 0:
+            return
+
+        # The row becomes a tombstone before the object is deleted, unless an
+        # upload re-acquired the blob in the meantime. Uploads of the same
+        # content wait for the tombstone to go away, so none of them can end
+        # up pointing at the object which is about to be deleted.
+        deleting_at = int(time.time())
+        try:
+            await table.update_item(
+                Key={"id": content_hash},
+                UpdateExpression="SET deleting_at = :now",
+                ConditionExpression=Attr("ref_count").eq(0) & Attr("deleting_at").not_exists(),
+                ExpressionAttributeValues={":now": deleting_at},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return
+            raise
+        await self._finish_blob_deletion(content_hash, deleting_at)
@@ -1,18 +1,23 @@
 """Defines the CRUD interface for handling user-uploaded KRecs."""
 
 import asyncio
-import io
+import base64
 import logging
+import time
 from types import TracebackType
-from typing import Self
+from typing import Any, Self
 
 from fastapi import UploadFile
 
 from www.app.crud.base import TABLE_NAME, BaseCrud
-from www.app.model import KRec
+from www.app.errors import BadArtifactError
+from www.app.model import KRec, get_krec_name
+from www.settings import settings
 
 logger = logging.getLogger(__name__)
 
+SWEEP_CONCURRENCY = 16
+
 
 class KRecsCrud(BaseCrud):
     """CRUD operations for KRecs."""
@@ -43,21 +48,68 @@ class KRecsCrud(BaseCrud):
         """Create a new KRec and upload its file."""
         krec = KRec.create(user_id=user_id, robot_id=robot_id, name=name, description=description)
 
-        file_data = io.BytesIO(await file.read())
-
-        key = f"krecs/{krec.id}/{name}"
-        await asyncio.gather(
-            self._upload_to_s3(
-                data=file_data,
-                name=name,
-                filename=key,
-                content_type="video/x-matroska",
-            ),
-            self._add_item(krec),
+        krec.size_bytes, content_hash = await self._stream_to_s3(
+            data=file,
+            name=name,
+            filename=get_krec_name(krec),
+            content_type="video/x-matroska",
         )
+        krec.checksum = base64.b64encode(bytes.fromhex(content_hash)).decode()
+        await self._add_item(krec)
 
         return krec
 
+    async def finalize_krec_upload(self, krec: KRec) -> KRec:
+        """Records the size and checksum of a KRec uploaded directly to S3.
+
+        Args:
+            krec: The KRec which was uploaded.
+
+        Returns:
+            The updated KRec.
+        """
+        if (response := await self._head_object(get_krec_name(krec))) is None:
+            raise BadArtifactError("KRec has not been uploaded yet")
+        updates: dict[str, Any] = {"size_bytes": response["ContentLength"], "status": "ready"}
+
+        # Multipart uploads have a checksum of checksums, like "abc=-3",
+        # which is not the hash of the content.
+        if (checksum := response.get("ChecksumSHA256")) is not None and "-" not in checksum:
+            updates["checksum"] = checksum
+        await self._update_item(krec.id, KRec, updates)
+        return krec.model_copy(update=updates)
+
+    async def sweep_pending_krec_uploads(self) -> int:
+        """Finalizes presigned KRec uploads which the client never finalized.
+
+        Uploads which are still missing after `abandoned_upload_seconds` are
+        marked as failed.
+
+        Returns:
+            The number of KRecs which were finalized.
+        """
+        now = time.time()
+        semaphore = asyncio.Semaphore(SWEEP_CONCURRENCY)
+
+        async def sweep(krec: KRec) -> bool:
+            async with semaphore:
+                try:
+                    await self.finalize_krec_upload(krec)
+                    return True
+                except BadArtifactError:
+                    if now - krec.created_at >= settings.s3.abandoned_upload_seconds:
+                        logger.warning("Upload of KRec %s was abandoned", krec.id)
+                        await self._update_item(krec.id, KRec, {"status": "failed"})
+                    return False
+
+        krecs = [
+            krec
+            for krec in await self._get_pending_items(KRec)
+            if now - krec.created_at >= settings.s3.finalize_grace_seconds
+        ]
+        results = await asyncio.gather(*(sweep(krec) for krec in krecs))
+        return sum(results)
+
     async def get_krec(self, krec_id: str) -> KRec | None:
         return await self._get_item(krec_id, KRec)
 
@@ -78,5 +130,12 @@ class KRecsCrud(BaseCrud):
         return [self._validate_item(item, KRec) for item in response.get("Items", [])]
 
     async def delete_krec(self, krec_id: str) -> None:
-        """Delete a krec."""
-        await self._delete_item(krec_id)
+        """Delete a krec and its file."""
+        if (krec := await self.get_krec(krec_id)) is None:
+            return
+        await self.delete_krecs([krec])
+
+    async def delete_krecs(self, krecs: list[KRec]) -> None:
+        """Delete krecs, then their files in batched requests."""
+        await self._delete_items(krecs)
+        await self._delete_many_from_s3(get_krec_name(krec) for krec in krecs)
@@ -4,23 +4,39 @@ import asyncio
 import logging
 import time
 from enum import Enum
-from typing import Any, Callable, Literal, Type, TypeVar, overload
+from typing import Any, Callable, Literal, TypeVar, overload
 
 from boto3.dynamodb.conditions import Attr
 
 from www.app.crud.artifacts import ArtifactsCrud
-from www.app.crud.base import TABLE_NAME, BaseCrud, ItemNotFoundError
+from www.app.crud.base import (
+    TABLE_NAME,
+    TYPE_SHARD_COLNAME,
+    TYPE_SORT_COLNAME,
+    BaseCrud,
+    ItemNotFoundError,
+    decode_offset_cursor,
+    encode_cursor,
+)
 from www.app.model import Listing, ListingTag, ListingVote, User
+from www.app.utils.search import listing_search_index
+from www.settings import settings
 
 T = TypeVar("T")
 
 logger = logging.getLogger(__name__)
 
 
+def get_listing_tags_key(listing_id: str) -> str:
+    """Gets the cache key for the tag names of a listing."""
+    return f"tags:{listing_id}"
+
+
 class SortOption(str, Enum):
     NEWEST = "newest"
     MOST_VIEWED = "most_viewed"
     MOST_UPVOTED = "most_upvoted"
+    RELEVANCE = "relevance"
 
 
 class ListingsCrud(ArtifactsCrud, BaseCrud):
@@ -30,6 +46,20 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
     def get_gsis(cls) -> set[str]:
         return super().get_gsis().union({"listing_id", "name"})
 
+    @classmethod
+    def get_sorted_gsis(cls) -> set[tuple[str, str]]:
+        return (
+            super()
+            .get_sorted_gsis()
+            .union(
+                {
+                    (TYPE_SHARD_COLNAME, "views"),
+                    (TYPE_SHARD_COLNAME, "score"),
+                    ("user_id", "created_at"),
+                }
+            )
+        )
+
     @overload
     async def get_listing(self, listing_id: str, throw_if_missing: Literal[True]) -> Listing: ...
 
@@ -41,19 +71,95 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
 
     async def get_listings(
         self,
-        page: int,
+        page: int = 1,
         search_query: str | None = None,
         sort_by: SortOption = SortOption.NEWEST,
-    ) -> tuple[list[Listing], bool]:
-        sort_key = self._get_sort_key(sort_by)
+        cursor: str | None = None,
+    ) -> tuple[list[Listing], str | None]:
+        """Gets one page of listings, in the requested sort order.
+
+        Args:
+            page: The page number, only used if no cursor is provided. Going
+                directly to page N has to read the N - 1 pages before it, so
+                clients should prefer following cursors.
+            search_query: A query string to filter listings by. Searches are
+                answered from the in-process search index.
+            sort_by: The sort order.
+            cursor: The cursor returned with the previous page.
+
+        Returns:
+            The listings on the page, and the cursor for the next page, or
+            None if this is the last page.
+        """
+        if search_query:
+            return await self._search_listings(search_query, page, sort_by, cursor)
+
+        # Newest-first pages are sorted by the type index's own sort column,
+        # which is the creation time for listings.
+        sort_colname = self._get_sort_colname(sort_by)
+        if sort_colname == "created_at":
+            sort_colname = TYPE_SORT_COLNAME
+
         try:
-            listings, has_next = await self._list(Listing, page, sort_key, search_query)
+            if cursor is None and page > 1:
+                _, cursor = await self._query_type_page(Listing, sort_colname, limit=(page - 1) * self.PAGE_SIZE)
+                if cursor is None:
+                    return [], None
+            listings, next_cursor = await self._query_type_page(
+                Listing, sort_colname, limit=self.PAGE_SIZE, cursor=cursor
+            )
             logger.info("Retrieved %s listings", len(listings))
-            return listings, has_next
+            return listings, next_cursor
         except Exception as e:
             logger.exception("Error in get_listings: %s", e)
             raise
 
+    async def _search_listings(
+        self,
+        search_query: str,
+        page: int,
+        sort_by: SortOption,
+        cursor: str | None,
+    ) -> tuple[list[Listing], str | None]:
+        if not listing_search_index.ready:
+            await self.build_search_index()
+
+        results = listing_search_index.search(search_query)
+        if sort_by != SortOption.RELEVANCE:
+            sort_key = self._get_sort_key(sort_by)
+            results.sort(key=lambda result: sort_key(result[0]), reverse=True)
+
+        start = (page - 1) * self.PAGE_SIZE if cursor is None else decode_offset_cursor(cursor)
+        end = start + self.PAGE_SIZE
+        listings = [listing for listing, _ in results[start:end]]
+        next_cursor = encode_cursor({"offset": end}) if end < len(results) else None
+        logger.info("Found %s listings matching %r", len(results), search_query)
+        return listings, next_cursor
+
+    async def build_search_index(self) -> None:
+        """Rebuilds this process's listing search index from the database."""
+        listing_search_index.begin_rebuild()
+        try:
+            listings = [listing async for listing in self._iter_items(Listing)]
+            tags: dict[str, list[str]] = {}
+            async for tag in self._iter_items(ListingTag):
+                tags.setdefault(tag.listing_id, []).append(tag.name)
+        except BaseException:
+            listing_search_index.abort_rebuild()
+            raise
+        listing_search_index.finish_rebuild(listings, tags)
+
+    def _get_sort_colname(self, sort_by: SortOption) -> str:
+        match sort_by:
+            case SortOption.NEWEST | SortOption.RELEVANCE:
+                return "created_at"
+            case SortOption.MOST_VIEWED:
+                return "views"
+            case SortOption.MOST_UPVOTED:
+                return "score"
+            case _:
+                raise ValueError(f"Invalid sort option: {sort_by}")
+
     def _get_sort_key(self, sort_by: SortOption) -> Callable[[Listing], Any]:
         match sort_by:
             case SortOption.NEWEST:
@@ -65,80 +171,75 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
             case _:
                 return lambda x: (x.id, x.name)
 
-    async def _list(
-        self,
-        item_class: Type[T],
-        page: int,
-        sort_key: Callable[[T], int] | None = None,
-        search_query: str | None = None,
-    ) -> tuple[list[T], bool]:
-        table = await self.db.Table(TABLE_NAME)
-
-        scan_params = {}
-        if search_query:
-            filter_expression = Attr("name").contains(search_query) | Attr("description").contains(search_query)
-            scan_params["FilterExpression"] = filter_expression
-
-        response = await table.scan(**scan_params)
-        items = response["Items"]
-
-        # Filter out items with missing required fields
-        required_fields = {"updated_at", "name", "child_ids"}
-        valid_items = [item for item in items if all(field in item for field in required_fields)]
-
-        # Convert items to the correct model type
-        try:
-            typed_items = [item_class(**item) for item in valid_items]
-        except Exception as e:
-            logger.exception("Error creating %s objects: %s", item_class.__name__, e)
-            raise
-
-        if sort_key:
-            sorted_items = sorted(typed_items, key=sort_key, reverse=True)
-        else:
-            sorted_items = typed_items
-
-        # Paginate results
-        start = (page - 1) * self.PAGE_SIZE
-        end = start + self.PAGE_SIZE
-        paginated_items = sorted_items[start:end]
-
-        return paginated_items, len(sorted_items) > end
-
     async def get_user_listings(
         self,
         user_id: str,
-        page: int,
+        page: int = 1,
         sort_by: SortOption = SortOption.NEWEST,
-    ) -> tuple[list[Listing], bool]:
-        sort_key = self._get_sort_key(sort_by)
+        cursor: str | None = None,
+    ) -> tuple[list[Listing], str | None]:
+        """Gets one page of a user's listings.
+
+        Newest-first pages are read from the sorted `user_id` index. Other
+        sort orders read all of the user's listings and sort them in memory,
+        in which case the cursor is just the offset of the next page.
+
+        Args:
+            user_id: The user whose listings to get.
+            page: The page number, only used if no cursor is provided.
+            sort_by: The sort order.
+            cursor: The cursor returned with the previous page.
+
+        Returns:
+            The listings on the page, and the cursor for the next page, or
+            None if this is the last page.
+        """
         try:
-            listings, has_next = await self._list_me(Listing, user_id, page, sort_key)
+            if sort_by == SortOption.NEWEST:
+                if cursor is None and page > 1:
+                    _, cursor = await self._query_page(
+                        Listing, "user_id", user_id, "created_at", limit=(page - 1) * self.PAGE_SIZE
+                    )
+                    if cursor is None:
+                        return [], None
+                listings, next_cursor = await self._query_page(
+                    Listing, "user_id", user_id, "created_at", limit=self.PAGE_SIZE, cursor=cursor
+                )
+            else:
+                start = (page - 1) * self.PAGE_SIZE if cursor is None else decode_offset_cursor(cursor)
+                end = start + self.PAGE_SIZE
+                all_listings = await self._get_items_from_secondary_index("user_id", user_id, Listing)
+                all_listings.sort(key=self._get_sort_key(sort_by), reverse=True)
+                listings = all_listings[start:end]
+                next_cursor = encode_cursor({"offset": end}) if end < len(all_listings) else None
             logger.info("Retrieved %s listings for user %s", len(listings), user_id)
-            return listings, has_next
+            return listings, next_cursor
         except Exception as e:
             logger.exception("Error in get_user_listings: %s", e)
             raise
 
     async def get_listings_by_ids(self, listing_ids: list[str]) -> list[Listing]:
-        return await self._list_items(
-            Listing,
-            filter_expression=Attr("id").is_in(listing_ids),
-        )
+        return await self._get_item_batch(listing_ids, Listing)
 
     async def dump_listings(self) -> list[Listing]:
         return await self._list_items(Listing)
 
     async def add_listing(self, listing: Listing) -> None:
         await self._add_item(listing)
+        listing_search_index.add(listing, [])
 
     async def _delete_listing_artifacts(self, listing: Listing) -> None:
         artifacts = await self.get_listing_artifacts(listing.id)
-        await asyncio.gather(*[self.remove_artifact(artifact) for artifact in artifacts])
+        await self.remove_artifacts(artifacts)
+
+        # Picks up any files left behind by earlier partial failures, since
+        # every non-blob artifact file is stored under the listing ID.
+        await self._delete_s3_prefix(f"{listing.id}/")
 
     async def _delete_listing_tags(self, listing_id: str) -> None:
         listing_tags = await self._get_items_from_secondary_index("listing_id", listing_id, ListingTag)
-        await asyncio.gather(*(self._delete_item(tag) for tag in listing_tags))
+        await self._delete_items(listing_tags)
+        await self._invalidate_items([get_listing_tags_key(listing_id)])
 
     async def delete_listing(self, listing: Listing) -> None:
         await asyncio.gather(
@@ -148,6 +249,21 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
 
         # Only delete the listing after all artifacts have been removed.
         await self._delete_item(listing)
+        listing_search_index.remove(listing.id)
+
+    async def delete_listings(self, listings: list[Listing]) -> None:
+        """Deletes many listings, a few at a time.
+
+        Args:
+            listings: The listings to delete.
+        """
+        semaphore = asyncio.Semaphore(settings.s3.delete_concurrency)
+
+        async def delete(listing: Listing) -> None:
+            async with semaphore:
+                await self.delete_listing(listing)
+
+        await asyncio.gather(*(delete(listing) for listing in listings))
 
     async def edit_listing(
         self,
@@ -183,16 +299,11 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
 
         if coroutines:
             await asyncio.gather(*coroutines)
+            listing_search_index.add(listing.model_copy(update=updates), tags)
 
     async def remove_onshape_url(self, listing_id: str) -> None:
         await self._update_item(listing_id, Listing, {"onshape_url": None})
 
-    async def _add_tag_to_listing(self, listing_id: str, tag: str) -> None:
-        await self._add_item(ListingTag.create(listing_id=listing_id, tag=tag), unique_fields=["listing_id", "name"])
-
-    async def _remove_tag_from_listing(self, listing_id: str, tag: str) -> None:
-        await self._delete_item(listing_id)
-
     async def set_listing_tags(self, listing: Listing, tags: list[str]) -> None:
         """For a given listing, determines which tags to add and which to remove.
 
@@ -200,18 +311,22 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
             listing: The listing to update.
             tags: The new tags to set.
         """
-        tags_to_add = set(tags)
-        tags_to_remove = set(await self.get_tags_for_listing(listing.id))
-        tags_to_add.difference_update(tags_to_remove)
-        tags_to_remove.difference_update(tags_to_add)
-        await asyncio.gather(
-            *(self._add_tag_to_listing(listing.id, tag) for tag in tags_to_add),
-            *(self._remove_tag_from_listing(listing.id, tag) for tag in tags_to_remove),
+        new_tags = set(tags)
+        listing_tags = await self._get_items_from_secondary_index("listing_id", listing.id, ListingTag)
+        existing_tags = {listing_tag.name for listing_tag in listing_tags}
+        await self._batch_write_items(
+            puts=[ListingTag.create(listing_id=listing.id, tag=tag) for tag in new_tags - existing_tags],
+            deletes=[listing_tag for listing_tag in listing_tags if listing_tag.name not in new_tags],
         )
+        await self._invalidate_items([get_listing_tags_key(listing.id)])
 
     async def get_tags_for_listing(self, listing_id: str) -> list[str]:
-        listing_tags = await self._get_items_from_secondary_index("listing_id", listing_id, ListingTag)
-        return [t.name for t in listing_tags]
+        async def read() -> dict[str, Any]:
+            listing_tags = await self._get_items_from_secondary_index("listing_id", listing_id, ListingTag)
+            return {"type": ListingTag.__name__, "names": [t.name for t in listing_tags]}
+
+        tags = await self._read_through(get_listing_tags_key(listing_id), read)
+        return [] if tags is None else list(tags["names"])
 
     async def get_listing_ids_for_tag(self, tag: str) -> list[str]:
         listing_tags = await self._get_items_from_secondary_index("name", tag, ListingTag)
@@ -225,6 +340,8 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
             ExpressionAttributeNames={"#views": "views"},
             ExpressionAttributeValues={":inc": 1},
         )
+        await self._invalidate_items([listing.id])
+        listing_search_index.increment(listing.id, "views", 1)
 
     async def _update_vote(self, listing_id: str, upvote: bool) -> None:
         table = await self.db.Table(TABLE_NAME)
@@ -234,6 +351,8 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
             ExpressionAttributeNames={"#vote_type": "upvotes" if upvote else "downvotes"},
             ExpressionAttributeValues={":inc": 1, ":score_inc": 1 if upvote else -1},
         )
+        await self._invalidate_items([listing_id])
+        listing_search_index.increment(listing_id, "score", 1 if upvote else -1)
 
     async def _remove_vote(self, listing_id: str, was_upvote: bool) -> None:
         table = await self.db.Table(TABLE_NAME)
@@ -244,6 +363,8 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
             ExpressionAttributeValues={":dec": -1, ":score_dec": -1 if was_upvote else 1},
             ConditionExpression=Attr(f"{'upvotes' if was_upvote else 'downvotes'}").gt(0),
         )
+        await self._invalidate_items([listing_id])
+        listing_search_index.increment(listing_id, "score", -1 if was_upvote else 1)
 
     async def get_user_vote(self, user_id: str, listing_id: str) -> ListingVote | None:
         votes = await self._get_items_from_secondary_index(
@@ -256,7 +377,7 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
         # If there are multiple votes, delete duplicates.
         if len(votes) > 1:
             await asyncio.gather(
-                *(self._delete_item(vote) for vote in votes[1:]),
+                self._delete_items(votes[1:]),
                 *(self._remove_vote(vote.listing_id, vote.is_upvote) for vote in votes[1:]),
             )
 
@@ -354,25 +475,28 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
         Returns:
             List of tuples containing (listing, username)
         """
-        # Get all unique user IDs from the listings
-        user_ids = {listing.user_id for listing in listings}
-
-        # Fetch all users in parallel
-        users = await asyncio.gather(*(self._get_item(user_id, User) for user_id in user_ids))
-
-        # Create mapping of user_id to username
-        username_map = {user.id: user.username for user in users if user is not None}
+        # Only the usernames are needed, so the rest of each user is not read.
+        users = await self._batch_get_items((listing.user_id for listing in listings), attributes=["username"])
+        username_map = {user_id: str(user["username"]) for user_id, user in users.items()}
 
         # Return listings paired with their creator's username
         return [(listing, username_map.get(listing.user_id, "unknown")) for listing in listings]
 
     async def update_username_for_user_listings(self, user_id: str, new_username: str) -> None:
         listings = await self._get_items_from_secondary_index("user_id", user_id, Listing)
-        update_tasks = [self._update_item(listing.id, Listing, {"username": new_username}) for listing in listings]
-        await asyncio.gather(*update_tasks)
+
+        # Updates can't be batched without overwriting the view and vote
+        # counters, so they are just sent a few at a time.
+        semaphore = asyncio.Semaphore(settings.dynamo.batch_write_concurrency)
+
+        async def update(listing: Listing) -> None:
+            async with semaphore:
+                await self._update_item(listing.id, Listing, {"username": new_username})
+
+        await asyncio.gather(*(update(listing) for listing in listings))
 
     async def get_featured_listings(self) -> list[str]:
-        featured = await self._get_by_known_id("featured_listings")
+        featured = await self._read_through("featured_listings", lambda: self._get_by_known_id("featured_listings"))
         if not featured:
             return []
         return list(featured["listing_ids"])
@@ -388,3 +512,4 @@ class ListingsCrud(ArtifactsCrud, BaseCrud):
                 "updated_at": int(time.time()),
             }
         )
+        await self._invalidate_items(["featured_listings"])
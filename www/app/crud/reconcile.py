@@ -0,0 +1,217 @@
+"""Defines a reconciler which finds S3 objects and rows that have drifted apart.
+
+Rows and their S3 objects are written and deleted separately, so a failure
+part way through can leave an object with no row pointing at it, or a row
+whose object is gone. The reconciler does a parallel segmented scan of the
+table to find every key the rows expect, then walks the bucket prefix in
+key order and joins the two:
+
+- Objects which no row expects are orphans, and can be deleted in batches.
+- Rows whose object never shows up in the listing are reported.
+
+The bucket walk is checkpointed to a file after each batch, so that a run
+against a large bucket can be resumed. The table scan is not checkpointed,
+since the join needs every row, but it is much cheaper than the listing.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from boto3.dynamodb.conditions import Attr
+from pydantic import BaseModel
+
+from www.app.crud.base import S3_DELETE_BATCH_SIZE, TABLE_NAME, BaseCrud
+from www.app.model import (
+    Artifact,
+    Blob,
+    KRec,
+    get_artifact_names,
+    get_blob_name,
+    get_krec_name,
+    get_staging_name,
+)
+from www.app.utils.ratelimit import RateLimiter
+from www.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExpectedObject(NamedTuple):
+    row_id: str
+    required: bool
+
+
+class ReconcileReport(BaseModel):
+    """Tracks the progress of a reconciliation run, and doubles as its checkpoint."""
+
+    start_after: str | None = None
+    scanned_rows: int = 0
+    scanned_objects: int = 0
+    orphan_objects: int = 0
+    deleted_objects: int = 0
+    missing_objects: int = 0
+    completed: bool = False
+
+
+def get_expected_objects(item: Artifact | KRec | Blob) -> list[tuple[str, bool]]:
+    """Gets the S3 objects which a row points at.
+
+    Rows which are still being uploaded or processed are allowed to have
+    their objects, but aren't required to yet.
+
+    Args:
+        item: The row.
+
+    Returns:
+        The object filenames, and whether each one is required to exist.
+    """
+    match item:
+        case Blob():
+            # Tombstones are rows whose object is being deleted.
+            return [(get_blob_name(item.id), item.deleting_at is None)]
+
+        case KRec():
+            return [(get_krec_name(item), item.status == "ready")]
+
+        case Artifact() if item.blobs:
+            # Blob objects are owned by the blob rows.
+            return []
+
+        case Artifact():
+            required = item.status == "ready"
+            expected = [(name, required) for name in get_artifact_names(item)]
+            if item.status == "processing":
+                expected.append((get_staging_name(item.id, item.name), False))
+            return expected
+
+
+class ReconcileCrud(BaseCrud):
+    """Finds and cleans up orphaned S3 objects and rows with missing objects."""
+
+    async def _scan_segment(
+        self,
+        segment: int,
+        total_segments: int,
+        limiter: RateLimiter,
+        expected: dict[str, ExpectedObject],
+    ) -> int:
+        table = await self.db.Table(TABLE_NAME)
+        item_classes: dict[str, type[Artifact | KRec | Blob]] = {cls.__name__: cls for cls in (Artifact, KRec, Blob)}
+        scan_params: dict[str, Any] = {
+            "Segment": segment,
+            "TotalSegments": total_segments,
+            "FilterExpression": Attr("type").is_in(list(item_classes)),
+        }
+        num_rows = 0
+        while True:
+            await limiter.wait()
+            response = await table.scan(**scan_params)
+            for data in response["Items"]:
+                item = self._validate_item(data, item_classes[str(data["type"])])
+                for name, required in get_expected_objects(item):
+                    expected[name] = ExpectedObject(item.id, required)
+                num_rows += 1
+            if (start_key := response.get("LastEvaluatedKey")) is None:
+                break
+            scan_params["ExclusiveStartKey"] = start_key
+        return num_rows
+
+    async def _delete_orphans(self, orphans: list[str], limiter: RateLimiter) -> int:
+        num_deleted = 0
+        for i in range(0, len(orphans), S3_DELETE_BATCH_SIZE):
+            batch = orphans[i : i + S3_DELETE_BATCH_SIZE]
+            await limiter.wait()
+            failed = await self._delete_many_from_s3(batch)
+            num_deleted += len(batch) - len(failed)
+        return num_deleted
+
+    async def reconcile_storage(
+        self,
+        delete: bool = False,
+        checkpoint_path: str | Path | None = None,
+    ) -> ReconcileReport:
+        """Joins the table against the bucket to find orphaned objects and rows.
+
+        Objects modified within `grace_seconds` are skipped, since their rows
+        may not have been written yet.
+
+        Args:
+            delete: If set, delete orphaned objects, instead of just reporting
+                them.
+            checkpoint_path: Where to save progress, so that an interrupted
+                run can pick up where it left off. The file is removed once
+                the run completes.
+
+        Returns:
+            The counts of scanned, orphaned and deleted objects and rows.
+        """
+        checkpoint = None if checkpoint_path is None else Path(checkpoint_path)
+        if checkpoint is not None and checkpoint.exists():
+            report = ReconcileReport.model_validate_json(checkpoint.read_text())
+            logger.info("Resuming reconciliation after %s", report.start_after)
+        else:
+            report = ReconcileReport()
+
+        def save_checkpoint() -> None:
+            if checkpoint is not None:
+                checkpoint.write_text(report.model_dump_json())
+
+        limiter = RateLimiter(settings.reconcile.requests_per_second)
+        expected: dict[str, ExpectedObject] = {}
+        total_segments = settings.reconcile.scan_segments
+        num_rows = await asyncio.gather(
+            *(self._scan_segment(segment, total_segments, limiter, expected) for segment in range(total_segments))
+        )
+        report.scanned_rows = sum(num_rows)
+        logger.info("Scanned %d rows expecting %d objects", report.scanned_rows, len(expected))
+
+        client = self.s3.meta.client
+        prefix = settings.s3.prefix
+        cutoff = datetime.fromtimestamp(time.time() - settings.reconcile.grace_seconds).astimezone()
+        resume_after = report.start_after
+        list_params: dict[str, Any] = {"Bucket": settings.s3.bucket, "Prefix": prefix}
+        if resume_after is not None:
+            list_params["StartAfter"] = f"{prefix}{resume_after}"
+
+        seen: set[str] = set()
+        orphans: list[str] = []
+        while True:
+            await limiter.wait()
+            response = await client.list_objects_v2(**list_params)
+            for obj in response.get("Contents", []):
+                name = obj["Key"].removeprefix(prefix)
+                report.scanned_objects += 1
+                report.start_after = name
+                if name in expected:
+                    seen.add(name)
+                elif obj["LastModified"] < cutoff:
+                    logger.info("Found orphaned object %s", name)
+                    report.orphan_objects += 1
+                    orphans.append(name)
+
+            last_page = not response.get("IsTruncated")
+            if delete and (len(orphans) >= S3_DELETE_BATCH_SIZE or last_page):
+                report.deleted_objects += await self._delete_orphans(orphans, limiter)
+                orphans = []
+            if not delete or not orphans:
+                save_checkpoint()
+            if last_page:
+                break
+            list_params["ContinuationToken"] = response["NextContinuationToken"]
+
+        # The listing is in key order, so keys before the resume point were
+        # already checked by the earlier run.
+        for name, (row_id, required) in expected.items():
+            if not required or name in seen or (resume_after is not None and name <= resume_after):
+                continue
+            logger.warning("Row %s is missing object %s", row_id, name)
+            report.missing_objects += 1
+
+        report.completed = True
+        if checkpoint is not None:
+            checkpoint.unlink(missing_ok=True)
+        return report
@@ -4,7 +4,9 @@ import asyncio
 import logging
 import random
 import string
+import time
 import warnings
+from collections import defaultdict
 from typing import Any, Literal, Optional, overload
 
 from boto3.dynamodb.conditions import Key
@@ -12,17 +14,24 @@ from botocore.exceptions import ClientError
 from pydantic import BaseModel
 
 from www.app.crud.base import TABLE_NAME, BaseCrud
+from www.app.crud.krecs import KRecsCrud
 from www.app.crud.listings import ListingsCrud
+from www.app.errors import ItemNotFoundError
 from www.app.model import (
     APIKey,
     APIKeyPermissionSet,
     APIKeySource,
+    Artifact,
+    KRec,
+    Listing,
+    ListingVote,
     OAuthKey,
     User,
     UserPermission,
 )
+from www.app.utils.itemcache import ItemCacheBackend, item_cache
 from www.settings import settings
-from www.utils import cache_async_result
+from www.utils import LRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +49,143 @@ class UserNotFoundError(Exception):
         super().__init__(message)
 
 
+Principal = tuple[APIKey, User]
+
+
+def get_key_invalidation_key(api_key_id: str) -> str:
+    return f"principal:{api_key_id}"
+
+
+def get_user_invalidation_key(user_id: str) -> str:
+    return f"principal-user:{user_id}"
+
+
+class PrincipalCache:
+    """Caches the API key and user that an API key ID resolves to.
+
+    Entries are keyed only by the API key ID, so lookups hit across requests.
+    Unknown keys are cached as well (for a shorter time) so that repeated
+    requests with a bad token don't each go to the database. Writes which
+    change a key or its user should call one of the `invalidate` methods.
+
+    Lookups which started before an invalidation of their key or user are
+    not cached, so that a slow lookup which raced with a revocation doesn't
+    put the old principal back. If a shared backend is given, invalidations
+    are recorded there too, and every hit is checked against them, so that a
+    key revoked in one process stops working in every process straight away.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        negative_ttl: float,
+        capacity: int,
+        *,
+        backend: ItemCacheBackend | None = None,
+        name: str | None = None,
+    ) -> None:
+        super().__init__()
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = LRUCache[str, tuple[float, float, Principal | None]](capacity, name=name)
+        self.user_keys: dict[str, set[str]] = {}
+        self._invalidated_at = LRUCache[str, float](capacity)
+        self._backend = backend
+
+    def _get_invalidation_keys(self, api_key_id: str, principal: Principal | None) -> list[str]:
+        keys = [get_key_invalidation_key(api_key_id)]
+        if principal is not None:
+            keys.append(get_user_invalidation_key(principal[1].id))
+        return keys
+
+    async def _is_current(self, api_key_id: str, principal: Principal | None, read_at: float) -> bool:
+        if self._backend is None:
+            return True
+        try:
+            invalidations = await self._backend.get_invalidations(self._get_invalidation_keys(api_key_id, principal))
+        except Exception:
+            logger.exception("Failed to read principal invalidations")
+            return False
+        return all(invalidated_at < read_at for invalidated_at in invalidations.values())
+
+    async def get(self, api_key_id: str) -> tuple[bool, Principal | None]:
+        """Looks up an API key ID.
+
+        Args:
+            api_key_id: The API key ID to look up.
+
+        Returns:
+            Whether the lookup was a hit, and the cached principal, which is
+            None if the key is known to not exist.
+        """
+        if (entry := self.entries.get(api_key_id)) is None:
+            return False, None
+        expires_at, read_at, principal = entry
+        if expires_at < time.time():
+            self.entries.stats.recount_hit_as_expired()
+            self._pop(api_key_id)
+            return False, None
+        if not await self._is_current(api_key_id, principal, read_at):
+            self.entries.stats.recount_hit_as_miss()
+            self._pop(api_key_id)
+            return False, None
+        return True, principal
+
+    def put(self, api_key_id: str, principal: Principal | None, read_at: float) -> None:
+        """Caches a lookup, unless its key or user was invalidated since.
+
+        Args:
+            api_key_id: The API key ID which was looked up.
+            principal: The principal it resolved to, or None if it doesn't
+                exist.
+            read_at: The time just before the lookup was read.
+        """
+        for key in self._get_invalidation_keys(api_key_id, principal):
+            if (invalidated_at := self._invalidated_at.get(key)) is not None and invalidated_at >= read_at:
+                return
+        ttl = self.negative_ttl if principal is None else self.ttl
+        self.entries.put(api_key_id, (time.time() + ttl, read_at, principal))
+        if principal is not None:
+            self.user_keys.setdefault(principal[1].id, set()).add(api_key_id)
+
+    def _pop(self, api_key_id: str) -> None:
+        if api_key_id not in self.entries:
+            return
+        _, _, principal = self.entries.pop(api_key_id)
+        if principal is not None and (key_ids := self.user_keys.get(principal[1].id)) is not None:
+            key_ids.discard(api_key_id)
+            if not key_ids:
+                self.user_keys.pop(principal[1].id)
+
+    async def _record_invalidation(self, key: str) -> None:
+        self._invalidated_at.put(key, time.time())
+        if self._backend is not None:
+            try:
+                await self._backend.delete_many([key])
+            except Exception:
+                logger.exception("Failed to record a principal invalidation")
+
+    async def invalidate(self, api_key_id: str) -> None:
+        self._pop(api_key_id)
+        await self._record_invalidation(get_key_invalidation_key(api_key_id))
+
+    async def invalidate_user(self, user_id: str) -> None:
+        for api_key_id in self.user_keys.pop(user_id, set()):
+            if api_key_id in self.entries:
+                self.entries.pop(api_key_id)
+        await self._record_invalidation(get_user_invalidation_key(user_id))
+
+
+principal_cache = PrincipalCache(
+    ttl=settings.crypto.cache_token_db_result_seconds,
+    negative_ttl=settings.crypto.cache_token_db_miss_seconds,
+    capacity=settings.crypto.cache_token_db_capacity,
+    backend=item_cache.backend,
+    name="principals",
+)
+
+
 class UserPublic(BaseModel):
     """Defines public user model for frontend.
 
@@ -59,7 +205,7 @@ class UserPublic(BaseModel):
     bio: str | None = None
 
 
-class UserCrud(BaseCrud):
+class UserCrud(ListingsCrud, KRecsCrud, BaseCrud):
     @classmethod
     def get_gsis(cls) -> set[str]:
         return super().get_gsis().union({"user_id", "email", "user_token", "username"})
@@ -89,7 +235,7 @@ class UserCrud(BaseCrud):
 
     async def _create_user_from_email(self, email: str, password: str) -> User:
         try:
-            base_username = email.split("@")[0]
+            base_username = email.split("@", maxsplit=1)[0]
             unique_username = await self.generate_unique_username(base_username)
             user = User.create(email=email, username=unique_username, password=password)
             await self._add_item(user, unique_fields=["email", "username"])
@@ -110,7 +256,7 @@ class UserCrud(BaseCrud):
             user = await self.get_user_from_email(email)
             if user is None:
                 # Generate a unique username based on the email
-                base_username = email.split("@")[0]
+                base_username = email.split("@", maxsplit=1)[0]
                 unique_username = await self.generate_unique_username(base_username)
 
                 user = User.create(
@@ -188,11 +334,55 @@ class UserCrud(BaseCrud):
         return await self._get_item_batch(ids, User)
 
     async def get_user_from_api_key(self, api_key_id: str) -> User:
-        api_key = await self.get_api_key(api_key_id)
-        return await self._get_item(api_key.user_id, User, throw_if_missing=True)
+        _, user = await self.get_principal(api_key_id)
+        return user
+
+    async def _get_user_rows(self, user_id: str) -> dict[str, list[dict[str, Any]]]:
+        table = await self.db.Table(TABLE_NAME)
+        query_params: dict[str, Any] = {
+            "IndexName": self.get_gsi_index_name("user_id"),
+            "KeyConditionExpression": Key("user_id").eq(user_id),
+        }
+        rows: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        while True:
+            response = await table.query(**query_params)
+            for item in response["Items"]:
+                rows[str(item["type"])].append(item)
+            if (start_key := response.get("LastEvaluatedKey")) is None:
+                return rows
+            query_params["ExclusiveStartKey"] = start_key
 
     async def delete_user(self, id: str) -> None:
+        """Deletes a user along with everything they own.
+
+        Listings are deleted with all of their artifacts, while the user's
+        artifacts, KRecs and votes on other listings are removed separately.
+        Every other row on the `user_id` index, like API keys and robots, is
+        just deleted.
+
+        Args:
+            id: The ID of the user to delete.
+        """
+        rows = await self._get_user_rows(id)
+        listings = [self._validate_item(row, Listing) for row in rows.pop(Listing.__name__, [])]
+        listing_ids = {listing.id for listing in listings}
+        artifacts = [self._validate_item(row, Artifact) for row in rows.pop(Artifact.__name__, [])]
+        krecs = [self._validate_item(row, KRec) for row in rows.pop(KRec.__name__, [])]
+        votes = [self._validate_item(row, ListingVote) for row in rows.pop(ListingVote.__name__, [])]
+
+        await self.delete_listings(listings)
+        await asyncio.gather(
+            self.remove_artifacts([artifact for artifact in artifacts if artifact.listing_id not in listing_ids]),
+            self.delete_krecs(krecs),
+            *(
+                self._remove_vote(vote.listing_id, vote.is_upvote)
+                for vote in votes
+                if vote.listing_id not in listing_ids
+            ),
+            self._delete_items([*votes, *(str(row["id"]) for type_rows in rows.values() for row in type_rows)]),
+        )
         await self._delete_item(id)
+        await principal_cache.invalidate_user(id)
 
     async def list_users(self) -> list[User]:
         warnings.warn("`list_users` probably shouldn't be called in production", ResourceWarning)
@@ -201,9 +391,34 @@ class UserCrud(BaseCrud):
     async def get_user_count(self) -> int:
         return await self._count_items(User)
 
-    @cache_async_result(settings.crypto.cache_token_db_result_seconds)
+    async def get_principal(self, api_key_id: str) -> Principal:
+        """Gets the API key and the user it belongs to.
+
+        Args:
+            api_key_id: The API key ID.
+
+        Returns:
+            The API key and its user.
+
+        Raises:
+            ItemNotFoundError: If the key or its user does not exist.
+        """
+        hit, principal = await principal_cache.get(api_key_id)
+        if not hit:
+            read_at = time.time()
+            start = time.perf_counter()
+            api_key = await self._get_item(api_key_id, APIKey)
+            user = None if api_key is None else await self.get_user(api_key.user_id)
+            principal = None if api_key is None or user is None else (api_key, user)
+            principal_cache.entries.stats.record_load(time.perf_counter() - start)
+            principal_cache.put(api_key_id, principal, read_at)
+        if principal is None:
+            raise ItemNotFoundError("API key not found")
+        return principal
+
     async def get_api_key(self, api_key_id: str) -> APIKey:
-        return await self._get_item(api_key_id, APIKey, throw_if_missing=True)
+        api_key, _ = await self.get_principal(api_key_id)
+        return api_key
 
     async def add_api_key(
         self,
@@ -213,22 +428,20 @@ class UserCrud(BaseCrud):
     ) -> APIKey:
         user_api_keys = await self.list_api_keys(user_id)
         if len(user_api_keys) >= 10:
-            await asyncio.gather(*[self.delete_api_key(key.id) for key in user_api_keys[:-10]])
+            await self._delete_items(user_api_keys[:-10])
+            for key in user_api_keys[:-10]:
+                await principal_cache.invalidate(key.id)
         api_key = APIKey.create(user_id=user_id, source=source, permissions=permissions)
         await self._add_item(api_key)
+        await principal_cache.invalidate(api_key.id)
         return api_key
 
     async def get_api_key_count(self, user_id: str) -> int:
-        table = await self.db.Table(TABLE_NAME)
-        item_dict = await table.scan(
-            IndexName="type_index",
-            Select="COUNT",
-            FilterExpression=Key("type").eq(APIKey.__name__) & Key("user_id").eq(user_id),
-        )
-        return item_dict["Count"]
+        return len(await self._get_items_from_secondary_index("user_id", user_id, APIKey))
 
     async def delete_api_key(self, token: APIKey | str) -> None:
         await self._delete_item(token)
+        await principal_cache.invalidate(token if isinstance(token, str) else token.id)
 
     async def list_api_keys(self, user_id: str) -> list[APIKey]:
         keys = await self._get_items_from_secondary_index("user_id", user_id, APIKey)
@@ -251,6 +464,8 @@ class UserCrud(BaseCrud):
                 raise ValueError(f"Invalid update: {str(e)}")
             raise
 
+        await principal_cache.invalidate_user(user_id)
+
         return await self.get_user(user_id, throw_if_missing=True)
 
     async def set_moderator(self, user_id: str, is_mod: bool) -> User:
@@ -262,12 +477,14 @@ class UserCrud(BaseCrud):
         else:
             user.permissions.discard("is_mod")
         await self._update_item(user_id, User, {"permissions": list(user.permissions)})
+        await principal_cache.invalidate_user(user_id)
         return user
 
     async def set_username(self, user_id: str, new_username: str) -> User:
         user = await self.get_user(user_id, throw_if_missing=True)
         user.set_username(new_username)
         await self._update_item(user_id, User, {"username": new_username, "updated_at": user.updated_at})
+        await principal_cache.invalidate_user(user_id)
 
         # Update username in all listings
         listings_crud = ListingsCrud()
@@ -299,6 +516,7 @@ class UserCrud(BaseCrud):
             user.permissions.discard("is_content_manager")
 
         await self._update_item(user_id, User, {"permissions": list(user.permissions)})
+        await principal_cache.invalidate_user(user_id)
         return user
 
 
@@ -3,17 +3,24 @@
 import argparse
 import asyncio
 import logging
-from typing import AsyncGenerator, Literal, Self
+from pathlib import Path
+from typing import Annotated, AsyncGenerator, Self
+
+from fastapi import Depends
 
 from www.app.crud.artifacts import ArtifactsCrud
-from www.app.crud.base import TABLE_NAME, BaseCrud
+from www.app.crud.base import TABLE_NAME, BaseCrud, GlobalSecondaryIndex, TableKey
+from www.app.crud.blobs import BlobsCrud
 from www.app.crud.email import EmailCrud
 from www.app.crud.krecs import KRecsCrud
 from www.app.crud.listings import ListingsCrud
 from www.app.crud.onshape import OnshapeCrud
+from www.app.crud.reconcile import ReconcileCrud
 from www.app.crud.robots import RobotsCrud
 from www.app.crud.teleop import TeleopCrud
 from www.app.crud.users import UserCrud
+from www.app.utils.aws import aws_clients
+from www.settings import settings
 
 
 class Crud(
@@ -22,9 +29,11 @@ class Crud(
     UserCrud,
     ListingsCrud,
     ArtifactsCrud,
+    BlobsCrud,
     KRecsCrud,
     RobotsCrud,
     TeleopCrud,
+    ReconcileCrud,
     BaseCrud,
 ):
     """Composes the various CRUD classes into a single class."""
@@ -35,6 +44,42 @@ class Crud(
             yield crud
 
 
+async def get_loading_crud(crud: Annotated[Crud, Depends(Crud.get)]) -> Crud:
+    """Gets the request's CRUD instance, with batched and memoized item reads.
+
+    FastAPI caches `Crud.get` per request, so any other dependencies which
+    ask for it get the same instance. Declaring this dependency before them
+    lets their reads, like the API key lookup, share the loader too.
+
+    Args:
+        crud: The request's CRUD instance.
+
+    Returns:
+        The same instance, with the loader enabled.
+    """
+    crud.use_loader()
+    return crud
+
+
+TABLE_KEYS: list[TableKey] = [("id", "S", "HASH")]
+
+
+def get_table_gsis(crud: Crud) -> list[GlobalSecondaryIndex]:
+    """Gets the GSIs that the table should have.
+
+    Args:
+        crud: The top-level CRUD class.
+
+    Returns:
+        The GSI definitions.
+    """
+    gsis: list[GlobalSecondaryIndex] = [(crud.get_gsi_index_name(g), [(g, "S", "HASH")]) for g in crud.get_gsis()]
+    gsis += [
+        (crud.get_sorted_gsi_index_name(h, r), [(h, "S", "HASH"), (r, "N", "RANGE")]) for h, r in crud.get_sorted_gsis()
+    ]
+    return gsis
+
+
 async def create_tables(crud: Crud | None = None, deletion_protection: bool = False) -> None:
     """Initializes all of the database tables.
 
@@ -49,24 +94,38 @@ async def create_tables(crud: Crud | None = None, deletion_protection: bool = Fa
             await create_tables(new_crud)
 
     else:
-        gsis_set = crud.get_gsis()
-        gsis: list[tuple[str, str, Literal["S", "N", "B"], Literal["HASH", "RANGE"]]] = [
-            (Crud.get_gsi_index_name(g), g, "S", "HASH") for g in gsis_set
-        ]
-
         await asyncio.gather(
             crud._create_dynamodb_table(
                 name=TABLE_NAME,
-                keys=[
-                    ("id", "S", "HASH"),
-                ],
-                gsis=gsis,
+                keys=TABLE_KEYS,
+                gsis=get_table_gsis(crud),
                 deletion_protection=deletion_protection,
             ),
             crud._create_s3_bucket(),
         )
 
 
+async def migrate_tables(crud: Crud | None = None) -> None:
+    """Brings an existing table up to date with the current schema.
+
+    This adds any GSIs which were introduced after the table was created.
+    Since each new GSI has to backfill before the next one can be added,
+    this can take a while on a large table, so it is run as a separate step
+    rather than on app startup.
+
+    Args:
+        crud: The top-level CRUD class.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    if crud is None:
+        async with Crud() as new_crud:
+            await migrate_tables(new_crud)
+
+    else:
+        await crud._add_missing_gsis(TABLE_NAME, TABLE_KEYS, get_table_gsis(crud))
+
+
 async def delete_tables(crud: Crud | None = None) -> None:
     """Deletes all of the database tables.
 
@@ -84,6 +143,94 @@ async def delete_tables(crud: Crud | None = None) -> None:
         await crud._delete_s3_bucket()
 
 
+async def backfill_artifact_sizes(crud: Crud | None = None) -> None:
+    """Records the size and content hash of artifacts uploaded before they were tracked.
+
+    Args:
+        crud: The top-level CRUD class.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    if crud is None:
+        async with Crud() as new_crud:
+            await backfill_artifact_sizes(new_crud)
+
+    else:
+        num_updated = await crud.backfill_artifact_sizes()
+        logging.info("Backfilled %d artifacts", num_updated)
+
+
+async def backfill_type_shards(crud: Crud | None = None) -> None:
+    """Sets the type index shard, sort value and pending index value on rows written before they existed.
+
+    Roll this out by running `migrate` to add the sharded type indexes, then
+    this, then deploying the code which reads from them. The old `type_index`
+    and `type_*_index` GSIs can be deleted by hand once nothing reads them.
+
+    Args:
+        crud: The top-level CRUD class.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    if crud is None:
+        async with Crud() as new_crud:
+            await backfill_type_shards(new_crud)
+
+    else:
+        num_updated = await crud.backfill_type_shards()
+        logging.info("Backfilled the type index for %d rows", num_updated)
+
+
+async def sweep_pending_uploads(crud: Crud | None = None) -> None:
+    """Finalizes presigned uploads which the client never finalized.
+
+    This is run on a schedule with the `sweep-uploads` action, from one place
+    rather than from every API worker.
+
+    Args:
+        crud: The top-level CRUD class.
+    """
+    if crud is None:
+        async with Crud() as new_crud:
+            await sweep_pending_uploads(new_crud)
+
+    else:
+        num_artifacts, num_krecs = await asyncio.gather(
+            crud.sweep_pending_artifact_uploads(),
+            crud.sweep_pending_krec_uploads(),
+        )
+        logging.info("Finalized %d artifacts and %d KRecs", num_artifacts, num_krecs)
+
+
+async def reconcile_storage(crud: Crud | None = None, delete: bool = False, restart: bool = False) -> None:
+    """Finds S3 objects with no row, and rows whose S3 object is missing.
+
+    Args:
+        crud: The top-level CRUD class.
+        delete: If set, delete orphaned objects instead of just reporting them.
+        restart: If set, ignore any checkpoint left by an interrupted run.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    if crud is None:
+        async with Crud() as new_crud:
+            await reconcile_storage(new_crud, delete, restart)
+
+    else:
+        checkpoint = Path(settings.reconcile.checkpoint_path)
+        if restart:
+            checkpoint.unlink(missing_ok=True)
+        report = await crud.reconcile_storage(delete=delete, checkpoint_path=checkpoint)
+        logging.info(
+            "Scanned %d rows and %d objects; found %d orphaned objects (%d deleted) and %d missing objects",
+            report.scanned_rows,
+            report.scanned_objects,
+            report.orphan_objects,
+            report.deleted_objects,
+            report.missing_objects,
+        )
+
+
 async def populate_with_dummy_data(crud: Crud | None = None) -> None:
     """Populates the database with dummy data.
 
@@ -100,13 +247,38 @@ async def populate_with_dummy_data(crud: Crud | None = None) -> None:
 
 async def main() -> None:
     parser = argparse.ArgumentParser()
-    parser.add_argument("action", choices=["create", "delete", "populate"])
+    parser.add_argument(
+        "action",
+        choices=[
+            "create",
+            "migrate",
+            "backfill-artifacts",
+            "backfill-type-shards",
+            "sweep-uploads",
+            "reconcile",
+            "delete",
+            "populate",
+        ],
+    )
+    parser.add_argument("--delete-orphans", action="store_true", help="Delete orphaned objects when reconciling")
+    parser.add_argument("--restart", action="store_true", help="Ignore the reconciliation checkpoint")
     args = parser.parse_args()
 
     async with Crud() as crud:
         match args.action:
             case "create":
                 await create_tables(crud)
+            case "migrate":
+                await migrate_tables(crud)
+            case "backfill-artifacts":
+                await backfill_artifact_sizes(crud)
+            case "backfill-type-shards":
+                await backfill_type_shards(crud)
+            case "sweep-uploads":
+                logging.basicConfig(level=logging.INFO)
+                await sweep_pending_uploads(crud)
+            case "reconcile":
+                await reconcile_storage(crud, delete=args.delete_orphans, restart=args.restart)
             case "delete":
                 await delete_tables(crud)
             case "populate":
@@ -114,6 +286,8 @@ async def main() -> None:
             case _:
                 raise ValueError(f"Invalid action: {args.action}")
 
+    await aws_clients.close()
+
 
 if __name__ == "__main__":
     # python -m store.app.db
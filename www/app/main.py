@@ -1,5 +1,6 @@
 """Defines the main entrypoint for the FastAPI app."""
 
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
@@ -10,7 +11,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.security import APIKeyCookie, APIKeyHeader
 
-from www.app.db import create_tables
+from www.app.db import Crud
 from www.app.errors import (
     BadArtifactError,
     InternalError,
@@ -23,22 +24,54 @@ from www.app.routers.auth import router as auth_router
 from www.app.routers.keys import router as keys_router
 from www.app.routers.krecs import router as krecs_router
 from www.app.routers.listings import router as listings_router
+from www.app.routers.metrics import router as metrics_router
 from www.app.routers.onshape import router as onshape_router
 from www.app.routers.robots import router as robots_router
 from www.app.routers.teleop import router as teleop_router
 from www.app.routers.users import router as users_router
+from www.app.utils.aws import aws_clients
+from www.app.utils.itemcache import item_cache
+from www.app.utils.jobs import job_runner
+from www.app.utils.workers import process_pool
+from www.settings import settings
 from www.utils import get_cors_origins
 
+logger = logging.getLogger(__name__)
+
+
+async def refresh_search_index() -> None:
+    """Periodically rebuilds the search index, to pick up writes from other workers."""
+    while True:
+        await asyncio.sleep(settings.search.refresh_seconds)
+        try:
+            async with Crud() as crud:
+                await crud.build_search_index()
+        except Exception:
+            logger.exception("Failed to refresh the search index")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
-    """Initializes the app and creates the database tables."""
+    """Opens the shared resources and starts the background tasks.
+
+    Tables are created and migrated with the `db` CLI, not on startup. Abandoned
+    uploads are swept by running `db sweep-uploads` on a schedule, rather than
+    from every worker.
+    """
     logging.getLogger("aiobotocore").setLevel(logging.CRITICAL)
-    await create_tables()
+    await aws_clients.start()
+    async with Crud() as crud:
+        await crud.build_search_index()
+    refresh_task = asyncio.create_task(refresh_search_index())
+    await job_runner.start()
     try:
         yield
     finally:
-        pass
+        refresh_task.cancel()
+        await job_runner.close()
+        await item_cache.close()
+        process_pool.close()
+        await aws_clients.close()
 
 
 # Use APIKeyCookie with the name "AUTH"
@@ -52,6 +85,7 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json",
+    lifespan=lifespan,
 )
 
 # Adds CORS middleware.
@@ -132,6 +166,7 @@ app.include_router(robots_router, prefix="/robots", tags=["robots"])
 app.include_router(users_router, prefix="/users", tags=["users"])
 app.include_router(teleop_router, prefix="/teleop", tags=["teleop"])
 app.include_router(krecs_router, prefix="/krecs", tags=["krecs"])
+app.include_router(metrics_router, prefix="/metrics", tags=["metrics"])
 
 # For running with debugger
 if __name__ == "__main__":
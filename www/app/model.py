@@ -169,6 +169,7 @@ MeshArtifactType = Literal["stl", "obj", "dae", "ply"]
 CompressedArtifactType = Literal["tgz", "zip"]
 KernelArtifactType = Literal["kernel"]
 ArtifactType = ImageArtifactType | KernelArtifactType | XMLArtifactType | MeshArtifactType | CompressedArtifactType
+ArtifactStatus = Literal["processing", "ready", "failed"]
 
 UPLOAD_CONTENT_TYPE_OPTIONS: dict[ArtifactType, set[str]] = {
     # Image
@@ -313,6 +314,10 @@ class Artifact(StoreBaseModel):
     timestamp: int
     children: list[str] | None = None
     is_main: bool = False
+    size_bytes: int | None = None
+    content_hash: str | None = None
+    blobs: dict[ArtifactSize, str] | None = None
+    status: ArtifactStatus = "ready"
 
     @classmethod
     def create(
@@ -325,6 +330,10 @@ class Artifact(StoreBaseModel):
         description: str | None = None,
         children: list[str] | None = None,
         is_main: bool = False,
+        size_bytes: int | None = None,
+        content_hash: str | None = None,
+        blobs: dict[ArtifactSize, str] | None = None,
+        status: ArtifactStatus = "ready",
     ) -> Self:
         return cls(
             id=new_uuid(),
@@ -337,6 +346,36 @@ class Artifact(StoreBaseModel):
             timestamp=int(time.time()),
             children=children,
             is_main=is_main,
+            size_bytes=size_bytes,
+            content_hash=content_hash,
+            blobs=blobs,
+            status=status,
+        )
+
+
+class Blob(StoreBaseModel):
+    """Defines a content-addressed object in S3.
+
+    The ID is the SHA-256 digest of the content. Artifacts which point at the
+    same content share a single blob, which is deleted once the last artifact
+    referencing it is removed. While the object is being deleted, the row
+    stays behind as a tombstone with `deleting_at` set.
+    """
+
+    size_bytes: int
+    content_type: str
+    ref_count: int
+    created_at: int
+    deleting_at: int | None = None
+
+    @classmethod
+    def create(cls, content_hash: str, size_bytes: int, content_type: str) -> Self:
+        return cls(
+            id=content_hash,
+            size_bytes=size_bytes,
+            content_type=content_type,
+            ref_count=1,
+            created_at=int(time.time()),
         )
 
 
@@ -403,6 +442,14 @@ class ListingTag(StoreBaseModel):
         )
 
 
+def get_blob_name(content_hash: str) -> str:
+    return f"blobs/{content_hash}"
+
+
+def get_staging_name(artifact_id: str, name: str) -> str:
+    return f"uploads/{artifact_id}/{name}"
+
+
 def get_artifact_name(
     *,
     artifact: Artifact | None = None,
@@ -412,6 +459,8 @@ def get_artifact_name(
     artifact_type: ArtifactType | None = None,
     size: ArtifactSize = "large",
 ) -> str:
+    if artifact and artifact.blobs:
+        return get_blob_name(artifact.blobs[size])
     if artifact:
         listing_id = artifact.listing_id
         name = artifact.name
@@ -430,6 +479,22 @@ def get_artifact_name(
             raise ValueError(f"Unknown artifact type: {artifact_type}")
 
 
+def get_artifact_names(artifact: Artifact) -> list[str]:
+    """Gets the names of every S3 object which stores an artifact.
+
+    Args:
+        artifact: The artifact.
+
+    Returns:
+        The object names, which are blob names for content-addressed artifacts.
+    """
+    if artifact.blobs:
+        return [get_blob_name(content_hash) for content_hash in artifact.blobs.values()]
+    if artifact.artifact_type == "image":
+        return [get_artifact_name(artifact=artifact, size=size) for size in SizeMapping.keys()]
+    return [get_artifact_name(artifact=artifact)]
+
+
 def get_artifact_url(
     *,
     artifact: Artifact | None = None,
@@ -588,6 +653,9 @@ class KRec(StoreBaseModel):
     created_at: int
     name: str
     description: str | None = None
+    status: ArtifactStatus = "ready"
+    size_bytes: int | None = None
+    checksum: str | None = None
 
     @classmethod
     def create(
@@ -596,6 +664,7 @@ class KRec(StoreBaseModel):
         robot_id: str,
         name: str,
         description: str | None = None,
+        status: ArtifactStatus = "ready",
     ) -> Self:
         now = int(time.time())
         return cls(
@@ -605,4 +674,9 @@ class KRec(StoreBaseModel):
             created_at=now,
             name=name,
             description=description,
+            status=status,
         )
+
+
+def get_krec_name(krec: KRec) -> str:
+    return f"krecs/{krec.id}/{krec.name}"
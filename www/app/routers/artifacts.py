@@ -3,19 +3,23 @@
 import asyncio
 import logging
 import os
-from datetime import datetime, timedelta
+import time
 from pathlib import Path
-from typing import Annotated, Literal, Self
+from typing import Annotated, Any, AsyncIterable, Literal, Self
 
 from boto3.dynamodb.conditions import Key
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, status
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic.main import BaseModel
+from types_aiobotocore_s3.type_defs import CompletedPartTypeDef
 
-from www.app.db import Crud
+from www.app.crud.base import MAX_MULTIPART_PARTS
+from www.app.db import Crud, get_loading_crud
+from www.app.errors import BadArtifactError, ItemNotFoundError
 from www.app.model import (
     Artifact,
     ArtifactSize,
+    ArtifactStatus,
     ArtifactType,
     KernelArtifactType,
     Listing,
@@ -27,11 +31,15 @@ from www.app.model import (
     get_artifact_type,
     get_artifact_urls,
 )
+from www.app.security.requests import get_request_api_key_id
+from www.app.security.tokens import create_stream_token, verify_stream_token
 from www.app.security.user import (
+    get_session_user_with_read_permission,
     get_session_user_with_write_permission,
     maybe_get_user_from_api_key,
 )
-from www.app.utils.cloudfront_signer import CloudFrontUrlSigner
+from www.app.utils.cloudfront_signer import get_cloudfront_signer
+from www.app.utils.jobs import Job, JobStatus, job_runner
 from www.settings import settings
 
 router = APIRouter()
@@ -39,6 +47,40 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+def sign_artifact_url(url: str, artifact_type: ArtifactType, listing_id: str) -> tuple[str, int]:
+    """Signs a CloudFront artifact URL.
+
+    In the default "url" signing mode, each URL gets its own policy. In the
+    "prefix" mode, every artifact of a given type in a listing shares one
+    wildcard policy, so a listing needs one signature per artifact type
+    rather than one per URL.
+
+    Args:
+        url: The CloudFront URL to sign.
+        artifact_type: The artifact type, which is the first path component.
+        listing_id: The listing ID, which is the second path component.
+
+    Returns:
+        The signed URL and the time at which it expires.
+    """
+    signer = get_cloudfront_signer()
+    expire_days = settings.cloudfront.url_expire_days
+    bucket_seconds = settings.cloudfront.url_expiry_bucket_seconds
+    match settings.cloudfront.signing_mode:
+        case "url":
+            return signer.sign_url(url, expire_days=expire_days, bucket_seconds=bucket_seconds)
+        case "prefix":
+            # Content-addressed blobs are shared between listings, so they
+            # are never covered by a listing's wildcard policy.
+            prefix = f"https://{settings.cloudfront.domain}/{artifact_type}/{listing_id}/"
+            if not url.startswith(prefix):
+                return signer.sign_url(url, expire_days=expire_days, bucket_seconds=bucket_seconds)
+            query, expiration_time = signer.sign_prefix(prefix, expire_days=expire_days, bucket_seconds=bucket_seconds)
+            return f"{url}?{query}", expiration_time
+        case _:
+            raise ValueError(f"Invalid CloudFront signing mode: {settings.cloudfront.signing_mode}")
+
+
 @router.get("/url/{artifact_type}/{listing_id}/{name}")
 async def artifact_url(
     artifact_type: ArtifactType,
@@ -64,20 +106,16 @@ async def artifact_url(
     _, file_extension = os.path.splitext(name)
     s3_filename = f"{artifact.id}{file_extension}"
 
-    # Initialize CloudFront signer
-    signer = CloudFrontUrlSigner(
-        key_id=settings.cloudfront.key_id,
-        private_key=settings.cloudfront.private_key,
-    )
-
     # Always use CloudFront domain and sign the URL
-    base_url = f"https://{settings.cloudfront.domain}/{artifact.artifact_type}/{listing_id}/{s3_filename}"
-    if size and artifact.artifact_type == "image":
-        base_url = f"{base_url}_{size}"
+    if artifact.blobs:
+        base_url = f"https://{settings.cloudfront.domain}/{get_artifact_name(artifact=artifact, size=size)}"
+    else:
+        base_url = f"https://{settings.cloudfront.domain}/{artifact.artifact_type}/{listing_id}/{s3_filename}"
+        if size and artifact.artifact_type == "image":
+            base_url = f"{base_url}_{size}"
 
     # Create and sign URL
-    policy = signer.create_custom_policy(url=base_url, expire_days=180)
-    signed_url = signer.generate_presigned_url(base_url, policy=policy)
+    signed_url, _ = sign_artifact_url(base_url, artifact.artifact_type, listing_id)
 
     return RedirectResponse(url=signed_url)
 
@@ -90,34 +128,31 @@ class ArtifactUrls(BaseModel):
 
 def get_artifact_url_response(artifact: Artifact) -> ArtifactUrls:
     artifact_urls = get_artifact_urls(artifact=artifact)
-    expiration_time = None
+    expiration_time: int | None = None
 
     # If in production, sign both URLs
     if settings.environment != "local":
         logger.debug("Original URLs for artifact %s: %s", artifact.id, artifact_urls)
 
-        signer = CloudFrontUrlSigner(
-            key_id=settings.cloudfront.key_id,
-            private_key=settings.cloudfront.private_key,
-        )
-
-        expire_days = 180
-        expiration_time = int((datetime.utcnow() + timedelta(days=expire_days)).timestamp())
-
         sizes: list[Literal["small", "large"]] = ["small", "large"]
         for size in sizes:
             try:
-                cf_url = (
-                    f"https://{settings.cloudfront.domain}/{artifact.artifact_type}/{artifact.listing_id}/{artifact.id}"
+                if artifact.blobs:
+                    cf_url = f"https://{settings.cloudfront.domain}/{get_artifact_name(artifact=artifact, size=size)}"
+                else:
+                    cf_url = (
+                        f"https://{settings.cloudfront.domain}/{artifact.artifact_type}/"
+                        f"{artifact.listing_id}/{artifact.id}"
+                    )
+                    if size == "small":
+                        cf_url += "_small_256x256"
+                    elif size == "large":
+                        cf_url += "_large_1536x1536"
+                    cf_url += f"_{artifact.name}"
+
+                artifact_urls[size], expiration_time = sign_artifact_url(
+                    cf_url, artifact.artifact_type, artifact.listing_id
                 )
-                if size == "small":
-                    cf_url += "_small_256x256"
-                elif size == "large":
-                    cf_url += "_large_1536x1536"
-                cf_url += f"_{artifact.name}"
-
-                policy = signer.create_custom_policy(url=cf_url, expire_days=expire_days)
-                artifact_urls[size] = signer.generate_presigned_url(cf_url, policy=policy)
             except KeyError:
                 continue
 
@@ -137,6 +172,7 @@ class SingleArtifactResponse(BaseModel):
     is_main: bool = False
     can_edit: bool = False
     size: int | None = None
+    status: ArtifactStatus = "ready"
 
     @classmethod
     async def from_artifact(
@@ -189,9 +225,6 @@ class SingleArtifactResponse(BaseModel):
             get_listing(listing),
         )
 
-        s3_filename = get_artifact_name(artifact=artifact)
-        size = await crud.get_file_size(s3_filename) if crud is not None else None
-
         return cls(
             artifact_id=artifact.id,
             listing_id=artifact.listing_id,
@@ -204,7 +237,8 @@ class SingleArtifactResponse(BaseModel):
             urls=get_artifact_url_response(artifact=artifact),
             is_main=artifact.is_main,
             can_edit=can_edit,
-            size=size,
+            size=artifact.size_bytes,
+            status=artifact.status,
         )
 
 
@@ -215,8 +249,8 @@ class ListArtifactsResponse(BaseModel):
 @router.get("/info/{artifact_id}")
 async def get_artifact_info(
     artifact_id: str,
+    crud: Annotated[Crud, Depends(get_loading_crud)],
     user: Annotated[User | None, Depends(maybe_get_user_from_api_key)],
-    crud: Annotated[Crud, Depends(Crud.get)],
 ) -> SingleArtifactResponse:
     artifact = await crud.get_raw_artifact(artifact_id)
     if artifact is None:
@@ -230,7 +264,7 @@ async def get_artifact_info(
 @router.get("/list/{listing_id}", response_model=ListArtifactsResponse)
 async def list_artifacts(
     listing_id: str,
-    crud: Annotated[Crud, Depends(Crud.get)],
+    crud: Annotated[Crud, Depends(get_loading_crud)],
 ) -> ListArtifactsResponse:
     listing, artifacts = await asyncio.gather(
         crud.get_listing(listing_id, throw_if_missing=True),
@@ -287,6 +321,31 @@ def validate_file(file: UploadFile) -> tuple[str, ArtifactType]:
 
 class UploadArtifactResponse(BaseModel):
     artifacts: list[SingleArtifactResponse]
+    job_ids: list[str] | None = None
+
+
+PROCESS_ARTIFACT_JOB = "process_artifact"
+
+
+async def process_artifact_job(payload: dict[str, Any]) -> dict[str, Any]:
+    async with Crud() as crud:
+        artifact = await crud.process_pending_artifact(**payload)
+    return {"artifact_id": artifact.id}
+
+
+async def fail_artifact_job(payload: dict[str, Any]) -> None:
+    async with Crud() as crud:
+        await crud.fail_pending_artifact(payload["artifact_id"], payload["name"])
+
+
+# Invalid uploads, and artifacts which were deleted in the meantime, won't
+# process on a retry; anything else, like a throttled request, might.
+job_runner.register(
+    PROCESS_ARTIFACT_JOB,
+    process_artifact_job,
+    on_failure=fail_artifact_job,
+    permanent_errors=(BadArtifactError, ItemNotFoundError),
+)
 
 
 @router.post("/upload/{listing_id}", response_model=UploadArtifactResponse)
@@ -295,6 +354,7 @@ async def upload(
     user: Annotated[User, Depends(get_session_user_with_write_permission)],
     crud: Annotated[Crud, Depends(Crud.get)],
     files: list[UploadFile],
+    background: bool = False,
 ) -> UploadArtifactResponse:
     # Checks that the user is not uploading too many files at once.
     if len(files) > settings.artifact.max_concurrent_file_uploads:
@@ -325,18 +385,44 @@ async def upload(
             detail="User does not have permission to upload artifacts to this listing",
         )
 
+    # In the background mode, the raw files are just staged here, and the
+    # processing happens in the job queue.
+    job_ids: list[str] | None = None
+    if background:
+        artifacts = await asyncio.gather(
+            *(
+                crud.create_pending_artifact(
+                    name=filename,
+                    file=file,
+                    listing=listing,
+                    artifact_type=artifact_type,
+                )
+                for file, (filename, artifact_type) in zip(files, filenames)
+            )
+        )
+        jobs = [
+            await job_runner.submit(
+                PROCESS_ARTIFACT_JOB,
+                {"artifact_id": artifact.id, "name": filename, "artifact_type": artifact_type},
+                user_id=user.id,
+            )
+            for artifact, (filename, artifact_type) in zip(artifacts, filenames)
+        ]
+        job_ids = [job.id for job in jobs]
+
     # Uploads the artifacts in chunks and adds them to the listing.
-    artifacts = await asyncio.gather(
-        *(
-            crud.upload_artifact(
-                name=filename,
-                file=file,
-                listing=listing,
-                artifact_type=artifact_type,
+    else:
+        artifacts = await asyncio.gather(
+            *(
+                crud.upload_artifact(
+                    name=filename,
+                    file=file,
+                    listing=listing,
+                    artifact_type=artifact_type,
+                )
+                for file, (filename, artifact_type) in zip(files, filenames)
             )
-            for file, (filename, artifact_type) in zip(files, filenames)
         )
-    )
 
     artifact_responses = await asyncio.gather(
         *(
@@ -350,7 +436,92 @@ async def upload(
         )
     )
 
-    return UploadArtifactResponse(artifacts=list(artifact_responses))
+    return UploadArtifactResponse(artifacts=list(artifact_responses), job_ids=job_ids)
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: JobStatus
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    created_at: float
+    updated_at: float
+
+    @classmethod
+    def from_job(cls, job: Job) -> Self:
+        return cls(
+            job_id=job.id,
+            kind=job.kind,
+            status=job.status,
+            result=job.result,
+            error=job.error,
+            created_at=job.created_at,
+            updated_at=job.updated_at,
+        )
+
+
+async def get_user_job(job_id: str, user_id: str) -> Job:
+    job = await job_runner.get(job_id)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Could not find job")
+    return job
+
+
+def get_job_stream_resource(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    user: Annotated[User, Depends(get_session_user_with_read_permission)],
+) -> JobResponse:
+    return JobResponse.from_job(await get_user_job(job_id, user.id))
+
+
+class StreamTokenResponse(BaseModel):
+    token: str
+    expires_at: int
+
+
+@router.post("/jobs/{job_id}/stream-token", response_model=StreamTokenResponse)
+async def create_job_stream_token(
+    job_id: str,
+    user: Annotated[User, Depends(get_session_user_with_read_permission)],
+) -> StreamTokenResponse:
+    """Creates a short-lived token for following a job's events with an `EventSource`."""
+    await get_user_job(job_id, user.id)
+    token, expires_at = create_stream_token(user.id, get_job_stream_resource(job_id))
+    return StreamTokenResponse(token=token, expires_at=expires_at)
+
+
+async def job_events_generator(job_id: str) -> AsyncIterable[str]:
+    async for job in job_runner.watch(job_id):
+        yield f"event: status\ndata: {JobResponse.from_job(job).model_dump_json()}\n\n"
+    yield "event: finish\ndata: finish\n\n"
+
+
+@router.get("/jobs/{job_id}/events", response_class=StreamingResponse)
+async def get_job_events(
+    job_id: str,
+    request: Request,
+    crud: Annotated[Crud, Depends(Crud.get)],
+    token: str | None = None,
+) -> StreamingResponse:
+    # EventSource can't set headers, so it passes a stream token from the
+    # `stream-token` endpoint as a query parameter instead. API keys are
+    # only accepted in the header, to keep them out of access logs.
+    if token is not None:
+        user_id = verify_stream_token(token, get_job_stream_resource(job_id))
+    else:
+        api_key, user = await crud.get_principal(await get_request_api_key_id(request))
+        if api_key.permissions is None or "read" not in api_key.permissions:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
+        user_id = user.id
+    await get_user_job(job_id, user_id)
+
+    return StreamingResponse(content=job_events_generator(job_id), media_type="text/event-stream")
 
 
 class UpdateArtifactRequest(BaseModel):
@@ -426,13 +597,13 @@ class PresignedUrlResponse(BaseModel):
     artifact_id: str
 
 
-@router.post("/presigned/{listing_id}", response_model=PresignedUrlResponse)
-async def get_presigned_url(
+async def create_kernel_artifact(
     listing_id: str,
     filename: str,
-    user: Annotated[User, Depends(get_session_user_with_write_permission)],
-    crud: Annotated[Crud, Depends(Crud.get)],
-) -> PresignedUrlResponse:
+    user: User,
+    crud: Crud,
+    artifact_status: ArtifactStatus = "ready",
+) -> Artifact:
     if not filename:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -463,8 +634,20 @@ async def get_presigned_url(
         listing_id=listing.id,
         name=filename,
         artifact_type=artifact_type,
+        status=artifact_status,
     )
     await crud._add_item(artifact)
+    return artifact
+
+
+@router.post("/presigned/{listing_id}", response_model=PresignedUrlResponse)
+async def get_presigned_url(
+    listing_id: str,
+    filename: str,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> PresignedUrlResponse:
+    artifact = await create_kernel_artifact(listing_id, filename, user, crud, artifact_status="processing")
 
     try:
         s3_filename = get_artifact_name(artifact=artifact)
@@ -480,3 +663,250 @@ async def get_presigned_url(
     except Exception as e:
         await crud._delete_item(artifact)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.post("/finalize/{artifact_id}", response_model=SingleArtifactResponse)
+async def finalize_upload(
+    artifact_id: str,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> SingleArtifactResponse:
+    artifact = await crud.get_raw_artifact(artifact_id)
+    if artifact is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not find artifact associated with the given id",
+        )
+    if not await can_write_artifact(user, artifact):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User does not have permission to finalize this artifact",
+        )
+    artifact = await crud.finalize_artifact_upload(artifact)
+    return await SingleArtifactResponse.from_artifact(artifact=artifact, crud=crud, user=user)
+
+
+class MultipartUploadResponse(BaseModel):
+    upload_id: str
+    part_size: int
+    max_parts: int
+
+
+class PartRequest(BaseModel):
+    part_number: int
+    checksum_sha256: str | None = None
+
+
+class PartUrlsRequest(BaseModel):
+    upload_id: str
+    parts: list[PartRequest]
+
+
+class PartUrl(BaseModel):
+    part_number: int
+    url: str
+
+
+class PartUrlsResponse(BaseModel):
+    urls: list[PartUrl]
+    expires_at: int
+
+
+class UploadedPart(BaseModel):
+    part_number: int
+    etag: str
+    checksum_sha256: str | None = None
+
+
+class UploadedPartsResponse(BaseModel):
+    parts: list[UploadedPart]
+
+
+class CompleteMultipartRequest(BaseModel):
+    upload_id: str
+    parts: list[UploadedPart]
+
+
+class AbortMultipartRequest(BaseModel):
+    upload_id: str
+
+
+def get_multipart_upload_response(upload_id: str) -> MultipartUploadResponse:
+    return MultipartUploadResponse(
+        upload_id=upload_id,
+        part_size=settings.s3.presigned_part_size,
+        max_parts=MAX_MULTIPART_PARTS,
+    )
+
+
+async def sign_upload_parts(crud: Crud, s3_key: str, request: PartUrlsRequest) -> PartUrlsResponse:
+    """Signs a batch of part URLs for a presigned multipart upload.
+
+    Clients request URLs in batches as they go, so a resumed upload only
+    needs URLs for the parts which are still missing.
+
+    Args:
+        crud: The CRUD instance.
+        s3_key: The key of the object being uploaded.
+        request: The parts to sign URLs for.
+
+    Returns:
+        The presigned part URLs.
+    """
+    if len(request.parts) > settings.s3.presigned_part_batch_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.s3.presigned_part_batch_size} part URLs can be requested at once",
+        )
+    expires_in = settings.s3.presigned_url_expire_seconds
+    urls = await crud.generate_presigned_part_urls(
+        s3_key=s3_key,
+        upload_id=request.upload_id,
+        parts=[(part.part_number, part.checksum_sha256) for part in request.parts],
+        expires_in=expires_in,
+    )
+    return PartUrlsResponse(
+        urls=[PartUrl(part_number=part.part_number, url=url) for part, url in zip(request.parts, urls)],
+        expires_at=int(time.time()) + expires_in,
+    )
+
+
+def upload_not_found(e: ItemNotFoundError) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+
+async def list_upload_parts(crud: Crud, s3_key: str, upload_id: str) -> UploadedPartsResponse:
+    try:
+        parts = await crud.list_multipart_upload_parts(s3_key, upload_id)
+    except ItemNotFoundError as e:
+        raise upload_not_found(e)
+    return UploadedPartsResponse(
+        parts=[
+            UploadedPart(
+                part_number=part["PartNumber"],
+                etag=part["ETag"],
+                checksum_sha256=part.get("ChecksumSHA256"),
+            )
+            for part in parts
+        ]
+    )
+
+
+async def complete_upload(crud: Crud, s3_key: str, request: CompleteMultipartRequest) -> None:
+    parts: list[CompletedPartTypeDef] = []
+    for part in request.parts:
+        completed: CompletedPartTypeDef = {"PartNumber": part.part_number, "ETag": part.etag}
+        if part.checksum_sha256 is not None:
+            completed["ChecksumSHA256"] = part.checksum_sha256
+        parts.append(completed)
+    try:
+        await crud.complete_multipart_upload(s3_key, request.upload_id, parts)
+    except ItemNotFoundError as e:
+        raise upload_not_found(e)
+
+
+async def abort_upload(crud: Crud, s3_key: str, upload_id: str) -> None:
+    try:
+        await crud.abort_multipart_upload(s3_key, upload_id)
+    except ItemNotFoundError as e:
+        raise upload_not_found(e)
+
+
+async def get_writable_artifact(artifact_id: str, user: User, crud: Crud) -> Artifact:
+    artifact = await crud.get_raw_artifact(artifact_id)
+    if artifact is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not find artifact associated with the given id",
+        )
+    if not await can_write_artifact(user, artifact):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User does not have permission to upload to this artifact",
+        )
+    if artifact.artifact_type != "kernel":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only kernel images can be uploaded in parts",
+        )
+    if artifact.status == "ready":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Artifact has already been uploaded",
+        )
+    return artifact
+
+
+class ArtifactMultipartUploadResponse(MultipartUploadResponse):
+    artifact_id: str
+
+
+@router.post("/multipart/{listing_id}", response_model=ArtifactMultipartUploadResponse)
+async def create_multipart_upload(
+    listing_id: str,
+    filename: str,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> ArtifactMultipartUploadResponse:
+    artifact = await create_kernel_artifact(listing_id, filename, user, crud, artifact_status="processing")
+    try:
+        upload_id = await crud.create_presigned_multipart_upload(
+            filename=filename,
+            s3_key=get_artifact_name(artifact=artifact),
+            content_type="application/x-raw-disk-image",
+        )
+    except Exception:
+        await crud._delete_item(artifact)
+        raise
+    return ArtifactMultipartUploadResponse(
+        artifact_id=artifact.id,
+        **get_multipart_upload_response(upload_id).model_dump(),
+    )
+
+
+@router.post("/multipart/{artifact_id}/parts", response_model=PartUrlsResponse)
+async def get_multipart_part_urls(
+    artifact_id: str,
+    request: PartUrlsRequest,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> PartUrlsResponse:
+    artifact = await get_writable_artifact(artifact_id, user, crud)
+    return await sign_upload_parts(crud, get_artifact_name(artifact=artifact), request)
+
+
+@router.get("/multipart/{artifact_id}/parts", response_model=UploadedPartsResponse)
+async def get_multipart_uploaded_parts(
+    artifact_id: str,
+    upload_id: str,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> UploadedPartsResponse:
+    artifact = await get_writable_artifact(artifact_id, user, crud)
+    return await list_upload_parts(crud, get_artifact_name(artifact=artifact), upload_id)
+
+
+@router.post("/multipart/{artifact_id}/complete", response_model=SingleArtifactResponse)
+async def complete_multipart_upload(
+    artifact_id: str,
+    request: CompleteMultipartRequest,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> SingleArtifactResponse:
+    artifact = await get_writable_artifact(artifact_id, user, crud)
+    await complete_upload(crud, get_artifact_name(artifact=artifact), request)
+    artifact = await crud.finalize_artifact_upload(artifact)
+    return await SingleArtifactResponse.from_artifact(artifact=artifact, crud=crud, user=user)
+
+
+@router.post("/multipart/{artifact_id}/abort", response_model=bool)
+async def abort_multipart_upload(
+    artifact_id: str,
+    request: AbortMultipartRequest,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> bool:
+    artifact = await get_writable_artifact(artifact_id, user, crud)
+    await abort_upload(crud, get_artifact_name(artifact=artifact), request.upload_id)
+    await crud._delete_item(artifact)
+    return True
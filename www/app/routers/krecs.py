@@ -9,7 +9,20 @@ from pydantic import BaseModel
 
 from www.app.db import Crud
 from www.app.errors import ItemNotFoundError
-from www.app.model import KRec, User
+from www.app.model import ArtifactStatus, KRec, User, get_krec_name
+from www.app.routers.artifacts import (
+    AbortMultipartRequest,
+    CompleteMultipartRequest,
+    MultipartUploadResponse,
+    PartUrlsRequest,
+    PartUrlsResponse,
+    UploadedPartsResponse,
+    abort_upload,
+    complete_upload,
+    get_multipart_upload_response,
+    list_upload_parts,
+    sign_upload_parts,
+)
 from www.app.security.user import (
     get_session_user,
     get_session_user_with_write_permission,
@@ -32,13 +45,7 @@ class CreateKRecResponse(BaseModel):
     expires_at: int
 
 
-@router.post("/upload")
-async def create_krec(
-    request: CreateKRecRequest,
-    user: Annotated[User, Depends(get_session_user_with_write_permission)],
-    crud: Annotated[Crud, Depends(Crud.get)],
-) -> CreateKRecResponse:
-    """Initialize a KRec upload and return a presigned URL."""
+async def add_krec(request: CreateKRecRequest, user: User, crud: Crud) -> KRec:
     robot = await crud.get_robot(request.robot_id)
     if robot is None:
         raise ItemNotFoundError("Robot with ID %s not found", request.robot_id)
@@ -53,13 +60,24 @@ async def create_krec(
         robot_id=request.robot_id,
         name=request.name,
         description=request.description,
+        status="processing",
     )
     await crud._add_item(my_krec)
+    return my_krec
+
+
+@router.post("/upload")
+async def create_krec(
+    request: CreateKRecRequest,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> CreateKRecResponse:
+    """Initialize a KRec upload and return a presigned URL."""
+    my_krec = await add_krec(request, user, crud)
 
-    s3_key = f"krecs/{my_krec.id}/{my_krec.name}"
     upload_url = await crud.generate_presigned_upload_url(
         filename=my_krec.name,
-        s3_key=s3_key,
+        s3_key=get_krec_name(my_krec),
         content_type="video/x-matroska",
     )
 
@@ -79,17 +97,23 @@ class KRecUrls(BaseModel):
 
 async def get_krec_url_response(my_krec: KRec, crud: Crud) -> KRecUrls:
     try:
-        s3_key = f"krecs/{my_krec.id}/{my_krec.name}"
+        s3_key = get_krec_name(my_krec)
         download_filename = f"{my_krec.name}.mkv" if not my_krec.name.endswith(".mkv") else my_krec.name
 
         logger.info("Generating download URL for krec %s with key %s", my_krec.id, s3_key)
 
+        # Finalized KRecs already have their checksum stored, so the object
+        # doesn't need to be looked up on every request.
+        finalized = my_krec.status == "ready" and my_krec.checksum is not None
         url, checksum = await crud.generate_presigned_download_url(
             filename=download_filename,
             s3_key=s3_key,
             content_type="video/x-matroska",
             checksum_algorithm="SHA256",
+            fetch_checksum=not finalized,
         )
+        if finalized:
+            checksum = my_krec.checksum
 
         expiration_time = int((datetime.utcnow() + timedelta(hours=1)).timestamp())
 
@@ -110,11 +134,14 @@ class SingleKRecResponse(BaseModel):
     type: str = "KRec"
     urls: KRecUrls | None = None
     size: int | None = None
+    status: ArtifactStatus = "ready"
 
     @classmethod
     async def from_krec(cls, my_krec: KRec, crud: Crud) -> "SingleKRecResponse":
-        s3_key = f"krecs/{my_krec.id}/{my_krec.name}"
-        size = await crud.get_file_size(s3_key) if crud is not None else None
+        if my_krec.status == "ready" and my_krec.size_bytes is not None:
+            size: int | None = my_krec.size_bytes
+        else:
+            size = await crud.get_file_size(get_krec_name(my_krec)) if crud is not None else None
         urls = await get_krec_url_response(my_krec, crud)
 
         return cls(
@@ -125,6 +152,7 @@ class SingleKRecResponse(BaseModel):
             robot_id=my_krec.robot_id,
             urls=urls,
             size=size,
+            status=my_krec.status,
         )
 
 
@@ -215,3 +243,110 @@ async def delete_krec(
 
     await crud.delete_krec(krec_id)
     return True
+
+
+class KRecMultipartUploadResponse(MultipartUploadResponse):
+    krec_id: str
+
+
+async def get_own_krec(krec_id: str, user: User, crud: Crud) -> KRec:
+    my_krec = await crud.get_krec(krec_id)
+    if my_krec is None:
+        raise ItemNotFoundError("KRec with ID %s not found", krec_id)
+    if my_krec.user_id != user.id:
+        verify_admin_permission(user, "upload KRecs for another user")
+    return my_krec
+
+
+async def get_writable_krec(krec_id: str, user: User, crud: Crud) -> KRec:
+    my_krec = await get_own_krec(krec_id, user, crud)
+    if my_krec.status == "ready":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="KRec has already been uploaded")
+    return my_krec
+
+
+@router.post("/finalize/{krec_id}", response_model=SingleKRecResponse)
+async def finalize_krec(
+    krec_id: str,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> SingleKRecResponse:
+    """Record the size and checksum of a KRec once its presigned upload is done."""
+    # Finalizing is idempotent, since the sweep may have finalized the KRec
+    # before the client got to it.
+    my_krec = await get_own_krec(krec_id, user, crud)
+    if my_krec.status != "ready":
+        my_krec = await crud.finalize_krec_upload(my_krec)
+    return await SingleKRecResponse.from_krec(my_krec, crud)
+
+
+@router.post("/multipart", response_model=KRecMultipartUploadResponse)
+async def create_krec_multipart_upload(
+    request: CreateKRecRequest,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> KRecMultipartUploadResponse:
+    """Initialize a multipart KRec upload, for uploading parts in parallel."""
+    my_krec = await add_krec(request, user, crud)
+    try:
+        upload_id = await crud.create_presigned_multipart_upload(
+            filename=my_krec.name,
+            s3_key=get_krec_name(my_krec),
+            content_type="video/x-matroska",
+        )
+    except Exception:
+        await crud.delete_krec(my_krec.id)
+        raise
+    return KRecMultipartUploadResponse(krec_id=my_krec.id, **get_multipart_upload_response(upload_id).model_dump())
+
+
+@router.post("/multipart/{krec_id}/parts", response_model=PartUrlsResponse)
+async def get_krec_part_urls(
+    krec_id: str,
+    request: PartUrlsRequest,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> PartUrlsResponse:
+    """Get presigned URLs for a batch of parts of a multipart KRec upload."""
+    my_krec = await get_writable_krec(krec_id, user, crud)
+    return await sign_upload_parts(crud, get_krec_name(my_krec), request)
+
+
+@router.get("/multipart/{krec_id}/parts", response_model=UploadedPartsResponse)
+async def get_krec_uploaded_parts(
+    krec_id: str,
+    upload_id: str,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> UploadedPartsResponse:
+    """List the parts of a multipart KRec upload which are already uploaded."""
+    my_krec = await get_writable_krec(krec_id, user, crud)
+    return await list_upload_parts(crud, get_krec_name(my_krec), upload_id)
+
+
+@router.post("/multipart/{krec_id}/complete", response_model=SingleKRecResponse)
+async def complete_krec_multipart_upload(
+    krec_id: str,
+    request: CompleteMultipartRequest,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> SingleKRecResponse:
+    """Complete a multipart KRec upload from its uploaded parts."""
+    my_krec = await get_writable_krec(krec_id, user, crud)
+    await complete_upload(crud, get_krec_name(my_krec), request)
+    my_krec = await crud.finalize_krec_upload(my_krec)
+    return await SingleKRecResponse.from_krec(my_krec, crud)
+
+
+@router.post("/multipart/{krec_id}/abort", response_model=bool)
+async def abort_krec_multipart_upload(
+    krec_id: str,
+    request: AbortMultipartRequest,
+    user: Annotated[User, Depends(get_session_user_with_write_permission)],
+    crud: Annotated[Crud, Depends(Crud.get)],
+) -> bool:
+    """Abort a multipart KRec upload and delete the KRec."""
+    my_krec = await get_writable_krec(krec_id, user, crud)
+    await abort_upload(crud, get_krec_name(my_krec), request.upload_id)
+    await crud.delete_krec(my_krec.id)
+    return True
@@ -17,7 +17,7 @@ from fastapi import (
 from pydantic import BaseModel
 
 from www.app.crud.listings import SortOption
-from www.app.db import Crud
+from www.app.db import Crud, get_loading_crud
 from www.app.model import Listing, User, can_write_listing
 from www.app.routers.artifacts import SingleArtifactResponse
 from www.app.security.user import (
@@ -25,7 +25,9 @@ from www.app.security.user import (
     get_session_user_with_write_permission,
     maybe_get_user_from_api_key,
 )
+from www.settings import settings as app_settings
 from www.settings.environment import EnvironmentSettings
+from www.utils import cache_async_result
 
 # Create settings instance
 settings = EnvironmentSettings()
@@ -114,22 +116,52 @@ class ListingInfo(BaseModel):
 class ListListingsResponse(BaseModel):
     listings: list[ListingInfo]
     has_next: bool = False
+    next_cursor: str | None = None
 
 
-@router.get("/search", response_model=ListListingsResponse)
-async def list_listings(
-    crud: Annotated[Crud, Depends(Crud.get)],
-    page: int = Query(1, description="Page number for pagination"),
-    search_query: str = Query("", description="Search query string"),
-    sort_by: SortOption = Query(SortOption.NEWEST, description="Sort option for listings"),
+async def get_listings_response(
+    crud: Crud,
+    page: int,
+    search_query: str,
+    sort_by: SortOption,
+    cursor: str | None,
 ) -> ListListingsResponse:
-    listings, has_next = await crud.get_listings(page, search_query=search_query, sort_by=sort_by)
+    listings, next_cursor = await crud.get_listings(page, search_query=search_query, sort_by=sort_by, cursor=cursor)
     listings_with_usernames = await crud.get_listings_with_usernames(listings)
     listing_infos = [
         ListingInfo(id=listing.id, username=username, slug=listing.slug)
         for listing, username in listings_with_usernames
     ]
-    return ListListingsResponse(listings=listing_infos, has_next=has_next)
+    return ListListingsResponse(listings=listing_infos, has_next=next_cursor is not None, next_cursor=next_cursor)
+
+
+@cache_async_result(
+    app_settings.cache.listings_page_seconds,
+    capacity=256,
+    stale_seconds=app_settings.cache.listings_page_stale_seconds,
+)
+async def get_browse_page(page: int, sort_by: SortOption) -> ListListingsResponse:
+    """Gets a page of listings without a search query, which every visitor to the home page reads.
+
+    Pages are shared between requests, so this opens its own CRUD instance
+    rather than borrowing the request's, which may be closed by the time the
+    page is refreshed in the background.
+    """
+    async with Crud() as crud:
+        return await get_listings_response(crud, page, "", sort_by, None)
+
+
+@router.get("/search", response_model=ListListingsResponse)
+async def list_listings(
+    crud: Annotated[Crud, Depends(Crud.get)],
+    page: int = Query(1, description="Page number for pagination, if no cursor is provided"),
+    search_query: str = Query("", description="Search query string"),
+    sort_by: SortOption = Query(SortOption.NEWEST, description="Sort option for listings"),
+    cursor: str | None = Query(None, description="Cursor returned with the previous page"),
+) -> ListListingsResponse:
+    if not search_query and cursor is None:
+        return await get_browse_page(page, sort_by)
+    return await get_listings_response(crud, page, search_query, sort_by, cursor)
 
 
 class ListingInfoResponse(BaseModel):
@@ -153,7 +185,7 @@ class GetBatchListingsResponse(BaseModel):
 
 @router.get("/batch", response_model=GetBatchListingsResponse)
 async def get_batch_listing_info(
-    crud: Annotated[Crud, Depends(Crud.get)],
+    crud: Annotated[Crud, Depends(get_loading_crud)],
     user: Annotated[User | None, Depends(maybe_get_user_from_api_key)],
     ids: list[str] = Query(description="List of part ids"),
 ) -> GetBatchListingsResponse:
@@ -228,30 +260,32 @@ async def dump_listings(
 async def get_user_listings(
     user_id: str,
     crud: Annotated[Crud, Depends(Crud.get)],
-    page: int = Query(1, description="Page number for pagination"),
+    page: int = Query(1, description="Page number for pagination, if no cursor is provided"),
+    cursor: str | None = Query(None, description="Cursor returned with the previous page"),
 ) -> ListListingsResponse:
-    listings, has_next = await crud.get_user_listings(user_id, page)
+    listings, next_cursor = await crud.get_user_listings(user_id, page, cursor=cursor)
     listings_with_usernames = await crud.get_listings_with_usernames(listings)
     listing_infos = [
         ListingInfo(id=listing.id, username=username, slug=listing.slug)
         for listing, username in listings_with_usernames
     ]
-    return ListListingsResponse(listings=listing_infos, has_next=has_next)
+    return ListListingsResponse(listings=listing_infos, has_next=next_cursor is not None, next_cursor=next_cursor)
 
 
 @router.get("/me", response_model=ListListingsResponse)
 async def get_my_listings(
     user: Annotated[User, Depends(get_session_user_with_read_permission)],
     crud: Annotated[Crud, Depends(Crud.get)],
-    page: int = Query(1, description="Page number for pagination"),
+    page: int = Query(1, description="Page number for pagination, if no cursor is provided"),
+    cursor: str | None = Query(None, description="Cursor returned with the previous page"),
 ) -> ListListingsResponse:
-    listings, has_next = await crud.get_user_listings(user.id, page)
+    listings, next_cursor = await crud.get_user_listings(user.id, page, cursor=cursor)
     listings_with_usernames = await crud.get_listings_with_usernames(listings)
     listing_infos = [
         ListingInfo(id=listing.id, username=username, slug=listing.slug)
         for listing, username in listings_with_usernames
     ]
-    return ListListingsResponse(listings=listing_infos, has_next=has_next)
+    return ListListingsResponse(listings=listing_infos, has_next=next_cursor is not None, next_cursor=next_cursor)
 
 
 class NewListingResponse(BaseModel):
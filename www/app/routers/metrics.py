@@ -0,0 +1,67 @@
+"""Defines the API endpoints for reporting cache metrics."""
+
+import logging
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from pydantic.main import BaseModel
+
+from www.app.model import User
+from www.app.security.user import get_session_user_with_admin_permission
+from www.utils import get_cache_metrics, render_cache_metrics
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+class CacheMetricsResponse(BaseModel):
+    name: str
+    size: int
+    hits: int
+    stale_hits: int
+    misses: int
+    coalesced: int
+    refreshes: int
+    evictions: int
+    expirations: int
+    loads: int
+    load_seconds: float
+    hit_rate: float | None
+
+
+class ListCacheMetricsResponse(BaseModel):
+    caches: list[CacheMetricsResponse]
+
+
+@router.get("", response_class=PlainTextResponse)
+async def get_prometheus_metrics() -> str:
+    """Reports the metrics of every cache in this process, for Prometheus to scrape."""
+    return render_cache_metrics()
+
+
+@router.get("/caches", response_model=ListCacheMetricsResponse)
+async def list_cache_metrics(
+    admin_user: Annotated[User, Depends(get_session_user_with_admin_permission)],
+) -> ListCacheMetricsResponse:
+    caches = []
+    for name, metrics in get_cache_metrics().items():
+        lookups = metrics["hits"] + metrics["stale_hits"] + metrics["misses"]
+        caches.append(
+            CacheMetricsResponse(
+                name=name,
+                size=int(metrics["size"]),
+                hits=int(metrics["hits"]),
+                stale_hits=int(metrics["stale_hits"]),
+                misses=int(metrics["misses"]),
+                coalesced=int(metrics["coalesced"]),
+                refreshes=int(metrics["refreshes"]),
+                evictions=int(metrics["evictions"]),
+                expirations=int(metrics["expirations"]),
+                loads=int(metrics["loads"]),
+                load_seconds=metrics["load_seconds"],
+                hit_rate=(metrics["hits"] + metrics["stale_hits"]) / lookups if lookups else None,
+            )
+        )
+    return ListCacheMetricsResponse(caches=caches)
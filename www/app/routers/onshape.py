@@ -84,10 +84,9 @@ async def pull_onshape_document(
         token = request.headers.get("Authorization") or request.headers.get("authorization")
         if token is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authorization header not found")
-    api_key = await crud.get_api_key(token)
+    api_key, user = await crud.get_principal(token)
     if api_key.permissions is None or "write" not in api_key.permissions:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
-    user = await crud.get_user(api_key.user_id, throw_if_missing=True)
 
     config = ConverterConfig(
         default_prismatic_joint_effort=default_prismatic_joint_effort,
@@ -0,0 +1,61 @@
+"""Defines short-lived tokens for streaming endpoints.
+
+Browsers' `EventSource` can't set headers, so streaming endpoints have to
+take their credentials in the query string, which ends up in proxy and
+access logs. Rather than the API key itself, clients exchange their API key
+for a signed token which only grants access to one resource, and expires
+after `stream_token_seconds`.
+"""
+
+import time
+
+import jwt
+
+from www.app.errors import NotAuthenticatedError
+from www.settings import settings
+
+STREAM_TOKEN_AUDIENCE = "stream"
+
+
+def create_stream_token(user_id: str, resource: str) -> tuple[str, int]:
+    """Creates a token which lets a user stream a single resource.
+
+    Args:
+        user_id: The user the token is for.
+        resource: The resource the token grants access to, like "job:123".
+
+    Returns:
+        The token, and the time it expires at.
+    """
+    expires_at = int(time.time()) + settings.crypto.stream_token_seconds
+    claims = {"sub": user_id, "aud": STREAM_TOKEN_AUDIENCE, "resource": resource, "exp": expires_at}
+    return jwt.encode(claims, settings.crypto.jwt_secret, algorithm=settings.crypto.algorithm), expires_at
+
+
+def verify_stream_token(token: str, resource: str) -> str:
+    """Checks a stream token, and that it grants access to a resource.
+
+    Args:
+        token: The token.
+        resource: The resource being accessed.
+
+    Returns:
+        The ID of the user the token is for.
+
+    Raises:
+        NotAuthenticatedError: If the token is invalid, expired, or for
+            another resource.
+    """
+    try:
+        claims = jwt.decode(
+            token,
+            settings.crypto.jwt_secret,
+            algorithms=[settings.crypto.algorithm],
+            audience=STREAM_TOKEN_AUDIENCE,
+            options={"require": ["exp", "sub", "aud"]},
+        )
+    except jwt.PyJWTError:
+        raise NotAuthenticatedError("Invalid stream token")
+    if claims.get("resource") != resource:
+        raise NotAuthenticatedError("Invalid stream token")
+    return claims["sub"]
@@ -34,8 +34,8 @@ async def get_session_user(
     api_key_id: Annotated[str, Depends(get_request_api_key_id)],
 ) -> User:
     try:
-        api_key = await crud.get_api_key(api_key_id)
-        return await crud.get_user(api_key.user_id, throw_if_missing=True)
+        _, user = await crud.get_principal(api_key_id)
+        return user
     except ItemNotFoundError:
         raise NotAuthenticatedError("Not authenticated")
 
@@ -46,10 +46,10 @@ async def get_session_user_with_permission(
     api_key_id: str,
 ) -> User:
     try:
-        api_key = await crud.get_api_key(api_key_id)
+        api_key, user = await crud.get_principal(api_key_id)
         if api_key.permissions is None or permission not in api_key.permissions:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
-        return await crud.get_user(api_key.user_id, throw_if_missing=True)
+        return user
     except ItemNotFoundError:
         raise NotAuthenticatedError("Not authenticated")
 
@@ -79,5 +79,9 @@ async def maybe_get_user_from_api_key(
 ) -> User | None:
     if api_key_id is None:
         return None
-    api_key = await crud.get_api_key(api_key_id)
-    return await crud.get_user(api_key.user_id, throw_if_missing=False)
+    try:
+        _, user = await crud.get_principal(api_key_id)
+    except ItemNotFoundError:
+        # Callers whose key or user no longer exists are treated as anonymous.
+        return None
+    return user
@@ -0,0 +1,139 @@
+"""Defines helpers for ingesting uploaded tgz and zip archives.
+
+Each archive member is validated and normalized independently in the worker
+process pool, while the rebuilt `.tgz` is compressed on the fly into a
+`BytePipe` which the S3 uploader reads from. Only a bounded number of members
+and a bounded amount of compressed output are held in memory at once.
+"""
+
+import asyncio
+import io
+from pathlib import Path
+from xml.etree import ElementTree as ET
+
+import trimesh
+from PIL import Image
+
+from www.app.errors import BadArtifactError
+from www.app.utils.formats.stl import validate_binary_stl
+from www.utils import save_xml
+
+IMAGE_FORMATS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".gif": "GIF",
+    ".bmp": "BMP",
+    ".tiff": "TIFF",
+    ".webp": "WEBP",
+}
+
+
+def normalize_archive_member(data: bytes, subname: str) -> bytes:
+    """Validates and normalizes a single file from an uploaded archive.
+
+    This runs in a worker process, so it must only use picklable arguments.
+
+    Args:
+        data: The file contents.
+        subname: The path of the file within the archive.
+
+    Returns:
+        The normalized file contents.
+    """
+    subtype = Path(subname).suffix.lower()
+    match subtype:
+        case ".stl" if validate_binary_stl(io.BytesIO(data)):
+            return data
+
+        case ".stl" | ".obj" | ".ply" | ".dae":
+            tmesh = trimesh.load(io.BytesIO(data), file_type=subtype)
+            if not isinstance(tmesh, trimesh.Trimesh):
+                raise BadArtifactError(f"Invalid mesh file: {subname}")
+            exported = tmesh.export(file_type=subtype.lstrip("."))
+            if isinstance(exported, str):
+                return exported.encode("utf-8")
+            if not isinstance(exported, bytes):
+                raise BadArtifactError(f"Could not export mesh file: {subname}")
+            return exported
+
+        case _ if subtype in IMAGE_FORMATS:
+            out_file = io.BytesIO()
+            Image.open(io.BytesIO(data)).save(out_file, format=IMAGE_FORMATS[subtype])
+            return out_file.getvalue()
+
+        case ".urdf" | ".mjcf":
+            try:
+                tree = ET.parse(io.BytesIO(data))
+            except Exception:
+                raise BadArtifactError("Invalid XML file")
+            out_file = io.BytesIO()
+            save_xml(out_file, tree)
+            return out_file.getvalue()
+
+        case _:
+            raise BadArtifactError(f"Invalid file in archive: {subname}")
+
+
+class ChunkSink(io.RawIOBase):
+    """A write-only file which collects written chunks until they are drained."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class BytePipe:
+    """An in-memory pipe between an async producer and an async reader.
+
+    Writers block once `max_buffer_bytes` are waiting to be read, so a fast
+    producer can't buffer an unbounded amount of data ahead of the reader.
+    If the producer fails, it closes the pipe with the exception, which is
+    then raised to the reader.
+    """
+
+    def __init__(self, max_buffer_bytes: int) -> None:
+        super().__init__()
+
+        self._buffer = bytearray()
+        self._max_buffer_bytes = max_buffer_bytes
+        self._closed = False
+        self._error: BaseException | None = None
+        self._condition = asyncio.Condition()
+
+    async def write(self, data: bytes) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._closed or len(self._buffer) < self._max_buffer_bytes)
+            if self._closed:
+                raise BrokenPipeError("Pipe is closed")
+            self._buffer.extend(data)
+            self._condition.notify_all()
+
+    async def close(self, error: BaseException | None = None) -> None:
+        async with self._condition:
+            self._closed = True
+            self._error = error
+            self._condition.notify_all()
+
+    async def read(self, size: int = -1) -> bytes:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._closed or len(self._buffer) > 0)
+            if self._error is not None:
+                raise self._error
+            size = len(self._buffer) if size < 0 else min(size, len(self._buffer))
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._condition.notify_all()
+            return data
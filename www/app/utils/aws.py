@@ -0,0 +1,113 @@
+"""Defines a process-wide pool of AWS resources.
+
+Opening an `aioboto3` session, resolving credentials and building the HTTP
+connection pool is expensive, so instead of doing it for every request we
+open the DynamoDB and S3 resources once per process (in the app lifespan)
+and let each `Crud` instance borrow them.
+"""
+
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+
+import aioboto3
+from aiobotocore.config import AioConfig
+from types_aiobotocore_dynamodb.service_resource import DynamoDBServiceResource
+from types_aiobotocore_s3.service_resource import S3ServiceResource
+
+from www.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_client_config() -> AioConfig:
+    return AioConfig(
+        max_pool_connections=settings.aws.max_pool_connections,
+        connect_timeout=settings.aws.connect_timeout,
+        read_timeout=settings.aws.read_timeout,
+        tcp_keepalive=True,
+        connector_args={"keepalive_timeout": settings.aws.keepalive_timeout},
+    )
+
+
+class AWSClientManager:
+    """Holds the shared DynamoDB and S3 resources for the current process.
+
+    The underlying HTTP sessions are bound to the event loop they were created
+    on, so if the manager is used from a different loop (for example, from a
+    one-off script run with `asyncio.run`) the resources are re-opened.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stack: AsyncExitStack | None = None
+        self._db: DynamoDBServiceResource | None = None
+        self._s3: S3ServiceResource | None = None
+        self._stale_stacks: list[AsyncExitStack] = []
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+            if self._stack is not None:
+                self._stale_stacks.append(self._stack)
+            self._stack = None
+            self._db = None
+            self._s3 = None
+        return self._lock
+
+    async def _close_stale(self) -> None:
+        # Resources opened on an earlier loop are closed before opening new
+        # ones, so their sessions and connectors don't leak. If that loop is
+        # already closed this can fail, which is fine to ignore.
+        while self._stale_stacks:
+            stack = self._stale_stacks.pop()
+            try:
+                await stack.aclose()
+            except Exception:
+                logger.warning("Failed to close AWS resources from a previous event loop", exc_info=True)
+
+    async def start(self) -> None:
+        async with self._get_lock():
+            await self._close_stale()
+            if self._stack is not None:
+                return
+            stack = AsyncExitStack()
+            session = aioboto3.Session()
+            config = get_client_config()
+            try:
+                db = await stack.enter_async_context(session.resource("dynamodb", config=config))
+                s3 = await stack.enter_async_context(session.resource("s3", config=config))
+            except BaseException:
+                await stack.aclose()
+                raise
+            self._stack, self._db, self._s3 = stack, db, s3
+            logger.info("Opened AWS resources with a pool of %d connections", settings.aws.max_pool_connections)
+
+    async def close(self) -> None:
+        async with self._get_lock():
+            await self._close_stale()
+            if self._stack is None:
+                return
+            stack, self._stack, self._db, self._s3 = self._stack, None, None, None
+            await stack.aclose()
+            logger.info("Closed AWS resources")
+
+    async def get(self) -> tuple[DynamoDBServiceResource, S3ServiceResource]:
+        """Returns the shared resources, opening them if needed.
+
+        Returns:
+            The DynamoDB and S3 service resources.
+        """
+        if self._loop is not asyncio.get_running_loop() or self._db is None or self._s3 is None:
+            await self.start()
+        if self._db is None or self._s3 is None:
+            raise RuntimeError("AWS resources failed to open")
+        return self._db, self._s3
+
+
+aws_clients = AWSClientManager()
@@ -1,30 +1,57 @@
 """This module provides a class to generate signed URLs for AWS CloudFront using RSA keys.
 
 The `CloudFrontUrlSigner` class allows you to create and sign CloudFront URLs with optional custom policies.
+Signing is an RSA operation, so `get_cloudfront_signer` returns a process-wide signer which parses the private
+key once and memoizes signed URLs. Expiration times are rounded up to a fixed bucket, so every request for the
+same resource within a bucket gets the same signed URL back. `sign_prefix` signs a wildcard policy instead, so
+that one signature can be shared by every artifact under a listing's prefix.
 """
 
+import base64
+import functools
 import json
+import math
+import time
 from datetime import datetime, timedelta
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
 from botocore.signers import CloudFrontSigner
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
 
+from www.settings import settings
+from www.utils import LRUCache
+
 
 class CloudFrontUrlSigner:
     """A class to generate signed URLs for AWS CloudFront using RSA keys."""
 
-    def __init__(self, key_id: str, private_key: str) -> None:
+    def __init__(self, key_id: str, private_key: str, cache_size: int = 0) -> None:
         """Initialize the CloudFrontUrlSigner with a key ID and private key content.
 
         :param key_id: The CloudFront key ID associated with the public key in your CloudFront key group.
         :param private_key: The private key content in PEM format.
+        :param cache_size: The number of signed URLs to memoize in `sign_url`.
         """
         self.key_id = key_id
         self.private_key = private_key
         self.cf_signer = CloudFrontSigner(key_id, self._rsa_signer)
+        self._rsa_private_key: RSAPrivateKey | None = None
+        self._url_cache: LRUCache[str, tuple[int, str]] | None = (
+            LRUCache(cache_size, name="signed_urls") if cache_size > 0 else None
+        )
+
+    def _get_private_key(self) -> RSAPrivateKey:
+        if self._rsa_private_key is None:
+            private_key = serialization.load_pem_private_key(
+                self.private_key.encode("utf-8"),
+                password=None,
+            )
+            if not isinstance(private_key, RSAPrivateKey):
+                raise ValueError("The provided key is not an RSA private key")
+            self._rsa_private_key = private_key
+        return self._rsa_private_key
 
     def _rsa_signer(self, message: bytes) -> bytes:
         """RSA signer function that signs a message using the private key.
@@ -38,15 +65,7 @@ class CloudFrontUrlSigner:
         Raises:
             ValueError: If the loaded key is not an RSA private key.
         """
-        private_key = serialization.load_pem_private_key(
-            self.private_key.encode("utf-8"),
-            password=None,
-        )
-
-        if not isinstance(private_key, RSAPrivateKey):
-            raise ValueError("The provided key is not an RSA private key")
-
-        return private_key.sign(message, padding.PKCS1v15(), hashes.SHA1())
+        return self._get_private_key().sign(message, padding.PKCS1v15(), hashes.SHA1())
 
     def generate_presigned_url(self, url: str, policy: Optional[str] = None) -> str:
         """Generate a presigned URL for CloudFront using an optional custom policy.
@@ -66,6 +85,16 @@ class CloudFrontUrlSigner:
         :return: The custom policy in JSON format.
         """
         expiration_time = int((datetime.utcnow() + timedelta(days=expire_days)).timestamp())
+        return self.create_policy_with_expiration(url, expiration_time, ip_range)
+
+    def create_policy_with_expiration(self, url: str, expiration_time: int, ip_range: Optional[str] = None) -> str:
+        """Create a custom policy for CloudFront signed URLs which expires at a given time.
+
+        :param url: The URL to be signed.
+        :param expiration_time: The Unix timestamp at which the policy expires.
+        :param ip_range: Optional IP range to restrict access (e.g., "203.0.113.0/24").
+        :return: The custom policy in JSON format.
+        """
         policy: dict[str, Any] = {
             "Statement": [
                 {
@@ -80,3 +109,72 @@ class CloudFrontUrlSigner:
             policy["Statement"][0]["Condition"]["IpAddress"] = {"AWS:SourceIp": ip_range}
 
         return json.dumps(policy, separators=(",", ":"))
+
+    def _get_bucketed_expiration(self, expire_days: float, bucket_seconds: int) -> int:
+        return math.ceil((time.time() + expire_days * 86400) / bucket_seconds) * bucket_seconds
+
+    def _memoize(self, key: str, expiration_time: int, sign: Callable[[], str]) -> str:
+        if self._url_cache is not None and (cached := self._url_cache.get(key)) is not None:
+            cached_expiration_time, signed = cached
+            if cached_expiration_time == expiration_time:
+                return signed
+            self._url_cache.stats.recount_hit_as_expired()
+        signed = sign()
+        if self._url_cache is not None:
+            self._url_cache.put(key, (expiration_time, signed))
+        return signed
+
+    def sign_url(self, url: str, expire_days: float, bucket_seconds: int) -> tuple[str, int]:
+        """Sign a URL, reusing an earlier signature for the same expiration bucket.
+
+        The expiration time is rounded up to the next multiple of
+        `bucket_seconds`, so the URL stays valid for between `expire_days`
+        and `expire_days` plus one bucket.
+
+        :param url: The URL to sign.
+        :param expire_days: The minimum number of days the signed URL should be valid for.
+        :param bucket_seconds: The granularity of the expiration time.
+        :return: The signed URL and its expiration time.
+        """
+        expiration_time = self._get_bucketed_expiration(expire_days, bucket_seconds)
+        signed_url = self._memoize(
+            url,
+            expiration_time,
+            lambda: self.generate_presigned_url(url, policy=self.create_policy_with_expiration(url, expiration_time)),
+        )
+        return signed_url, expiration_time
+
+    def sign_prefix(self, prefix: str, expire_days: float, bucket_seconds: int) -> tuple[str, int]:
+        """Sign a wildcard policy which grants access to every URL under a prefix.
+
+        The returned query string can be appended to any URL which starts
+        with `prefix`, so a single signature covers all of them.
+
+        :param prefix: The URL prefix, like "https://example.com/image/123/".
+        :param expire_days: The minimum number of days the signature should be valid for.
+        :param bucket_seconds: The granularity of the expiration time.
+        :return: The signed query string and its expiration time.
+        """
+        resource = f"{prefix}*"
+        expiration_time = self._get_bucketed_expiration(expire_days, bucket_seconds)
+
+        def sign() -> str:
+            policy = self.create_policy_with_expiration(resource, expiration_time).encode("utf-8")
+            signature = self._rsa_signer(policy)
+            return f"Policy={_url_b64encode(policy)}&Signature={_url_b64encode(signature)}&Key-Pair-Id={self.key_id}"
+
+        return self._memoize(resource, expiration_time, sign), expiration_time
+
+
+def _url_b64encode(data: bytes) -> str:
+    # CloudFront's URL-safe variant of base64.
+    return base64.b64encode(data).replace(b"+", b"-").replace(b"=", b"_").replace(b"/", b"~").decode("utf-8")
+
+
+@functools.cache
+def get_cloudfront_signer() -> CloudFrontUrlSigner:
+    return CloudFrontUrlSigner(
+        key_id=settings.cloudfront.key_id,
+        private_key=settings.cloudfront.private_key,
+        cache_size=settings.cloudfront.signed_url_cache_size,
+    )
@@ -0,0 +1,71 @@
+"""Defines a fast validator for binary STL files.
+
+A binary STL file is an 80-byte header, a little-endian `uint32` triangle
+count, and then 50 bytes per triangle: a normal vector, three vertices and a
+two-byte attribute field. Since that layout fully determines the file size,
+well-formed binary STLs can be recognized and validated directly, without
+parsing them into a mesh and re-exporting them.
+"""
+
+import os
+import struct
+from typing import IO
+
+import numpy as np
+
+from www.app.errors import BadArtifactError
+
+HEADER_BYTES = 80
+COUNT_BYTES = 4
+TRIANGLE_DTYPE = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attributes", "<u2")])
+MAX_COORDINATE = 1e6
+CHUNK_TRIANGLES = 1 << 16
+
+
+def validate_binary_stl(file: IO[bytes]) -> bool:
+    """Checks whether a file is a valid binary STL.
+
+    The face buffer is read in fixed-size chunks, so memory use doesn't
+    depend on the size of the mesh. The file is rewound to where it started
+    before returning.
+
+    Args:
+        file: The seekable file to check, positioned at the start of the STL.
+
+    Returns:
+        True if the file is a binary STL with sane vertex data, False if it
+        is not a binary STL at all (for example, an ASCII STL).
+
+    Raises:
+        BadArtifactError: If the file is laid out like a binary STL but its
+            vertex data is not finite or is out of bounds.
+    """
+    start = file.tell()
+    try:
+        total_bytes = file.seek(0, os.SEEK_END) - start
+        file.seek(start)
+        if total_bytes < HEADER_BYTES + COUNT_BYTES:
+            return False
+
+        file.seek(start + HEADER_BYTES)
+        (num_triangles,) = struct.unpack("<I", file.read(COUNT_BYTES))
+        if num_triangles == 0 or total_bytes != HEADER_BYTES + COUNT_BYTES + num_triangles * TRIANGLE_DTYPE.itemsize:
+            return False
+
+        remaining = num_triangles
+        while remaining > 0:
+            count = min(remaining, CHUNK_TRIANGLES)
+            buffer = file.read(count * TRIANGLE_DTYPE.itemsize)
+            if len(buffer) != count * TRIANGLE_DTYPE.itemsize:
+                return False
+            vertices = np.frombuffer(buffer, dtype=TRIANGLE_DTYPE)["vertices"]
+            if not np.isfinite(vertices).all():
+                raise BadArtifactError("STL file contains non-finite vertex coordinates")
+            if (np.abs(vertices) > MAX_COORDINATE).any():
+                raise BadArtifactError(f"STL file contains vertex coordinates larger than {MAX_COORDINATE:g}")
+            remaining -= count
+
+        return True
+
+    finally:
+        file.seek(start)
@@ -0,0 +1,85 @@
+"""Defines helpers for resizing uploaded images.
+
+Cropping, resizing and PNG-encoding a large image takes hundreds of
+milliseconds of pure CPU time, so each size variant is rendered in the
+worker process pool and the upload handlers just await the result.
+"""
+
+import asyncio
+import io
+
+from PIL import Image
+
+from www.app.errors import BadArtifactError
+from www.app.utils.workers import process_pool
+from www.settings import settings
+
+
+def crop_image(image: Image.Image, size: tuple[int, int], quality: int) -> bytes:
+    """Center-crops an image to the aspect ratio of `size`, then resizes it.
+
+    Args:
+        image: The image to crop.
+        size: The target width and height.
+        quality: The encoder quality setting.
+
+    Returns:
+        The PNG-encoded image.
+    """
+    image_ratio, size_ratio = image.width / image.height, size[0] / size[1]
+    if image_ratio > size_ratio:
+        new_width = int(image.height * size_ratio)
+        new_height = image.height
+        left = (image.width - new_width) // 2
+        upper = 0
+    else:
+        new_width = image.width
+        new_height = int(image.width / size_ratio)
+        left = 0
+        upper = (image.height - new_height) // 2
+    right = left + new_width
+    lower = upper + new_height
+    image = image.crop((left, upper, right, lower))
+
+    # Resize the image to the desired size.
+    image = image.resize(size, resample=Image.Resampling.BICUBIC)
+
+    # Save the image to a byte stream.
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format="PNG", optimize=True, quality=quality)
+    return image_bytes.getvalue()
+
+
+def _process_image(source: bytes | Image.Image, size: tuple[int, int], quality: int) -> bytes:
+    image = Image.open(io.BytesIO(source)) if isinstance(source, bytes) else source
+    return crop_image(image, size, quality)
+
+
+class ImageProcessor:
+    """Renders image size variants in the worker process pool."""
+
+    async def crop(self, source: bytes | Image.Image, size: tuple[int, int]) -> bytes:
+        """Decodes, crops and encodes an image in a worker process.
+
+        Args:
+            source: The encoded image, or an already-decoded image.
+            size: The target width and height.
+
+        Returns:
+            The PNG-encoded image.
+        """
+        try:
+            return await process_pool.run(
+                _process_image,
+                source,
+                size,
+                settings.artifact.quality,
+                timeout=settings.artifact.image_timeout_seconds,
+            )
+        except asyncio.TimeoutError:
+            raise BadArtifactError("Timed out while processing image")
+        except (OSError, Image.DecompressionBombError) as e:
+            raise BadArtifactError(f"Invalid image: {e}")
+
+
+image_processor = ImageProcessor()
@@ -0,0 +1,361 @@
+"""Defines a cross-request cache for rows which are read often and rarely change.
+
+Users, listings and tags are read on almost every request, but only change
+when someone edits them. The cache keeps recently read rows in two levels:
+
+- An in-process LRU, bounded by both the number of entries and their
+  approximate size, which serves most reads without leaving the process.
+- An optional shared backend, so that the worker processes on a host warm
+  one copy instead of one each. `SQLiteItemCacheBackend` keeps entries in
+  a SQLite file which every worker can read.
+
+Only item types with a configured TTL are cached. Writes invalidate both
+levels in the writing process, and the shared backend for everyone, but
+other processes may keep serving their in-process copy for up to
+`local_ttl_seconds`, which is why that is kept short.
+
+Reads which started before an invalidation are not cached, so that a slow
+read which raced with a write doesn't put back the old row. The shared
+backend records when each key was invalidated, so it also skips reads which
+raced with a write in another process; the reading process may still keep
+its in-process copy until `local_ttl_seconds` runs out.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Callable, Iterable, Mapping, NamedTuple
+
+from www.settings import settings
+from www.utils import CacheStats, LRUCache, register_cache
+
+logger = logging.getLogger(__name__)
+
+# Maps keys to (expiry time, encoded item) pairs.
+EncodedEntries = dict[str, tuple[float, str]]
+
+
+def encode_item(item: dict[str, Any]) -> str:
+    def default(value: Any) -> Any:  # noqa: ANN401
+        if isinstance(value, Decimal):
+            return int(value) if value == int(value) else float(value)
+        if isinstance(value, set):
+            return sorted(value)
+        raise TypeError(f"Can't encode {type(value).__name__}")
+
+    return json.dumps(item, default=default, separators=(",", ":"))
+
+
+class ItemCacheBackend(ABC):
+    """Defines the interface for a cache which is shared between processes."""
+
+    @abstractmethod
+    async def get_many(self, keys: list[str]) -> EncodedEntries:
+        """Gets the entries which exist and haven't expired."""
+
+    @abstractmethod
+    async def put_many(self, entries: EncodedEntries, read_at: float) -> None:
+        """Adds or replaces entries, except for keys invalidated since `read_at`."""
+
+    @abstractmethod
+    async def delete_many(self, keys: list[str]) -> None:
+        """Removes entries, if they exist, and records that they were invalidated."""
+
+    @abstractmethod
+    async def get_invalidations(self, keys: list[str]) -> dict[str, float]:
+        """Gets when each key was last invalidated, for keys which were."""
+
+    async def close(self) -> None:
+        """Releases any resources held by the backend."""
+
+
+class SQLiteItemCacheBackend(ItemCacheBackend):
+    """Stores cache entries in a SQLite database.
+
+    SQLite calls are blocking, so they run in a thread. Expired entries are
+    skipped on read, and pruned every so often on write, along with
+    invalidation times older than `invalidation_seconds`, which only need to
+    outlive the slowest read.
+    """
+
+    def __init__(self, path: str | Path, prune_every: int = 1000, invalidation_seconds: float = 60 * 60) -> None:
+        super().__init__()
+
+        self._path = Path(path)
+        self._prune_every = prune_every
+        self._invalidation_seconds = invalidation_seconds
+        self._num_puts = 0
+        self._conn: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    key TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL,
+                    value TEXT NOT NULL
+                )
+                """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS invalidations (
+                    key TEXT PRIMARY KEY,
+                    invalidated_at REAL NOT NULL
+                )
+                """)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:  # noqa: ANN401
+        async with self._lock:
+            return await asyncio.to_thread(lambda: func(self._connect()))
+
+    async def get_many(self, keys: list[str]) -> EncodedEntries:
+        def get_many(conn: sqlite3.Connection) -> EncodedEntries:
+            placeholders = ", ".join("?" for _ in keys)
+            rows = conn.execute(
+                f"SELECT key, expires_at, value FROM items WHERE key IN ({placeholders}) AND expires_at > ?",
+                (*keys, time.time()),
+            ).fetchall()
+            return {key: (expires_at, value) for key, expires_at, value in rows}
+
+        return await self._run(get_many) if keys else {}
+
+    async def put_many(self, entries: EncodedEntries, read_at: float) -> None:
+        self._num_puts += len(entries)
+        prune, self._num_puts = self._num_puts >= self._prune_every, self._num_puts % self._prune_every
+
+        def put_many(conn: sqlite3.Connection) -> None:
+            # Checks for an invalidation in the same statement as the insert,
+            # so that a write in another process can't slip in between.
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO items
+                SELECT ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM invalidations WHERE key = ? AND invalidated_at >= ?)
+                """,
+                [(key, expires_at, value, key, read_at) for key, (expires_at, value) in entries.items()],
+            )
+            if prune:
+                now = time.time()
+                conn.execute("DELETE FROM items WHERE expires_at <= ?", (now,))
+                conn.execute("DELETE FROM invalidations WHERE invalidated_at <= ?", (now - self._invalidation_seconds,))
+
+        await self._run(put_many)
+
+    async def delete_many(self, keys: list[str]) -> None:
+        def delete_many(conn: sqlite3.Connection) -> None:
+            # Records the invalidation before deleting, so that a stale put
+            # either lands first and is deleted, or is skipped.
+            now = time.time()
+            conn.executemany("INSERT OR REPLACE INTO invalidations VALUES (?, ?)", [(key, now) for key in keys])
+            conn.executemany("DELETE FROM items WHERE key = ?", [(key,) for key in keys])
+
+        await self._run(delete_many)
+
+    async def get_invalidations(self, keys: list[str]) -> dict[str, float]:
+        def get_invalidations(conn: sqlite3.Connection) -> dict[str, float]:
+            placeholders = ", ".join("?" for _ in keys)
+            rows = conn.execute(
+                f"SELECT key, invalidated_at FROM invalidations WHERE key IN ({placeholders})",
+                keys,
+            ).fetchall()
+            return dict(rows)
+
+        return await self._run(get_invalidations) if keys else {}
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            conn.close()
+
+
+class _Entry(NamedTuple):
+    expires_at: float
+    item: dict[str, Any]
+    size: int
+
+
+class ItemCache:
+    """Caches raw items by key, in process and optionally in a shared backend.
+
+    Args:
+        ttls: The number of seconds to cache each item type for, keyed by
+            the item's `type` attribute. Other types aren't cached.
+        capacity: The maximum number of in-process entries.
+        max_bytes: The maximum total encoded size of in-process entries.
+        local_ttl: If set, the most seconds to keep an in-process entry,
+            even if its type's TTL is longer. This bounds how stale a
+            process can be after a write in another process.
+        backend: The shared backend, if any.
+        name: If set, report metrics for the cache under this name.
+    """
+
+    def __init__(
+        self,
+        ttls: Mapping[str, float],
+        capacity: int,
+        max_bytes: int,
+        *,
+        local_ttl: float | None = None,
+        backend: ItemCacheBackend | None = None,
+        name: str | None = None,
+    ) -> None:
+        super().__init__()
+
+        self._ttls = dict(ttls)
+        self._capacity = capacity
+        self._max_bytes = max_bytes
+        self._local_ttl = local_ttl
+        self._backend = backend
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._num_bytes = 0
+        self._invalidated_at = LRUCache[str, float](capacity)
+        self.stats = CacheStats()
+        if name is not None:
+            register_cache(name, self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def backend(self) -> ItemCacheBackend | None:
+        return self._backend
+
+    def caches(self, item_type: str) -> bool:
+        return item_type in self._ttls
+
+    def _pop_local(self, key: str) -> None:
+        if (entry := self._entries.pop(key, None)) is not None:
+            self._num_bytes -= entry.size
+
+    def _put_local(self, key: str, item: dict[str, Any], expires_at: float, size: int) -> None:
+        if self._local_ttl is not None:
+            expires_at = min(expires_at, time.time() + self._local_ttl)
+        self._pop_local(key)
+        self._entries[key] = _Entry(expires_at, item, size)
+        self._num_bytes += size
+        while self._entries and (len(self._entries) > self._capacity or self._num_bytes > self._max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._num_bytes -= evicted.size
+            self.stats.evictions += 1
+
+    async def get_many(self, keys: Iterable[str]) -> dict[str, dict[str, Any]]:
+        """Gets the cached items for some keys.
+
+        Args:
+            keys: The keys to look up.
+
+        Returns:
+            Copies of the items which were cached, keyed by key.
+        """
+        now = time.time()
+        hits: dict[str, dict[str, Any]] = {}
+        misses: list[str] = []
+        found: EncodedEntries = {}
+        for key in dict.fromkeys(keys):
+            if (entry := self._entries.get(key)) is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                hits[key] = dict(entry.item)
+                continue
+            if entry is not None:
+                self._pop_local(key)
+                self.stats.expirations += 1
+            misses.append(key)
+
+        if misses and self._backend is not None:
+            try:
+                found = await self._backend.get_many(misses)
+            except Exception:
+                logger.exception("Failed to read from the shared item cache")
+            for key, (expires_at, value) in found.items():
+                item = json.loads(value)
+                self._put_local(key, item, expires_at, len(value))
+                hits[key] = dict(item)
+
+        self.stats.hits += len(hits)
+        self.stats.misses += len(misses) - len(found)
+        return hits
+
+    async def put_many(self, items: Mapping[str, dict[str, Any]], read_at: float) -> None:
+        """Caches items which were just read.
+
+        Items which were invalidated after they were read are skipped, so
+        that a slow read which raced with a write doesn't cache the old row.
+
+        Args:
+            items: The raw items, keyed by key.
+            read_at: The time just before the items were read.
+        """
+        now = time.time()
+        self.stats.record_load(now - read_at)
+        entries: EncodedEntries = {}
+        for key, item in items.items():
+            if (ttl := self._ttls.get(str(item.get("type")))) is None:
+                continue
+            if (invalidated_at := self._invalidated_at.get(key)) is not None and invalidated_at >= read_at:
+                continue
+            value = encode_item(item)
+            entries[key] = (now + ttl, value)
+            self._put_local(key, dict(item), now + ttl, len(value))
+
+        if entries and self._backend is not None:
+            try:
+                await self._backend.put_many(entries, read_at)
+            except Exception:
+                logger.exception("Failed to write to the shared item cache")
+
+    async def invalidate(self, keys: Iterable[str]) -> None:
+        """Drops cached items after they were written.
+
+        Args:
+            keys: The keys which were written.
+        """
+        now = time.time()
+        keys = list(dict.fromkeys(keys))
+        for key in keys:
+            self._invalidated_at.put(key, now)
+            self._pop_local(key)
+
+        if keys and self._backend is not None:
+            try:
+                await self._backend.delete_many(keys)
+            except Exception:
+                logger.exception("Failed to invalidate the shared item cache")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._num_bytes = 0
+
+    async def close(self) -> None:
+        if self._backend is not None:
+            await self._backend.close()
+
+
+def get_item_cache_backend() -> ItemCacheBackend | None:
+    match settings.cache.backend:
+        case "memory":
+            return None
+        case "sqlite":
+            return SQLiteItemCacheBackend(settings.cache.sqlite_path)
+        case _:
+            raise ValueError(f"Invalid item cache backend: {settings.cache.backend}")
+
+
+item_cache = ItemCache(
+    ttls=settings.cache.ttl_seconds,
+    capacity=settings.cache.capacity,
+    max_bytes=settings.cache.max_bytes,
+    local_ttl=None if settings.cache.backend == "memory" else settings.cache.local_ttl_seconds,
+    backend=get_item_cache_backend(),
+    name="items",
+)
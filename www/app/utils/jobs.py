@@ -0,0 +1,534 @@
+"""Defines a background job queue for slow, CPU-heavy request work.
+
+Request handlers submit a job with a JSON payload and return immediately,
+and a bounded number of worker tasks pick jobs up and run the handler which
+was registered for the job's kind. Job state lives in a pluggable backend:
+
+- `MemoryJobQueue` keeps jobs in the current process, which is enough for a
+  single worker and for tests.
+- `SQLiteJobQueue` keeps jobs in a SQLite file, so that every worker process
+  on a host can see and run the same jobs.
+
+Claiming a job takes out a lease on it, which the runner renews while the
+handler runs. If the worker dies, the lease expires and another worker
+claims the job again, up to `max_attempts` times. If the handler raises, the
+job is queued again after a backoff, also up to `max_attempts` times, unless
+the error is one of the kind's permanent errors. Finished jobs are pruned
+after `retention_seconds`.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Literal, Self
+
+from pydantic import BaseModel
+
+from www.settings import settings
+from www.utils import new_uuid
+
+logger = logging.getLogger(__name__)
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+JobHandler = Callable[[dict[str, Any]], Awaitable[dict[str, Any] | None]]
+
+JobFailureHandler = Callable[[dict[str, Any]], Awaitable[None]]
+
+TERMINAL_STATUSES: set[JobStatus] = {"succeeded", "failed"}
+
+LEASE_COLUMNS = {
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "lease_id": "TEXT",
+    "lease_expires_at": "REAL",
+}
+
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    payload: dict[str, Any]
+    user_id: str | None = None
+    status: JobStatus = "queued"
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    created_at: float
+    updated_at: float
+    attempts: int = 0
+    lease_id: str | None = None
+    lease_expires_at: float | None = None
+
+    def claim(self, lease_seconds: float) -> None:
+        now = time.time()
+        self.status, self.updated_at, self.attempts = "running", now, self.attempts + 1
+        self.lease_id, self.lease_expires_at = new_uuid(), now + lease_seconds
+
+    def is_claimable(self, now: float) -> bool:
+        # Queued jobs which are waiting to be retried are held until their
+        # retry time, the same way running jobs are held by their lease.
+        if self.status == "queued":
+            return self.lease_expires_at is None or self.lease_expires_at < now
+        return self.status == "running" and self.lease_expires_at is not None and self.lease_expires_at < now
+
+    @classmethod
+    def create(cls, kind: str, payload: dict[str, Any], user_id: str | None = None) -> Self:
+        now = time.time()
+        return cls(id=new_uuid(), kind=kind, payload=payload, user_id=user_id, created_at=now, updated_at=now)
+
+
+class JobQueue(ABC):
+    """Defines the interface for storing and claiming jobs."""
+
+    @abstractmethod
+    async def put(self, job: Job) -> None:
+        """Adds a new job to the queue."""
+
+    @abstractmethod
+    async def claim(self, lease_seconds: float) -> Job | None:
+        """Leases the oldest claimable job, if there is one."""
+
+    @abstractmethod
+    async def renew(self, job: Job, lease_seconds: float) -> bool:
+        """Extends the lease on a running job, returning False if it was lost."""
+
+    @abstractmethod
+    async def update(self, job: Job) -> bool:
+        """Saves the status, result and error of a job, returning False if its lease was lost."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Job | None:
+        """Gets a job by ID."""
+
+    @abstractmethod
+    async def prune(self, before: float) -> int:
+        """Deletes finished jobs last updated before a given time, returning how many were deleted."""
+
+    async def close(self) -> None:
+        """Releases any resources held by the queue."""
+
+
+class MemoryJobQueue(JobQueue):
+    def __init__(self) -> None:
+        super().__init__()
+
+        self._jobs: dict[str, Job] = {}
+
+    async def put(self, job: Job) -> None:
+        self._jobs[job.id] = job.model_copy()
+
+    async def claim(self, lease_seconds: float) -> Job | None:
+        now = time.time()
+        claimable = [job for job in self._jobs.values() if job.is_claimable(now)]
+        if not claimable:
+            return None
+        job = min(claimable, key=lambda job: job.created_at)
+        job.claim(lease_seconds)
+        return job.model_copy()
+
+    async def renew(self, job: Job, lease_seconds: float) -> bool:
+        stored = self._jobs.get(job.id)
+        if stored is None or stored.status != "running" or stored.lease_id != job.lease_id:
+            return False
+        stored.lease_expires_at = job.lease_expires_at = time.time() + lease_seconds
+        return True
+
+    async def update(self, job: Job) -> bool:
+        stored = self._jobs.get(job.id)
+        if stored is None or stored.lease_id != job.lease_id:
+            return False
+        self._jobs[job.id] = job.model_copy()
+        return True
+
+    async def get(self, job_id: str) -> Job | None:
+        job = self._jobs.get(job_id)
+        return None if job is None else job.model_copy()
+
+    async def prune(self, before: float) -> int:
+        pruned = [job.id for job in self._jobs.values() if job.status in TERMINAL_STATUSES and job.updated_at < before]
+        for job_id in pruned:
+            del self._jobs[job_id]
+        return len(pruned)
+
+
+class SQLiteJobQueue(JobQueue):
+    """Stores jobs in a SQLite database.
+
+    SQLite calls are blocking, so they run in a thread. Claims happen inside
+    an immediate transaction, so each job is claimed by exactly one worker
+    even when several processes share the database file.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        super().__init__()
+
+        self._path = Path(path)
+        self._conn: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None, timeout=30.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    user_id TEXT,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_id TEXT,
+                    lease_expires_at REAL
+                )
+                """)
+            # Adds the lease columns to databases created before they existed.
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, declaration in LEASE_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {declaration}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_index ON jobs (status, created_at)")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:  # noqa: ANN401
+        async with self._lock:
+            return await asyncio.to_thread(lambda: func(self._connect()))
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            kind=row["kind"],
+            payload=json.loads(row["payload"]),
+            user_id=row["user_id"],
+            status=row["status"],
+            result=None if row["result"] is None else json.loads(row["result"]),
+            error=row["error"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            attempts=row["attempts"],
+            lease_id=row["lease_id"],
+            lease_expires_at=row["lease_expires_at"],
+        )
+
+    async def put(self, job: Job) -> None:
+        def put(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                """
+                INSERT INTO jobs (id, kind, payload, user_id, status, result, error, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    job.id,
+                    job.kind,
+                    json.dumps(job.payload),
+                    job.user_id,
+                    job.status,
+                    None if job.result is None else json.dumps(job.result),
+                    job.error,
+                    job.created_at,
+                    job.updated_at,
+                ),
+            )
+
+        await self._run(put)
+
+    async def claim(self, lease_seconds: float) -> Job | None:
+        def claim(conn: sqlite3.Connection) -> Job | None:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    """
+                    SELECT * FROM jobs
+                    WHERE (status = 'queued' AND (lease_expires_at IS NULL OR lease_expires_at < ?))
+                    OR (status = 'running' AND lease_expires_at < ?)
+                    ORDER BY created_at LIMIT 1
+                    """,
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                job = self._to_job(row)
+                job.claim(lease_seconds)
+                conn.execute(
+                    """
+                    UPDATE jobs SET status = ?, updated_at = ?, attempts = ?, lease_id = ?, lease_expires_at = ?
+                    WHERE id = ?
+                    """,
+                    (job.status, job.updated_at, job.attempts, job.lease_id, job.lease_expires_at, job.id),
+                )
+                conn.execute("COMMIT")
+                return job
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        return await self._run(claim)
+
+    async def renew(self, job: Job, lease_seconds: float) -> bool:
+        lease_expires_at = time.time() + lease_seconds
+
+        def renew(conn: sqlite3.Connection) -> bool:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND lease_id = ? AND status = 'running'",
+                (lease_expires_at, job.id, job.lease_id),
+            )
+            return cursor.rowcount > 0
+
+        if renewed := await self._run(renew):
+            job.lease_expires_at = lease_expires_at
+        return renewed
+
+    async def update(self, job: Job) -> bool:
+        def update(conn: sqlite3.Connection) -> bool:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, lease_expires_at = ?
+                WHERE id = ? AND lease_id IS ?
+                """,
+                (
+                    job.status,
+                    None if job.result is None else json.dumps(job.result),
+                    job.error,
+                    job.updated_at,
+                    job.lease_expires_at,
+                    job.id,
+                    job.lease_id,
+                ),
+            )
+            return cursor.rowcount > 0
+
+        return await self._run(update)
+
+    async def get(self, job_id: str) -> Job | None:
+        def get(conn: sqlite3.Connection) -> Job | None:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return None if row is None else self._to_job(row)
+
+        return await self._run(get)
+
+    async def prune(self, before: float) -> int:
+        def prune(conn: sqlite3.Connection) -> int:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+                (before,),
+            )
+            return cursor.rowcount
+
+        return await self._run(prune)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            conn.close()
+
+
+def get_job_queue() -> JobQueue:
+    match settings.jobs.backend:
+        case "memory":
+            return MemoryJobQueue()
+        case "sqlite":
+            return SQLiteJobQueue(settings.jobs.sqlite_path)
+        case _:
+            raise ValueError(f"Invalid job queue backend: {settings.jobs.backend}")
+
+
+class JobRunner:
+    """Runs queued jobs on a fixed number of worker tasks."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self._queue: JobQueue | None = None
+        self._handlers: dict[str, JobHandler] = {}
+        self._failure_handlers: dict[str, JobFailureHandler] = {}
+        self._permanent_errors: dict[str, tuple[type[Exception], ...]] = {}
+        self._workers: list[asyncio.Task[None]] = []
+        self._wakeup = asyncio.Event()
+        self._pruned_at = 0.0
+
+    @property
+    def queue(self) -> JobQueue:
+        if self._queue is None:
+            self._queue = get_job_queue()
+        return self._queue
+
+    def register(
+        self,
+        kind: str,
+        handler: JobHandler,
+        on_failure: JobFailureHandler | None = None,
+        *,
+        permanent_errors: tuple[type[Exception], ...] = (),
+    ) -> None:
+        """Registers the handler for a kind of job.
+
+        Args:
+            kind: The kind of job.
+            handler: Runs the job, given its payload, and returns its result.
+                It may run more than once, so it should be safe to retry.
+            on_failure: If set, called with the payload once the job has
+                failed for good, including when its workers kept dying
+                before it could finish, to clean up after it.
+            permanent_errors: Errors which fail the job straight away, such
+                as invalid input. Other errors are retried.
+        """
+        self._handlers[kind] = handler
+        if on_failure is not None:
+            self._failure_handlers[kind] = on_failure
+        self._permanent_errors[kind] = permanent_errors
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(settings.jobs.concurrency)]
+
+    async def close(self) -> None:
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self._queue is not None:
+            queue, self._queue = self._queue, None
+            await queue.close()
+
+    async def submit(self, kind: str, payload: dict[str, Any], user_id: str | None = None) -> Job:
+        """Adds a job to the queue.
+
+        Args:
+            kind: The kind of job, which selects the handler to run.
+            payload: The JSON-serializable arguments for the handler.
+            user_id: The user who the job belongs to, if any.
+
+        Returns:
+            The queued job.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+        job = Job.create(kind, payload, user_id)
+        await self.queue.put(job)
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Job | None:
+        return await self.queue.get(job_id)
+
+    async def watch(self, job_id: str) -> AsyncIterator[Job]:
+        """Yields a job each time its status changes, until it finishes.
+
+        Jobs may be run by other processes, so this polls the queue instead
+        of waiting on in-process notifications.
+
+        Args:
+            job_id: The job to watch.
+
+        Yields:
+            The job, whenever its status changes.
+        """
+        last_status: JobStatus | None = None
+        while (job := await self.queue.get(job_id)) is not None:
+            if job.status != last_status:
+                last_status = job.status
+                yield job
+            if job.status in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(settings.jobs.poll_seconds)
+
+    async def _heartbeat(self, job: Job) -> None:
+        # Returns once the lease is lost, for example because this worker
+        # stalled for so long that another one claimed the job.
+        while True:
+            await asyncio.sleep(settings.jobs.lease_seconds / 3)
+            try:
+                if not await self.queue.renew(job, settings.jobs.lease_seconds):
+                    return
+            except Exception:
+                logger.exception("Failed to renew the lease on job %s", job.id)
+
+    async def _handle(self, job: Job) -> None:
+        try:
+            if job.attempts > settings.jobs.max_attempts:
+                raise RuntimeError(f"Job was interrupted after {job.attempts - 1} attempts")
+            if (handler := self._handlers.get(job.kind)) is None:
+                raise ValueError(f"No handler registered for job kind: {job.kind}")
+            job.result = await handler(job.payload)
+            job.status, job.error, job.lease_expires_at = "succeeded", None, None
+        except Exception as e:
+            if job.attempts < settings.jobs.max_attempts and not isinstance(
+                e, self._permanent_errors.get(job.kind, ())
+            ):
+                delay = settings.jobs.retry_seconds * 2 ** (job.attempts - 1)
+                logger.warning("Job %s failed; retrying in %.1f seconds", job.id, delay, exc_info=True)
+                job.status, job.error, job.lease_expires_at = "queued", str(e), time.time() + delay
+                return
+            logger.exception("Job %s failed", job.id)
+            job.status, job.error, job.lease_expires_at = "failed", str(e), None
+            if (on_failure := self._failure_handlers.get(job.kind)) is not None:
+                try:
+                    await on_failure(job.payload)
+                except Exception:
+                    logger.exception("Failed to clean up after job %s", job.id)
+
+    async def _run_job(self, job: Job) -> None:
+        logger.info("Running %s job %s (attempt %d)", job.kind, job.id, job.attempts)
+        handle_task = asyncio.create_task(self._handle(job))
+        heartbeat_task = asyncio.create_task(self._heartbeat(job))
+        try:
+            await asyncio.wait([handle_task, heartbeat_task], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            heartbeat_task.cancel()
+            if not handle_task.done():
+                handle_task.cancel()
+            await asyncio.gather(handle_task, heartbeat_task, return_exceptions=True)
+        if not handle_task.done() or handle_task.cancelled():
+            logger.warning("Lost the lease on job %s; leaving it to the worker which claimed it", job.id)
+            return
+        job.updated_at = time.time()
+        if not await self.queue.update(job):
+            logger.warning("Lost the lease on job %s before saving its result", job.id)
+
+    async def _prune(self) -> None:
+        now = time.time()
+        if now - self._pruned_at < settings.jobs.prune_interval_seconds:
+            return
+        self._pruned_at = now
+        try:
+            if num_pruned := await self.queue.prune(now - settings.jobs.retention_seconds):
+                logger.info("Pruned %d finished jobs", num_pruned)
+        except Exception:
+            logger.exception("Failed to prune finished jobs")
+
+    async def _work(self) -> None:
+        while True:
+            # Cleared before claiming, so that a job submitted in between is
+            # not missed until the next poll.
+            self._wakeup.clear()
+            try:
+                job = await self.queue.claim(settings.jobs.lease_seconds)
+            except Exception:
+                logger.exception("Failed to claim a job")
+                job = None
+            if job is None:
+                await self._prune()
+                # Sleeps until a job is submitted locally, or until the next
+                # poll for jobs submitted by other processes.
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.jobs.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_job(job)
+
+
+job_runner = JobRunner()
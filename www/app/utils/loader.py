@@ -0,0 +1,81 @@
+"""Defines a request-scoped loader which batches and memoizes item reads.
+
+Rendering one response often reads the same rows several times from
+different places, like the creator of every artifact in a listing. The
+loader collects the IDs requested within one event loop iteration, reads
+them with a single batched request, and remembers the results for the rest
+of the request, so each row is read at most once.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Iterable
+
+BatchLoadFunction = Callable[[list[str]], Awaitable[dict[str, dict[str, Any]]]]
+
+
+class ItemLoader:
+    """Coalesces and memoizes reads of raw items by ID.
+
+    Args:
+        batch_load: Reads a batch of items, returning the ones which exist,
+            keyed by ID.
+    """
+
+    def __init__(self, batch_load: BatchLoadFunction) -> None:
+        super().__init__()
+
+        self._batch_load = batch_load
+        self._items: dict[str, asyncio.Future[dict[str, Any] | None]] = {}
+        self._queue: list[tuple[str, asyncio.Future[dict[str, Any] | None]]] = []
+        self._tasks: set[asyncio.Task[None]] = set()
+        self.num_batches = 0
+
+    async def load(self, item_id: str) -> dict[str, Any] | None:
+        """Loads an item, batching it with other loads in the same iteration.
+
+        Args:
+            item_id: The ID of the item to load.
+
+        Returns:
+            A copy of the raw item, or None if it doesn't exist.
+        """
+        if (future := self._items.get(item_id)) is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._items[item_id] = future
+            self._queue.append((item_id, future))
+            if len(self._queue) == 1:
+                loop.call_soon(self._start_dispatch)
+        item = await asyncio.shield(future)
+        return None if item is None else dict(item)
+
+    async def load_many(self, item_ids: Iterable[str]) -> list[dict[str, Any] | None]:
+        return await asyncio.gather(*(self.load(item_id) for item_id in item_ids))
+
+    def clear(self, item_id: str) -> None:
+        """Forgets an item, so that the next load reads it again."""
+        self._items.pop(item_id, None)
+
+    def _start_dispatch(self) -> None:
+        # Runs after every callback which is already scheduled, so that loads
+        # from all the tasks which are ready in this iteration are batched.
+        task = asyncio.create_task(self._dispatch())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self) -> None:
+        futures, self._queue = self._queue, []
+        self.num_batches += 1
+        try:
+            items = await self._batch_load([item_id for item_id, _ in futures])
+        except Exception as e:
+            # Failed reads aren't remembered, so they can be retried.
+            for item_id, future in futures:
+                if self._items.get(item_id) is future:
+                    self._items.pop(item_id)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for item_id, future in futures:
+            if not future.done():
+                future.set_result(items.get(item_id))
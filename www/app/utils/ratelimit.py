@@ -0,0 +1,36 @@
+"""Defines a simple rate limiter for paced background work.
+
+Long-running maintenance jobs like the orphan reconciler make a lot of AWS
+calls back to back, which can eat into the table's provisioned throughput
+and the bucket's request rate. Each call waits on a shared `RateLimiter` so
+that the job stays under a fixed number of requests per second.
+"""
+
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` happen per second.
+
+    Args:
+        rate: The maximum number of calls per second, or None for no limit.
+    """
+
+    def __init__(self, rate: float | None) -> None:
+        super().__init__()
+
+        self._interval = 0.0 if rate is None else 1.0 / rate
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        """Waits until the next call is allowed."""
+        if self._interval <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_time > now:
+                await asyncio.sleep(self._next_time - now)
+                now = self._next_time
+            self._next_time = now + self._interval
@@ -0,0 +1,192 @@
+"""Defines an in-process full-text search index for listings.
+
+The index maps case-folded tokens from each listing's name, description and
+tags to the listings that contain them, so that searches can be answered
+from memory instead of filtering the whole table in DynamoDB. Each worker
+process builds its own copy on startup and keeps it up to date as listings
+are written.
+"""
+
+import bisect
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Callable
+
+from www.app.model import Listing
+
+logger = logging.getLogger(__name__)
+
+NAME_WEIGHT = 3.0
+TAG_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+PREFIX_MATCH_WEIGHT = 0.5
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str | None) -> list[str]:
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.casefold())
+
+
+@dataclass
+class _Document:
+    listing: Listing
+    tags: list[str]
+    weights: dict[str, float] = field(default_factory=dict)
+
+
+class ListingSearchIndex:
+    """A tokenized, case-folded inverted index over listings.
+
+    Queries match listings which contain every query term, either exactly or
+    as a prefix of some token. Results are ranked by the sum of each term's
+    best field weight times its inverse document frequency, with prefix
+    matches counting for less than exact ones.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.ready = False
+        self._docs: dict[str, _Document] = {}
+        self._postings: dict[str, dict[str, float]] = {}
+        self._vocab: list[str] = []
+        self._replay: list[Callable[[], None]] | None = None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, listing_id: str) -> bool:
+        return listing_id in self._docs
+
+    def _record(self, op: Callable[[], None]) -> None:
+        # Writes that happen while a rebuild is reading from the database are
+        # replayed on top of the rebuilt index, so they don't get lost.
+        if self._replay is not None:
+            self._replay.append(op)
+        op()
+
+    def _add(self, listing: Listing, tags: list[str] | None) -> None:
+        if tags is None:
+            tags = self._docs[listing.id].tags if listing.id in self._docs else []
+        self._remove(listing.id)
+
+        weights: dict[str, float] = {}
+        for text, weight in ((listing.name, NAME_WEIGHT), (listing.description, DESCRIPTION_WEIGHT)):
+            for token in tokenize(text):
+                weights[token] = max(weights.get(token, 0.0), weight)
+        for token in (token for tag in tags for token in tokenize(tag)):
+            weights[token] = max(weights.get(token, 0.0), TAG_WEIGHT)
+
+        self._docs[listing.id] = _Document(listing=listing, tags=list(tags), weights=weights)
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                bisect.insort(self._vocab, token)
+            self._postings[token][listing.id] = weight
+
+    def _remove(self, listing_id: str) -> None:
+        if (doc := self._docs.pop(listing_id, None)) is None:
+            return
+        for token in doc.weights:
+            postings = self._postings[token]
+            postings.pop(listing_id, None)
+            if not postings:
+                del self._postings[token]
+                del self._vocab[bisect.bisect_left(self._vocab, token)]
+
+    def _increment(self, listing_id: str, field_name: str, amount: int) -> None:
+        if (doc := self._docs.get(listing_id)) is None:
+            return
+        setattr(doc.listing, field_name, getattr(doc.listing, field_name) + amount)
+
+    def add(self, listing: Listing, tags: list[str] | None = None) -> None:
+        """Adds or replaces a listing.
+
+        Args:
+            listing: The listing to index.
+            tags: The listing's tags, or None to keep its existing tags.
+        """
+        self._record(lambda: self._add(listing, tags))
+
+    def remove(self, listing_id: str) -> None:
+        self._record(lambda: self._remove(listing_id))
+
+    def increment(self, listing_id: str, field_name: str, amount: int) -> None:
+        """Increments a counter, like `views` or `score`, on an indexed listing."""
+        self._record(lambda: self._increment(listing_id, field_name, amount))
+
+    def begin_rebuild(self) -> None:
+        """Starts recording writes, before reading the listings to rebuild from."""
+        self._replay = []
+
+    def finish_rebuild(self, listings: list[Listing], tags: dict[str, list[str]]) -> None:
+        """Replaces the index contents with a fresh snapshot.
+
+        Args:
+            listings: All listings.
+            tags: Mapping from listing ID to that listing's tags.
+        """
+        replay, self._replay = self._replay or [], None
+        self._docs, self._postings, self._vocab = {}, {}, []
+        for listing in listings:
+            self._add(listing, tags.get(listing.id, []))
+        for op in replay:
+            op()
+        self.ready = True
+        logger.info("Built search index with %d listings and %d tokens", len(self._docs), len(self._vocab))
+
+    def abort_rebuild(self) -> None:
+        self._replay = None
+
+    def _expand(self, term: str) -> list[tuple[str, float]]:
+        matches: list[tuple[str, float]] = []
+        for i in range(bisect.bisect_left(self._vocab, term), len(self._vocab)):
+            token = self._vocab[i]
+            if not token.startswith(term):
+                break
+            matches.append((token, 1.0 if token == term else PREFIX_MATCH_WEIGHT))
+        return matches
+
+    def search(self, query: str) -> list[tuple[Listing, float]]:
+        """Finds the listings which match a query.
+
+        Args:
+            query: The search query.
+
+        Returns:
+            The matching listings and their relevance scores, most relevant
+            first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return [(doc.listing, 0.0) for doc in self._docs.values()]
+
+        num_docs = len(self._docs)
+        scores: dict[str, float] | None = None
+        for term in dict.fromkeys(terms):
+            term_scores: dict[str, float] = {}
+            for token, match_weight in self._expand(term):
+                postings = self._postings[token]
+                idf = math.log(1 + num_docs / len(postings))
+                for listing_id, field_weight in postings.items():
+                    score = field_weight * match_weight * idf
+                    if score > term_scores.get(listing_id, 0.0):
+                        term_scores[listing_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {k: v + term_scores[k] for k, v in scores.items() if k in term_scores}
+            if not scores:
+                return []
+
+        assert scores is not None
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(self._docs[listing_id].listing, score) for listing_id, score in ranked]
+
+
+listing_search_index = ListingSearchIndex()
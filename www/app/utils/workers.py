@@ -0,0 +1,112 @@
+"""Defines a process-wide pool of worker processes for CPU-heavy work.
+
+Image resizing, mesh conversion and similar steps of artifact ingestion are
+pure CPU work, so running them on the event loop would stall every other
+request on the worker. Instead they are submitted to this pool, and the
+request handlers just await the result.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, TypeVar
+
+from www.settings import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ProcessPool:
+    """Runs functions in a pool of worker processes.
+
+    A worker which runs past its timeout can't be interrupted, so instead
+    the whole pool is retired: new calls go to a fresh pool, and the old
+    pool's processes are killed as soon as no other caller is waiting on
+    them. This way a few hung calls can't use up every worker.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self._executor: ProcessPoolExecutor | None = None
+        self._num_waiting: dict[ProcessPoolExecutor, int] = {}
+        self._retired: set[ProcessPoolExecutor] = set()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawn rather than fork, since the parent has live event loop
+            # and connection pool threads.
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.artifact.worker_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _retire(self, executor: ProcessPoolExecutor) -> None:
+        if self._executor is executor:
+            self._executor = None
+        self._retired.add(executor)
+
+    def _release(self, executor: ProcessPoolExecutor) -> None:
+        self._num_waiting[executor] -= 1
+        if self._num_waiting[executor] > 0:
+            return
+        del self._num_waiting[executor]
+        if executor in self._retired:
+            self._retired.discard(executor)
+            _kill_executor(executor)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            executor.shutdown(wait=False, cancel_futures=True)
+        for executor in self._retired:
+            _kill_executor(executor)
+        self._retired.clear()
+
+    async def run(self, func: Callable[..., T], *args: Any, timeout: float) -> T:  # noqa: ANN401
+        """Runs a function in a worker process.
+
+        Args:
+            func: The function to run. It and its arguments must be picklable.
+            args: The arguments to pass to the function.
+            timeout: The number of seconds to wait for the result. After a
+                timeout, the worker is killed once no other call is using
+                its pool.
+
+        Returns:
+            The function's return value.
+
+        Raises:
+            asyncio.TimeoutError: If the function doesn't finish in time.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        self._num_waiting[executor] = self._num_waiting.get(executor, 0) + 1
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(executor, func, *args), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Worker process timed out after %.1f seconds; replacing the pool", timeout)
+            self._retire(executor)
+            raise
+        except BrokenProcessPool:
+            logger.exception("Worker process pool died; restarting it")
+            self._retire(executor)
+            raise
+        finally:
+            self._release(executor)
+
+
+def _kill_executor(executor: ProcessPoolExecutor) -> None:
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.kill()
+
+
+process_pool = ProcessPool()
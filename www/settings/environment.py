@@ -16,9 +16,12 @@ class OauthSettings:
 @dataclass
 class CryptoSettings:
     cache_token_db_result_seconds: int = field(default=30)
+    cache_token_db_miss_seconds: int = field(default=5)
+    cache_token_db_capacity: int = field(default=2**14)
     expire_otp_minutes: int = field(default=10)
     jwt_secret: str = field(default=MISSING)
     algorithm: str = field(default="HS256")
+    stream_token_seconds: int = field(default=60)
 
 
 @dataclass
@@ -45,17 +48,94 @@ class ArtifactSettings:
     max_bytes: int = field(default=1536 * 1536 * 25)
     quality: int = field(default=80)
     max_concurrent_file_uploads: int = field(default=3)
+    worker_processes: int = field(default=2)
+    image_timeout_seconds: float = field(default=30.0)
+    archive_member_timeout_seconds: float = field(default=60.0)
+    archive_members_in_flight: int = field(default=4)
+    content_addressed: bool = field(default=False)
+    blob_deletion_timeout_seconds: float = field(default=30.0)
 
 
 @dataclass
 class S3Settings:
     bucket: str = field(default=II("oc.env:S3_BUCKET"))
     prefix: str = field(default=II("oc.env:S3_PREFIX"))
+    multipart_part_size: int = field(default=8 * 1024 * 1024)
+    multipart_concurrency: int = field(default=4)
+    presigned_part_size: int = field(default=64 * 1024 * 1024)
+    presigned_part_batch_size: int = field(default=100)
+    presigned_url_expire_seconds: int = field(default=60 * 60)
+    finalize_grace_seconds: int = field(default=15 * 60)
+    abandoned_upload_seconds: int = field(default=24 * 60 * 60)
+    delete_concurrency: int = field(default=4)
+    delete_max_attempts: int = field(default=5)
+    delete_retry_seconds: float = field(default=0.1)
+
+
+@dataclass
+class AWSSettings:
+    max_pool_connections: int = field(default=50)
+    keepalive_timeout: float = field(default=60.0)
+    connect_timeout: float = field(default=5.0)
+    read_timeout: float = field(default=30.0)
+
+
+@dataclass
+class SearchSettings:
+    refresh_seconds: float = field(default=300.0)
+
+
+@dataclass
+class JobSettings:
+    backend: str = field(default="memory")
+    sqlite_path: str = field(default="jobs.sqlite3")
+    concurrency: int = field(default=2)
+    poll_seconds: float = field(default=1.0)
+    lease_seconds: float = field(default=60.0)
+    max_attempts: int = field(default=3)
+    retry_seconds: float = field(default=10.0)
+    retention_seconds: float = field(default=7 * 24 * 60 * 60)
+    prune_interval_seconds: float = field(default=60 * 60)
+
+
+@dataclass
+class ReconcileSettings:
+    scan_segments: int = field(default=8)
+    requests_per_second: float | None = field(default=20.0)
+    grace_seconds: int = field(default=24 * 60 * 60)
+    checkpoint_path: str = field(default="reconcile.checkpoint.json")
 
 
 @dataclass
 class DynamoSettings:
     table_name: str = field(default=MISSING)
+    batch_write_concurrency: int = field(default=4)
+    batch_get_concurrency: int = field(default=4)
+    query_concurrency: int = field(default=8)
+    batch_max_attempts: int = field(default=8)
+    batch_retry_seconds: float = field(default=0.05)
+    type_index_shards: int = field(default=8)
+    backfill_segments: int = field(default=8)
+    backfill_requests_per_second: float | None = field(default=50.0)
+
+
+@dataclass
+class CacheSettings:
+    backend: str = field(default="memory")
+    sqlite_path: str = field(default="cache.sqlite3")
+    capacity: int = field(default=2**14)
+    max_bytes: int = field(default=64 * 1024 * 1024)
+    local_ttl_seconds: float = field(default=5.0)
+    ttl_seconds: dict[str, float] = field(
+        default_factory=lambda: {
+            "User": 60.0,
+            "Listing": 30.0,
+            "ListingTag": 300.0,
+            "featured_listings": 60.0,
+        }
+    )
+    listings_page_seconds: float = field(default=10.0)
+    listings_page_stale_seconds: float = field(default=60.0)
 
 
 @dataclass
@@ -69,6 +149,10 @@ class CloudFrontSettings:
     domain: str = field(default=II("oc.env:CLOUDFRONT_DOMAIN"))
     key_id: str = field(default=II("oc.env:CLOUDFRONT_KEY_ID"))
     private_key: str = field(default=II("oc.env:CLOUDFRONT_PRIVATE_KEY"))
+    url_expire_days: float = field(default=180.0)
+    url_expiry_bucket_seconds: int = field(default=60 * 60 * 24)
+    signed_url_cache_size: int = field(default=2**16)
+    signing_mode: str = field(default="url")
 
 
 @dataclass
@@ -79,7 +163,12 @@ class EnvironmentSettings:
     email: EmailSettings = field(default_factory=EmailSettings)
     artifact: ArtifactSettings = field(default_factory=ArtifactSettings)
     s3: S3Settings = field(default_factory=S3Settings)
+    aws: AWSSettings = field(default_factory=AWSSettings)
     dynamo: DynamoSettings = field(default_factory=DynamoSettings)
+    search: SearchSettings = field(default_factory=SearchSettings)
+    jobs: JobSettings = field(default_factory=JobSettings)
+    reconcile: ReconcileSettings = field(default_factory=ReconcileSettings)
+    cache: CacheSettings = field(default_factory=CacheSettings)
     site: SiteSettings = field(default_factory=SiteSettings)
     cloudfront: CloudFrontSettings = field(default_factory=CloudFrontSettings)
     debug: bool = field(default=False)
@@ -1,13 +1,17 @@
 """Defines package-wide utility functions."""
 
+import asyncio
 import datetime
 import functools
 import hashlib
 import io
+import logging
+import time
 import uuid
+import weakref
 from collections import OrderedDict
 from pathlib import Path
-from typing import Awaitable, Callable, Generic, Hashable, ParamSpec, TypeVar, overload
+from typing import Any, Awaitable, Callable, Generic, Hashable, ParamSpec, Protocol, TypeVar, overload
 from xml.etree import ElementTree as ET
 
 from www.settings import settings
@@ -16,13 +20,119 @@ Tk = TypeVar("Tk", bound=Hashable)
 Tv = TypeVar("Tv")
 P = ParamSpec("P")
 
+logger = logging.getLogger(__name__)
+
+
+class CacheStats:
+    """Counts what happened to the lookups and loads in a cache."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+
+    def record_load(self, seconds: float) -> None:
+        self.loads += 1
+        self.load_seconds += seconds
+
+    def recount_hit_as_miss(self) -> None:
+        """Recounts the last hit as a miss, for caches which check entries themselves."""
+        self.hits -= 1
+        self.misses += 1
+
+    def recount_hit_as_expired(self) -> None:
+        """Recounts the last hit as a miss, for caches which check expiry themselves."""
+        self.recount_hit_as_miss()
+        self.expirations += 1
+
+
+class MeasuredCache(Protocol):
+    @property
+    def stats(self) -> CacheStats: ...
+
+    def __len__(self) -> int: ...
+
+
+# Caches which report metrics, by name. Weak references, so that registering
+# a short-lived cache doesn't keep it alive.
+_cache_registry: weakref.WeakValueDictionary[str, MeasuredCache] = weakref.WeakValueDictionary()
+
+# The Prometheus name, type and help text for each metric, keyed by stat.
+CACHE_METRICS: dict[str, tuple[str, str, str]] = {
+    "size": ("www_cache_entries", "gauge", "The number of entries in the cache."),
+    "hits": ("www_cache_hits_total", "counter", "Lookups which found a fresh entry."),
+    "stale_hits": ("www_cache_stale_hits_total", "counter", "Lookups which were served a stale entry."),
+    "misses": ("www_cache_misses_total", "counter", "Lookups which found no usable entry."),
+    "coalesced": ("www_cache_single_flight_waits_total", "counter", "Misses which waited on a load in flight."),
+    "refreshes": ("www_cache_refreshes_total", "counter", "Background refreshes of stale entries."),
+    "evictions": ("www_cache_evictions_total", "counter", "Entries evicted to stay under capacity."),
+    "expirations": ("www_cache_expirations_total", "counter", "Entries dropped because they expired."),
+}
+
+
+def register_cache(name: str, cache: MeasuredCache) -> None:
+    """Adds a cache to the metrics registry.
+
+    Args:
+        name: The name to report the cache under. A later cache with the
+            same name replaces the earlier one.
+        cache: The cache.
+    """
+    _cache_registry[name] = cache
+
+
+def get_cache_metrics() -> dict[str, dict[str, float]]:
+    """Gets the current size and counters of every registered cache.
+
+    Returns:
+        The metrics for each cache, keyed by cache name.
+    """
+    return {name: {"size": len(cache), **vars(cache.stats)} for name, cache in sorted(_cache_registry.items())}
+
+
+def render_cache_metrics() -> str:
+    """Renders the metrics of every registered cache in the Prometheus text format.
+
+    Returns:
+        The metrics, one sample per line.
+    """
+
+    def label(name: str) -> str:
+        escaped = name.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return f'{{cache="{escaped}"}}'
+
+    metrics = get_cache_metrics()
+    lines: list[str] = []
+    for stat, (metric, metric_type, help_text) in CACHE_METRICS.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {metric_type}"]
+        lines += [f"{metric}{label(name)} {values[stat]}" for name, values in metrics.items()]
+    lines += [
+        "# HELP www_cache_load_seconds Time spent loading values on misses.",
+        "# TYPE www_cache_load_seconds summary",
+    ]
+    for name, values in metrics.items():
+        lines.append(f"www_cache_load_seconds_sum{label(name)} {values['load_seconds']}")
+        lines.append(f"www_cache_load_seconds_count{label(name)} {values['loads']}")
+    return "\n".join(lines) + "\n"
+
 
 class LRUCache(Generic[Tk, Tv]):
-    def __init__(self, capacity: int) -> None:
+    def __init__(self, capacity: int, name: str | None = None) -> None:
         super().__init__()
 
         self.cache: OrderedDict[Tk, Tv] = OrderedDict()
         self.capacity = capacity
+        self.stats = CacheStats()
+        if name is not None:
+            register_cache(name, self)
 
     @overload
     def get(self, key: Tk) -> Tv | None: ...
@@ -32,8 +142,10 @@ class LRUCache(Generic[Tk, Tv]):
 
     def get(self, key: Tk, default: Tv | None = None) -> Tv | None:
         if key not in self.cache:
+            self.stats.misses += 1
             return None
         else:
+            self.stats.hits += 1
             self.cache.move_to_end(key)
             return self.cache[key]
 
@@ -48,6 +160,7 @@ class LRUCache(Generic[Tk, Tv]):
         self.cache.move_to_end(key)
         if len(self.cache) > self.capacity:
             self.cache.popitem(last=False)
+            self.stats.evictions += 1
 
     def pop(self, key: Tk) -> Tv:
         return self.cache.pop(key)
@@ -61,55 +174,134 @@ class LRUCache(Generic[Tk, Tv]):
         self.put(key, value)
 
 
-def cache_result(num_seconds: float, capacity: int = 2**16) -> Callable[[Callable[P, Tv]], Callable[P, Tv]]:
-    """Cache the result of a function for a certain number of seconds.
+class TTLCache(Generic[Tk, Tv]):
+    """An LRU cache whose entries expire a fixed time after they are added.
 
-    Usage:
-
-        ```python
-        @cache_result(num_seconds=60)
-        def expensive_function(arg):
-            ...
-        ```
+    Entries are fresh for `ttl` seconds, and then stale for another
+    `stale_ttl` seconds, during which they can still be served while they
+    are refreshed. Older entries are dropped whenever the cache is used,
+    oldest first, rather than waiting to be pushed out by newer entries.
 
     Args:
-        num_seconds: The number of seconds to cache the result.
-        capacity: The number of results to cache.
-
-    Returns:
-        A decorator that caches the result of the function.
+        ttl: The number of seconds an entry is fresh for.
+        capacity: The maximum number of entries.
+        stale_ttl: The number of seconds an entry can be served stale for.
+        name: If set, report metrics for the cache under this name.
     """
 
-    def decorator(func: Callable[P, Tv]) -> Callable[P, Tv]:
-        cache = LRUCache[str, tuple[datetime.datetime, Tv]](capacity)
+    def __init__(self, ttl: float, capacity: int, stale_ttl: float = 0.0, name: str | None = None) -> None:
+        super().__init__()
 
-        @functools.wraps(func)
-        def wrapper(*args: P.args, **kwargs: P.kwargs) -> Tv:
-            cur_time = datetime.datetime.now()
-            key = str((args, kwargs))
-            if key in cache:
-                last_time, result = cache[key]
-                if (cur_time - last_time).total_seconds() < num_seconds:
-                    return result
-            result = func(*args, **kwargs)
-            cache[key] = (cur_time, result)
-            return result
+        self.ttl = ttl
+        self.capacity = capacity
+        self.stale_ttl = stale_ttl
+        self.stats = CacheStats()
+        if name is not None:
+            register_cache(name, self)
 
-        return wrapper
+        # Entries in least-recently-used order, and their insertion times in
+        # insertion order, which is also expiry order since the TTL is fixed.
+        self._entries: OrderedDict[Tk, Tv] = OrderedDict()
+        self._added_at: OrderedDict[Tk, float] = OrderedDict()
 
-    return decorator
+    def __contains__(self, key: Tk) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.ttl - self.stale_ttl
+        while self._added_at:
+            key, added_at = next(iter(self._added_at.items()))
+            if added_at > cutoff:
+                break
+            self._added_at.popitem(last=False)
+            self._entries.pop(key)
+            self.stats.expirations += 1
+
+    def get(self, key: Tk) -> tuple[Tv, bool] | None:
+        """Looks up a key.
+
+        Args:
+            key: The key to look up.
+
+        Returns:
+            The value and whether it is still fresh, or None if the key
+            isn't cached.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        if key not in self._entries:
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        fresh = now - self._added_at[key] < self.ttl
+        if fresh:
+            self.stats.hits += 1
+        else:
+            self.stats.stale_hits += 1
+        return self._entries[key], fresh
+
+    def put(self, key: Tk, value: Tv) -> None:
+        now = time.monotonic()
+        self._expire(now)
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._added_at[key] = now
+        self._added_at.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            evicted, _ = self._entries.popitem(last=False)
+            self._added_at.pop(evicted)
+            self.stats.evictions += 1
+
+    def invalidate(self, key: Tk) -> None:
+        self._entries.pop(key, None)
+        self._added_at.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._added_at.clear()
+
+
+def _get_default_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> Hashable:
+    key = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return repr(key)
+    return key
+
+
+def _consume_exception(task: asyncio.Task[Any]) -> None:
+    # Marks the exception as retrieved, in case every caller went away.
+    if not task.cancelled():
+        task.exception()
 
 
 def cache_async_result(
     num_seconds: float,
     capacity: int = 2**16,
+    key: Callable[..., Hashable] | None = None,
+    stale_seconds: float = 0.0,
 ) -> Callable[[Callable[P, Awaitable[Tv]]], Callable[P, Awaitable[Tv]]]:
     """Cache the result of an async function for a certain number of seconds.
 
+    Concurrent calls with the same key share a single call to the wrapped
+    function, so an expired entry is only recomputed once. If
+    `stale_seconds` is set, expired entries keep being served for that
+    long while they are refreshed in the background.
+
+    The shared call, and any background refresh, run with the arguments of
+    whichever caller started them, possibly after that caller's request has
+    finished. The wrapped function shouldn't take request-scoped arguments,
+    like a request or a CRUD instance from a dependency, even if the key
+    function leaves them out; it should open its own resources instead.
+
     Usage:
 
         ```python
-        @cache_async_result(num_seconds=60)
+        @cache_async_result(num_seconds=60, stale_seconds=60)
         async def expensive_function(arg):
             ...
         ```
@@ -117,25 +309,60 @@ def cache_async_result(
     Args:
         num_seconds: The number of seconds to cache the result.
         capacity: The number of results to cache.
+        key: Builds the cache key from the function's arguments. By
+            default, the arguments themselves are the key.
+        stale_seconds: The number of seconds after an entry expires during
+            which it can still be served while it is refreshed.
 
     Returns:
         A decorator that caches the result of the function.
     """
 
     def decorator(func: Callable[P, Awaitable[Tv]]) -> Callable[P, Awaitable[Tv]]:
-        cache = LRUCache[str, tuple[datetime.datetime, Tv]](capacity)
+        cache = TTLCache[Hashable, Tv](
+            num_seconds,
+            capacity,
+            stale_seconds,
+            name=f"{func.__module__}.{func.__qualname__}",
+        )
+        inflight: dict[Hashable, asyncio.Task[Tv]] = {}
+
+        def load(cache_key: Hashable, refresh: bool, *args: P.args, **kwargs: P.kwargs) -> asyncio.Task[Tv]:
+            async def run() -> Tv:
+                start = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    if refresh:
+                        logger.exception("Failed to refresh the cached result of %s", func.__qualname__)
+                    raise
+                finally:
+                    inflight.pop(cache_key, None)
+                    cache.stats.record_load(time.perf_counter() - start)
+                cache.put(cache_key, result)
+                return result
+
+            task = asyncio.create_task(run())
+            task.add_done_callback(_consume_exception)
+            inflight[cache_key] = task
+            return task
 
         @functools.wraps(func)
         async def wrapper(*args: P.args, **kwargs: P.kwargs) -> Tv:
-            cur_time = datetime.datetime.now()
-            key = str((args, kwargs))
-            if key in cache:
-                last_time, result = cache[key]
-                if (cur_time - last_time).total_seconds() < num_seconds:
-                    return result
-            result = await func(*args, **kwargs)
-            cache[key] = (cur_time, result)
-            return result
+            cache_key = _get_default_key(args, kwargs) if key is None else key(*args, **kwargs)
+            if (entry := cache.get(cache_key)) is not None:
+                result, fresh = entry
+                if not fresh and cache_key not in inflight:
+                    cache.stats.refreshes += 1
+                    load(cache_key, True, *args, **kwargs)
+                return result
+            if (task := inflight.get(cache_key)) is not None:
+                cache.stats.coalesced += 1
+            else:
+                task = load(cache_key, False, *args, **kwargs)
+            # Shielded, so that a cancelled caller doesn't cancel the call
+            # which other callers are waiting on.
+            return await asyncio.shield(task)
 
         return wrapper
 